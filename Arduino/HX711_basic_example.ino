@@ -4,23 +4,90 @@
 const int LOADCELL_DOUT_PIN = 2;
 const int LOADCELL_SCK_PIN = 3;
 
+// Serial commands from the host
+//   'g' : poll, reply with one reading as "<value>\n"
+//   's' : start streaming, every conversion is sent as "<seq>,<value>\n"
+//   'b' : start binary streaming, every conversion is sent as one frame (see below)
+//   'x' : stop streaming
+// The sequence number is 16 bit and wraps, so the host can count lost samples.
+// 57600 baud leaves room for 80 SPS in streaming mode and matches the host.
+const long BAUD_RATE = 57600;
+
+// Binary frame, little endian, 11 bytes:
+//   0xA5 | seq (2) | raw 24 bit reading (3) | micros() (4) | crc8 of the 9 bytes in between
+const byte SYNC = 0xA5;
+const byte FRAME_SIZE = 11;
+
 HX711 scale;
+bool streaming = false;
+bool binary = false;
+unsigned int seq = 0;
 
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(BAUD_RATE);
   scale.begin(LOADCELL_DOUT_PIN, LOADCELL_SCK_PIN);
 }
 
+// CRC-8, polynomial 0x07, initial value 0
+byte crc8(const byte *data, byte len) {
+  byte crc = 0;
+  for (byte i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (byte bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame(long reading, unsigned long now) {
+  byte frame[FRAME_SIZE];
+  frame[0] = SYNC;
+  frame[1] = seq & 0xFF;
+  frame[2] = (seq >> 8) & 0xFF;
+  frame[3] = reading & 0xFF;
+  frame[4] = (reading >> 8) & 0xFF;
+  frame[5] = (reading >> 16) & 0xFF;
+  frame[6] = now & 0xFF;
+  frame[7] = (now >> 8) & 0xFF;
+  frame[8] = (now >> 16) & 0xFF;
+  frame[9] = (now >> 24) & 0xFF;
+  frame[10] = crc8(frame + 1, FRAME_SIZE - 2);
+  Serial.write(frame, FRAME_SIZE);
+}
+
+void handleCommand(char c) {
+  if (c == 'g') {
+    if (scale.wait_ready_timeout(1000)) {
+      Serial.println(scale.read() / 100);
+    } else {
+      Serial.println("HX711 not found.");
+    }
+  } else if (c == 's' || c == 'b') {
+    streaming = true;
+    binary = (c == 'b');
+    seq = 0;
+  } else if (c == 'x') {
+    streaming = false;
+  }
+}
+
 void loop() {
+  while (Serial.available() > 0) {
+    handleCommand(Serial.read());
+  }
 
-  if (scale.is_ready()) {
+  // no delay: send each conversion as soon as the HX711 has it (10 or 80 SPS)
+  if (streaming && scale.is_ready()) {
+    unsigned long now = micros();
     long reading = scale.read();
-    //Serial.print("HX711 reading: ");
-    Serial.println(reading/100);
-  } else {
-    Serial.println("HX711 not found.");
+    if (binary) {
+      sendFrame(reading, now);
+    } else {
+      Serial.print(seq);
+      Serial.print(',');
+      Serial.println(reading / 100);
+    }
+    seq++;
   }
-
-  delay(200);
-  
 }
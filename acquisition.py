@@ -0,0 +1,298 @@
+import threading
+import time
+
+import numpy as np
+
+from instrumentation import Instrumentation
+from logger import log
+from protocol import (POLL, STREAM, BINARY, CMD_POLL, CMD_START_STREAM, CMD_STOP_STREAM, CMD_START_BINARY,
+                      FRAME_SIZE, SEQ_MODULO, BinaryFrameDecoder, parse_ascii_line, missing_samples,
+                      reading_to_value)
+
+
+class SampleRingBuffer:
+    # Fixed size ring of (arrival time, value) pairs. The reader thread pushes,
+    # the GUI drains everything that arrived since the last frame in one go.
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.int64)
+        self.head = 0  # total samples written
+        self.tail = 0  # total samples drained
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def push(self, t, value):
+        with self.lock:
+            if self.head - self.tail >= self.capacity:
+                # consumer is too slow, overwrite the oldest sample
+                self.tail += 1
+                self.dropped += 1
+            i = self.head % self.capacity
+            self.times[i] = t
+            self.values[i] = value
+            self.head += 1
+
+    def push_many(self, times, values):
+        n = len(values)
+        if n == 0:
+            return
+        with self.lock:
+            if n > self.capacity:
+                self.dropped += n - self.capacity
+                self.tail += n - self.capacity
+                self.head += n - self.capacity
+                times = times[-self.capacity:]
+                values = values[-self.capacity:]
+                n = self.capacity
+            overflow = self.head + n - self.tail - self.capacity
+            if overflow > 0:
+                self.tail += overflow
+                self.dropped += overflow
+            start = self.head % self.capacity
+            first = min(n, self.capacity - start)
+            self.times[start:start + first] = times[:first]
+            self.values[start:start + first] = values[:first]
+            self.times[:n - first] = times[first:]
+            self.values[:n - first] = values[first:]
+            self.head += n
+
+    def drain(self):
+        with self.lock:
+            n = self.head - self.tail
+            start = self.tail % self.capacity
+            end = start + n
+            if end <= self.capacity:
+                times = self.times[start:end].copy()
+                values = self.values[start:end].copy()
+            else:
+                end -= self.capacity
+                times = np.concatenate((self.times[start:], self.times[:end]))
+                values = np.concatenate((self.values[start:], self.values[:end]))
+            self.tail = self.head
+        return times, values
+
+    def clear(self):
+        with self.lock:
+            self.tail = self.head
+
+
+class SerialReader:
+    # Owns the serial port while running, independent of how often the plot is
+    # redrawn. In BINARY and STREAM mode the firmware pushes sequenced samples on
+    # its own; if it does not answer the start command the reader falls back
+    # BINARY -> STREAM -> POLL. on_error(exception) is called from the reader
+    # thread when the port fails, e.g. to start a reconnect. With an enabled
+    # Instrumentation the port reads and the parsing are timed as 'serial' and
+    # 'parse'. With batch_interval the binary reader waits that long between
+    # reads so each read picks up a batch of frames instead of one: frames
+    # carry the device clock, so only the latency grows, and several readers
+    # in one process stop competing for the interpreter a thousand times a
+    # second each.
+    def __init__(self, serial_port, buffer, mode=BINARY, late_after=0.5, on_error=None, perf=None,
+                 batch_interval=0.0):
+        self.serial_port = serial_port
+        self.buffer = buffer
+        self.on_error = on_error
+        self.perf = perf or Instrumentation()
+        self.mode = mode
+        self.late_after = late_after
+        self.batch_interval = batch_interval
+        self.late = 0
+        self.lost = 0
+        self.parse_errors = 0
+        self.timeouts = 0
+        self.last_sample_time = None
+        self.last_seq = None
+        self.decoder = BinaryFrameDecoder()
+        self.clock_offset = None  # host monotonic time minus device time
+        self.last_device_time = None
+        self.device_time_wraps = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def dropped(self):
+        return self.buffer.dropped
+
+    @property
+    def bad_frames(self):
+        return self.decoder.bad_frames
+
+    @property
+    def resyncs(self):
+        return self.decoder.resyncs
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_alive():
+            return
+        self._stop_event.clear()
+        self.last_sample_time = None
+        self.last_seq = None
+        self.clock_offset = None
+        self.last_device_time = None
+        self.device_time_wraps = 0
+        self._thread = threading.Thread(target=self.run, name="SerialReader", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def start_stream(self, attempts=3):
+        # ask the firmware to stream and check that the first line is sequenced.
+        # Opening the port resets the board, so silence is retried a few times.
+        self.serial_port.reset_input_buffer()
+        for _ in range(attempts):
+            self.serial_port.write(CMD_START_STREAM)
+            line = self.serial_port.readline()
+            if not line:
+                continue
+            try:
+                seq, value = parse_ascii_line(line)
+            except (ValueError, UnicodeDecodeError):
+                continue
+            if seq is None:
+                return False  # old firmware, it only knows plain readings
+            self.handle_sample(time.monotonic(), seq, value)
+            return True
+        return False
+
+    def start_binary(self, attempts=3):
+        self.serial_port.reset_input_buffer()
+        for _ in range(attempts):
+            self.serial_port.write(CMD_START_BINARY)
+            chunk = self.serial_port.read(FRAME_SIZE * 4)
+            frames = self.decoder.feed(chunk)
+            if len(frames):
+                self.handle_frames(time.monotonic(), frames)
+                return True
+        self.decoder = BinaryFrameDecoder()  # forget whatever the probe saw
+        return False
+
+    def stop_stream(self):
+        try:
+            self.serial_port.write(CMD_STOP_STREAM)
+        except (OSError, ValueError):
+            pass
+
+    def read_sample(self):
+        if self.mode == POLL:
+            self.serial_port.write(CMD_POLL)
+        return self.serial_port.readline()
+
+    def handle_sample(self, arrival, seq, value):
+        if seq is not None:
+            if self.last_seq is not None:
+                self.lost += missing_samples(self.last_seq, seq)
+            self.last_seq = seq
+        if self.last_sample_time is not None and arrival - self.last_sample_time > self.late_after:
+            self.late += 1
+        self.last_sample_time = arrival
+        self.buffer.push(arrival, value)
+
+    def device_times(self, arrival, device_time):
+        # Map the device micros() clock onto the host monotonic clock, so samples
+        # read in one chunk keep their own spacing. The offset is the smallest
+        # arrival - device time seen, i.e. the least delayed frame.
+        device_time = device_time.astype(np.int64)
+        if self.last_device_time is not None:
+            previous = np.concatenate(([self.last_device_time], device_time[:-1]))
+        else:
+            previous = device_time[:1]
+        wraps = self.device_time_wraps + np.cumsum(device_time < previous)
+        self.device_time_wraps = int(wraps[-1])
+        self.last_device_time = int(device_time[-1])
+        seconds = (device_time + (wraps << 32)) / 1e6
+        offset = arrival - seconds[-1]
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        return seconds + self.clock_offset
+
+    def handle_frames(self, arrival, frames):
+        seqs = frames['seq'].astype(np.int64)
+        if self.last_seq is not None:
+            seqs = np.concatenate(([self.last_seq], seqs))
+        self.lost += int(((np.diff(seqs) - 1) % SEQ_MODULO).sum())
+        self.last_seq = int(seqs[-1])
+        times = self.device_times(arrival, frames['device_time'])
+        if self.last_sample_time is not None:
+            gaps = np.diff(np.concatenate(([self.last_sample_time], times)))
+            self.late += int(np.count_nonzero(gaps > self.late_after))
+        self.last_sample_time = times[-1]
+        self.buffer.push_many(times, reading_to_value(frames['reading']))
+
+    def port_failed(self, error):
+        log.error('serial_failed', f"Serial read failed: {error}", mode=self.mode)
+        if self.on_error is not None and not self._stop_event.is_set():
+            self.on_error(error)
+
+    def run_binary(self):
+        while not self._stop_event.is_set():
+            try:
+                with self.perf.stage('serial'):
+                    chunk = self.serial_port.read(max(self.serial_port.in_waiting, FRAME_SIZE))
+            except (OSError, ValueError) as e:
+                self.port_failed(e)
+                break
+            arrival = time.monotonic()
+            if not chunk:
+                self.timeouts += 1
+                continue
+            with self.perf.stage('parse'):
+                frames = self.decoder.feed(chunk)
+                if len(frames):
+                    self.handle_frames(arrival, frames)
+            if self.batch_interval:
+                self._stop_event.wait(self.batch_interval)
+        self.stop_stream()
+
+    def run(self):
+        try:
+            if self.mode == BINARY and not self.start_binary():
+                log.warning('fallback', "Device did not start binary streaming, trying ASCII streaming", mode=STREAM)
+                self.stop_stream()
+                self.mode = STREAM
+            if self.mode == STREAM and not self.start_stream():
+                log.warning('fallback', "Device did not start streaming, falling back to polling", mode=POLL)
+                self.stop_stream()
+                self.serial_port.reset_input_buffer()
+                self.mode = POLL
+        except (OSError, ValueError) as e:
+            self.port_failed(e)
+            return
+
+        if self.mode == BINARY:
+            self.run_binary()
+            return
+
+        while not self._stop_event.is_set():
+            try:
+                with self.perf.stage('serial'):
+                    line = self.read_sample()
+            except (OSError, ValueError) as e:
+                # port closed or unplugged under us
+                self.port_failed(e)
+                break
+            arrival = time.monotonic()
+            if not line:
+                self.timeouts += 1
+                continue
+            with self.perf.stage('parse'):
+                try:
+                    seq, value = parse_ascii_line(line)
+                except (ValueError, UnicodeDecodeError):
+                    self.parse_errors += 1
+                    continue
+                self.handle_sample(arrival, seq, value)
+
+        if self.mode == STREAM:
+            self.stop_stream()
@@ -0,0 +1,211 @@
+import json
+import os
+
+import numpy as np
+
+from session import Event, SessionBuffer, match_puncture
+
+# Session archive: a directory of flat little endian column files that open
+# with numpy.memmap, without parsing:
+#   time.f8, value.i4                    all samples
+#   puncture_time.f8, puncture_value.i4  samples taken in puncture state
+#   second.i8                            time index, entry k = first sample with time >= k s
+#   events.jsonl, meta.json
+# Columns are only ever appended, so after a crash the sample count is the
+# shortest column (a partly written value is ignored) and the time index is
+# completed from the times on open. The index needs sample times that never
+# decrease: one archive holds one measurement.
+SUFFIX = '.archive'
+TIME_DTYPE = np.dtype('<f8')
+VALUE_DTYPE = np.dtype('<i4')
+INDEX_DTYPE = np.dtype('<i8')
+COLUMNS = {
+    'time': ('time.f8', TIME_DTYPE),
+    'value': ('value.i4', VALUE_DTYPE),
+    'puncture_time': ('puncture_time.f8', TIME_DTYPE),
+    'puncture_value': ('puncture_value.i4', VALUE_DTYPE),
+    'second': ('second.i8', INDEX_DTYPE),
+}
+
+
+class ArchiveWriter:
+    # Creates an archive directory and appends to it as samples arrive; used
+    # from SessionRecorder's writer thread
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, filename), 'wb') for name, (filename, _) in COLUMNS.items()}
+        self.events = open(os.path.join(path, 'events.jsonl'), 'w', encoding='utf-8')
+        self.meta = {}
+        self.count = 0
+        self.seconds = 0  # entries in the time index so far
+        self.last_time = -np.inf
+
+    def append_samples(self, times, values):
+        times = np.asarray(times, dtype=TIME_DTYPE)
+        if len(times) and (times[0] < self.last_time or np.any(np.diff(times) < 0)):
+            raise ValueError(f"{self.path}: sample times went back, a new measurement needs a new archive")
+        self.files['time'].write(times.tobytes())
+        self.files['value'].write(np.asarray(values, dtype=VALUE_DTYPE).tobytes())
+        # index entries for every second reached by this batch
+        last = int(np.floor(times[-1])) if len(times) else -1
+        if last >= self.seconds:
+            seconds = np.arange(self.seconds, last + 1)
+            first = self.count + np.searchsorted(times, seconds, side='left')
+            self.files['second'].write(first.astype(INDEX_DTYPE).tobytes())
+            self.seconds = last + 1
+        self.count += len(times)
+        if len(times):
+            self.last_time = times[-1]
+
+    def append_puncture(self, times, values):
+        self.files['puncture_time'].write(np.asarray(times, dtype=TIME_DTYPE).tobytes())
+        self.files['puncture_value'].write(np.asarray(values, dtype=VALUE_DTYPE).tobytes())
+
+    def append_events(self, events):
+        # events as (time, kind, value) tuples
+        self.events.write(''.join(json.dumps(event) + '\n' for event in events))
+
+    def write_meta(self, fields):
+        self.meta.update(fields)
+        path = os.path.join(self.path, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.meta, f, default=str)
+        os.replace(path + '.tmp', path)
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+        self.events.flush()
+
+    def sync(self):
+        self.flush()
+        for f in self.files.values():
+            os.fsync(f.fileno())
+        os.fsync(self.events.fileno())
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.events.close()
+
+
+def _count(path, *names):
+    # complete values in the shortest of the columns
+    counts = []
+    for name in names:
+        filename, dtype = COLUMNS[name]
+        full = os.path.join(path, filename)
+        counts.append(os.path.getsize(full) // dtype.itemsize if os.path.exists(full) else 0)
+    return min(counts)
+
+
+def _column(path, name, count):
+    filename, dtype = COLUMNS[name]
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(os.path.join(path, filename), dtype=dtype, mode='r', shape=(count,))
+
+
+class SessionArchive:
+    # Read-only view of an archive. The columns are memory mapped, so opening
+    # costs nothing whatever the length and slice() only touches the pages of
+    # the requested range.
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise ValueError(f"{path} is not a session archive")
+        self.path = path
+        count = _count(path, 'time', 'value')
+        self.times = _column(path, 'time', count)
+        self.values = _column(path, 'value', count)
+        count = _count(path, 'puncture_time', 'puncture_value')
+        self.puncture_times = _column(path, 'puncture_time', count)
+        self.puncture_values = _column(path, 'puncture_value', count)
+        self.second_index = self._load_index()
+        self.events = self._load_events()
+        meta_path = os.path.join(path, 'meta.json')
+        self.meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+
+    def _load_index(self):
+        index = _column(self.path, 'second', _count(self.path, 'second'))
+        # keep the entries that agree with the samples on disk, rebuild the rest
+        valid = len(index)
+        if valid and index[-1] >= len(self.times):
+            valid = int(np.searchsorted(index, len(self.times), side='left'))
+        if not len(self.times):
+            return np.empty(0, dtype=INDEX_DTYPE)
+        last = int(np.floor(self.times[-1]))
+        if valid == last + 1:
+            return index[:valid]
+        start = int(index[valid - 1]) if valid else 0
+        seconds = np.arange(valid, last + 1)
+        tail = start + np.searchsorted(self.times[start:], seconds, side='left')
+        return np.concatenate((index[:valid], tail)).astype(INDEX_DTYPE)
+
+    def _load_events(self):
+        events = []
+        path = os.path.join(self.path, 'events.jsonl')
+        if not os.path.exists(path):
+            return events
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    t, kind, value = json.loads(line)
+                except ValueError:
+                    break  # cut short by a crash
+                events.append(Event(t, kind, value))
+        return events
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def locate(self, t):
+        # index of the first sample at or after t seconds, via the time index
+        if t <= 0 or not len(self.times):
+            return 0
+        second = int(t)
+        if second >= len(self.second_index):
+            return len(self.times)
+        start = int(self.second_index[second])
+        end = int(self.second_index[second + 1]) if second + 1 < len(self.second_index) else len(self.times)
+        return start + int(np.searchsorted(self.times[start:end], t, side='left'))
+
+    def slice(self, t0, t1):
+        # (times, values) for t0 <= time < t1, as memmap views
+        start, end = self.locate(t0), self.locate(t1)
+        return self.times[start:end], self.values[start:end]
+
+    def events_between(self, t0, t1):
+        return [e for e in self.events if t0 <= e.time < t1]
+
+    def to_session(self):
+        # everything loaded into memory, for the tools that work on a SessionBuffer
+        session = SessionBuffer()
+        session.samples.extend(self.times, self.values)
+        session.puncture.extend(self.puncture_times, self.puncture_values)
+        session.puncture_mask.extend(match_puncture(self.times, self.puncture_times))
+        session.events.extend(self.events)
+        session.meta.update(self.meta)
+        return session
+
+
+def write_archive(session, path):
+    # converts a whole SessionBuffer, e.g. an older recording
+    writer = ArchiveWriter(path)
+    try:
+        writer.append_samples(session.samples.times, session.samples.values)
+        writer.append_puncture(session.puncture.times, session.puncture.values)
+        writer.append_events([(e.time, e.kind, e.value) for e in session.events])
+        if session.meta:
+            writer.write_meta(session.meta)
+        writer.sync()
+    finally:
+        writer.close()
+    return path
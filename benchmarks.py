@@ -0,0 +1,343 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+
+from detector import EventDetector
+from filters import FilterChain
+from formats import available_formats, export_session
+from protocol import BinaryFrameDecoder, encode_frames, parse_ascii_line
+from pyramid import MinMaxPyramid
+from renderer import BlitRenderer
+from rolling import RollingStats
+from session import SampleSeries, SessionBuffer
+from simulator import LoadCellModel
+
+# Fixed datasets and sizes, so results from different commits are comparable.
+# Metrics ending in _ms / _us / _s are times (lower is better) and are what
+# --compare looks at.
+RATE = 80  # samples per second of a session
+
+
+def synthetic_signal(n, rate=20, baseline=650000, noise=40, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.arange(n) / rate
+    values = baseline + rng.normal(0, noise, n).round().astype(np.int64)
+    return times, values
+
+
+def session_signal(n, rate=RATE, seed=0):
+    # baseline noise with the simulator's touch / puncture / plateau script
+    times = np.arange(n) / rate
+    return times, LoadCellModel(seed=seed).values(times)
+
+
+def best_of(fn, repeat=5):
+    # seconds for the fastest of `repeat` runs, like timeit
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parse(n=100000, chunk_size=4096):
+    # cost per sample of turning received bytes into (seq, value)
+    seq = np.arange(n)
+    _, values = session_signal(n)
+    lines = [b"%d,%d\r\n" % (s % 65536, v) for s, v in zip(seq.tolist(), values.tolist())]
+    frames = encode_frames(seq, values * 100, seq * 12500)
+
+    def ascii():
+        for line in lines:
+            parse_ascii_line(line)
+
+    def binary():
+        decoder = BinaryFrameDecoder()
+        for start in range(0, len(frames), chunk_size):
+            decoder.feed(frames[start:start + chunk_size])
+
+    return {
+        'ascii_per_sample_us': best_of(ascii) / n * 1e6,
+        'binary_per_sample_us': best_of(binary) / n * 1e6,
+    }
+
+
+def bench_rolling(n=1000000, window=50, batch=256, pushes=100000):
+    # the moving average behind the thresholds, in frame sized batches and per sample
+    _, values = session_signal(n)
+
+    def batched():
+        stats = RollingStats(window)
+        for start in range(0, n, batch):
+            stats.update(values[start:start + batch])
+
+    def per_sample():
+        stats = RollingStats(window)
+        for v in values[:pushes].tolist():
+            stats.push(v)
+
+    return {
+        'batched_per_1m_s': best_of(batched, 3) * 1e6 / n,
+        'push_per_sample_us': best_of(per_sample, 3) / pushes * 1e6,
+    }
+
+
+def bench_detection(n=1000000, batch=256):
+    # touch / puncture / plateau detection over 1M samples, in one call and batch by batch
+    times, values = session_signal(n)
+
+    def whole():
+        EventDetector().process(times, values)
+
+    def batched():
+        detector = EventDetector()
+        for start in range(0, n, batch):
+            detector.process(times[start:start + batch], values[start:start + batch])
+
+    return {
+        'whole_per_1m_s': best_of(whole, 3) * 1e6 / n,
+        'batched_per_1m_s': best_of(batched, 3) * 1e6 / n,
+        'events': len(EventDetector().process(times, values).events),
+    }
+
+
+def bench_filter(n=100000, spec='rate:80,median:5,notch:50,lowpass:10', chunks=(8, 256)):
+    # the filter stage on session-like chunks, in microseconds per sample and per chunk
+    _, values = session_signal(n)
+    results = {}
+    for size in chunks:
+        def run():
+            chain = FilterChain(spec)
+            for start in range(0, n, size):
+                chain.process(values[start:start + size])
+
+        seconds = best_of(run, 3)
+        results[f'chunk{size}_per_sample_us'] = seconds / n * 1e6
+        results[f'chunk{size}_per_chunk_us'] = seconds / (n / size) * 1e6
+    return results
+
+
+def bench_render_windows(windows=(10, 60, 300), frames=100, rate=RATE):
+    # BlitRenderer frame time with window seconds of samples on screen, drawing
+    # every sample ('raw') and through the MinMaxPyramid as the plotter does
+    # ('lod', the pyramid update and query included)
+    results = {}
+    for window in windows:
+        points = window * rate
+        times, values = session_signal(frames * 4 + points, rate=rate)
+        results[f'{window}s'] = {'points': points}
+        for mode in ('raw', 'lod'):
+            fig = Figure(figsize=(8, 5))
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot()
+            renderer = BlitRenderer(fig, ax, window=window)
+            series = SampleSeries(np.int64)
+            series.extend(times[:points], values[:points])
+            pyramid = MinMaxPyramid(series)
+            frame_times = []
+            drawn = 0
+            for i in range(frames):
+                # a 20 fps frame brings rate / 20 new samples
+                end = points + i * 4
+                series.extend(times[end:end + 4], values[end:end + 4])
+                current_time = float(times[end + 3])
+                mean = float(np.mean(values[end - 50:end]))
+                start = time.perf_counter()
+                if mode == 'raw':
+                    t, v = times[i * 4 + 4:end + 4], values[i * 4 + 4:end + 4]
+                else:
+                    pyramid.update()
+                    t, v = pyramid.query(*renderer.visible_span(current_time), int(ax.bbox.width))
+                renderer.render(t, v, mean * 0.9985, mean * 1.00025, mean * 0.99971, y_center=mean,
+                                current_time=current_time)
+                frame_times.append(time.perf_counter() - start)
+                drawn = len(v)
+            frame_times = np.array(frame_times) * 1000
+            results[f'{window}s'][mode] = {
+                'drawn_points': drawn,
+                'p50_ms': float(np.percentile(frame_times, 50)),
+                'p99_ms': float(np.percentile(frame_times, 99)),
+                'full_redraws': renderer.full_redraws,
+            }
+    return results
+
+
+def bench_export(hours=(1, 8), rate=RATE):
+    # export_data of a 1 h and an 8 h session, a tenth of it in puncture state,
+    # in every format available here
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for h in hours:
+            n = int(h * 3600 * rate)
+            times, values = session_signal(n, rate=rate)
+            session = SessionBuffer()
+            session.add_samples(times, values, np.arange(n) < n // 10)
+            results[f'{h}h'] = {'rows': n}
+            for fmt in available_formats():
+                base = os.path.join(directory, f'{h}h')
+                start = time.perf_counter()
+                paths = export_session(session, base, fmt)
+                results[f'{h}h'][fmt] = {
+                    'export_s': time.perf_counter() - start,
+                    'size_mb': sum(os.path.getsize(path) for path in paths) / 1e6,
+                }
+    return results
+
+
+def render_legacy(ax, canvas, times, values, threshold, high_threshold, punc_threshold):
+    # the per-frame path animate() used before BlitRenderer
+    current_time = times[-1]
+    ax.clear()
+    ax.plot(times, values)
+    mean = np.mean(values)
+    ax.set_ylim([mean - 0.002 * mean, mean + 0.002 * mean])
+    ax.set_xlim([max(0, current_time - 10), current_time])
+    ax.axhline(y=threshold, color='r', linestyle='--', label=f'Threshold: {threshold}')
+    ax.axhline(y=high_threshold, color='k', linestyle='--', label=f'High Threshold :{high_threshold}')
+    ax.axhline(y=punc_threshold, color='m', linestyle='--', label=f'Puncture Threshold : {punc_threshold}')
+    ax.legend()
+    ax.set_title("Arduino Data")
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Value")
+    canvas.draw()
+
+
+def bench_render(frames=200, points=50, rate=20):
+    times, values = synthetic_signal(frames + points, rate=rate)
+    results = {}
+    for name in ('legacy', 'blit'):
+        fig = Figure(figsize=(8, 5))
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        renderer = BlitRenderer(fig, ax) if name == 'blit' else None
+        frame_times = []
+        for i in range(frames):
+            t = times[i:i + points]
+            v = values[i:i + points]
+            mean = float(np.mean(v))
+            start = time.perf_counter()
+            if renderer is None:
+                render_legacy(ax, canvas, t, v, mean * 0.9985, mean * 1.00025, mean * 0.99971)
+            else:
+                renderer.render(t, v, mean * 0.9985, mean * 1.00025, mean * 0.99971, y_center=mean)
+            frame_times.append(time.perf_counter() - start)
+        frame_times = np.array(frame_times) * 1000
+        results[name] = {
+            'mean_ms': float(frame_times.mean()),
+            'p50_ms': float(np.percentile(frame_times, 50)),
+            'p99_ms': float(np.percentile(frame_times, 99)),
+            'full_redraws': renderer.full_redraws if renderer else frames,
+        }
+    return results
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'rolling': bench_rolling,
+    'detection': bench_detection,
+    'filter': bench_filter,
+    'render': bench_render,
+    'render_windows': bench_render_windows,
+    'export': bench_export,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(names=None):
+    results = {}
+    for name in names or BENCHMARKS:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = BENCHMARKS[name]()
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def is_timing(metric):
+    return metric.endswith(('_ms', '_us', '_s'))
+
+
+def compare(baseline, current, tolerance=0.1):
+    # prints every timing of both runs; returns the metrics more than
+    # `tolerance` slower than the baseline
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    print(f"{'metric':<40} {baseline.get('commit') or 'baseline':>12} {current.get('commit') or 'current':>12}  ratio")
+    regressions = []
+    for metric, value in new.items():
+        if not is_timing(metric) or metric not in old:
+            continue
+        ratio = value / old[metric] if old[metric] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(metric)
+            flag = '  slower'
+        elif ratio < 1 - tolerance:
+            flag = '  faster'
+        print(f"{metric:<40} {old[metric]:>12.4g} {value:>12.4g}  {ratio:5.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the acquisition, detection, rendering and "
+                                                 "export hot paths")
+    parser.add_argument('names', nargs='*', metavar='name', help=f"benchmarks to run, default all of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('-o', '--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="slowdown counted as a regression (0.1 = 10%%)")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(sorted(unknown))}")
+
+    report = run(args.names)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    elif not args.output:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,556 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from logger import log
+from process_station import COMMANDS, FIELDS, STATUSES, RemoteStation, advance, station_state
+from pyramid import interleave
+from session import Event
+from shared_ring import EVENT_KINDS
+from station import Station, ACQUIRING
+
+# Broker wire format. Every message is a 5 byte header, type u8 and payload
+# length u32, then the payload; numbers are little endian:
+#   HELLO      server -> client on connect: version u16, state fields u16, decimation u16
+#   SAMPLES    n u32, then time f8[n], value i4[n], puncture u1[n]
+#   DECIMATED  the same, the minimum and the maximum of every `decimation` samples
+#   EVENTS     n u32, then time f8[n], kind u1[n] (index in EVENT_KINDS), value f8[n] (NaN for None)
+#   STATE      f8 per name in process_station.FIELDS
+#   GAP        stream u8 (SAMPLES or DECIMATED), samples dropped u32: the subscriber fell behind
+#   SUBSCRIBE  client -> server: mask u8 of the streams wanted, FULL | DECIMATED | EVENTS | STATE
+#   COMMAND    client -> server: JSON [command, *args], see process_station.COMMANDS
+#   REPLY      server -> client: JSON answer to the client's last COMMAND
+#   ERROR      server -> client instead of REPLY: the COMMAND failed, UTF-8 message
+VERSION = 2
+HELLO, SAMPLES, DECIMATED, EVENTS, STATE, GAP, SUBSCRIBE, COMMAND, REPLY, ERROR = range(1, 11)
+FULL, DECIMATED_STREAM, EVENT_STREAM, STATE_STREAM = 1, 2, 4, 8
+HEADER = struct.Struct('<BI')
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+
+
+def parse_address(address):
+    # 'host:port' for TCP, 'unix:/path' for a Unix domain socket
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def listen(address):
+    family, target = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)  # left over from a broker that did not shut down
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(target)
+    sock.listen()
+    return sock
+
+
+def connect(address, timeout=5):
+    family, target = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(target)
+    sock.settimeout(None)
+    if family != socket.AF_UNIX:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def pack_message(kind, payload):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def read_message(sock):
+    kind, size = HEADER.unpack(recv_exact(sock, HEADER.size))
+    return kind, recv_exact(sock, size)
+
+
+def pack_samples(times, values, puncture):
+    return (struct.pack('<I', len(values)) + np.asarray(times, dtype='<f8').tobytes()
+            + np.asarray(values, dtype='<i4').tobytes() + np.asarray(puncture, dtype=np.uint8).tobytes())
+
+
+def unpack_samples(payload):
+    n, = struct.unpack_from('<I', payload)
+    times = np.frombuffer(payload, dtype='<f8', count=n, offset=4)
+    values = np.frombuffer(payload, dtype='<i4', count=n, offset=4 + 8 * n).astype(np.int64)
+    puncture = np.frombuffer(payload, dtype=np.uint8, count=n, offset=4 + 12 * n).astype(bool)
+    return times, values, puncture
+
+
+def pack_events(events):
+    return (struct.pack('<I', len(events)) + np.array([e.time for e in events], dtype='<f8').tobytes()
+            + np.array([EVENT_KINDS.index(e.kind) for e in events], dtype=np.uint8).tobytes()
+            + np.array([np.nan if e.value is None else e.value for e in events], dtype='<f8').tobytes())
+
+
+def unpack_events(payload):
+    n, = struct.unpack_from('<I', payload)
+    times = np.frombuffer(payload, dtype='<f8', count=n, offset=4).tolist()
+    kinds = np.frombuffer(payload, dtype=np.uint8, count=n, offset=4 + 8 * n).tolist()
+    values = np.frombuffer(payload, dtype='<f8', count=n, offset=4 + 9 * n).tolist()
+    return [Event(t, EVENT_KINDS[kind], None if np.isnan(value) else int(value))
+            for t, kind, value in zip(times, kinds, values)]
+
+
+def pack_state(state):
+    values = np.array([state[name] for name in FIELDS], dtype='<f8')
+    values[np.isnan(values)] = np.nan  # one bit pattern, so equal states pack equal
+    return values.tobytes()
+
+
+def unpack_state(payload):
+    return dict(zip(FIELDS, np.frombuffer(payload, dtype='<f8').tolist()))
+
+
+class Decimator:
+    # The minimum and the maximum of every `factor` samples, in time order;
+    # what is left of a batch waits for the next one
+    def __init__(self, factor):
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        self.times = np.empty(0, dtype=np.float64)
+        self.values = np.empty(0, dtype=np.int64)
+        self.puncture = np.empty(0, dtype=bool)
+
+    def feed(self, times, values, puncture):
+        times = np.concatenate((self.times, times))
+        values = np.concatenate((self.values, values))
+        puncture = np.concatenate((self.puncture, puncture))
+        n = len(values) // self.factor * self.factor
+        self.times, self.values, self.puncture = times[n:], values[n:], puncture[n:]
+        block_t = times[:n].reshape(-1, self.factor)
+        block_v = values[:n].reshape(-1, self.factor)
+        rows = np.arange(len(block_v))
+        i, j = block_v.argmin(axis=1), block_v.argmax(axis=1)
+        out_t, out_v = interleave(block_t[rows, i], block_v[rows, i], block_t[rows, j], block_v[rows, j])
+        return out_t, out_v, np.repeat(puncture[:n].reshape(-1, self.factor).any(axis=1), 2)
+
+
+class Subscriber:
+    # One client on the broker side. Messages are queued and sent by a thread
+    # of its own, so a slow client only delays itself. Past max_pending
+    # queued bytes, sample messages for it are dropped and the count goes out
+    # in a GAP message once it has caught up; events, state and replies are
+    # always queued.
+    def __init__(self, sock, address, max_pending, on_message):
+        self.sock = sock
+        self.address = address
+        self.max_pending = max_pending
+        self.on_message = on_message
+        self.mask = EVENT_STREAM | STATE_STREAM
+        self.queue = deque()
+        self.pending = 0  # bytes queued or being sent
+        self.dropped = {SAMPLES: 0, DECIMATED: 0}
+        self.condition = threading.Condition()
+        self.closed = False
+        self._writer = threading.Thread(target=self.run_writer, name=f"Subscriber {address} writer", daemon=True)
+        self._reader = threading.Thread(target=self.run_reader, name=f"Subscriber {address} reader", daemon=True)
+
+    def start(self):
+        self._writer.start()
+        self._reader.start()
+        return self
+
+    def wants(self, stream):
+        return not self.closed and self.mask & stream
+
+    def send(self, kind, payload, samples=0):
+        # samples > 0 marks a droppable sample message of that many samples
+        with self.condition:
+            if self.closed:
+                return
+            if samples:
+                if self.pending + HEADER.size + len(payload) > self.max_pending:
+                    self.dropped[kind] += samples
+                    return
+                if self.dropped[kind]:
+                    self._queue(pack_message(GAP, struct.pack('<BI', kind, self.dropped[kind])))
+                    self.dropped[kind] = 0
+            self._queue(pack_message(kind, payload))
+
+    def _queue(self, message):
+        self.queue.append(message)
+        self.pending += len(message)
+        self.condition.notify()
+
+    def run_writer(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                data = b''.join(self.queue)
+                self.queue.clear()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                return
+            with self.condition:
+                self.pending -= len(data)
+
+    def run_reader(self):
+        try:
+            while True:
+                kind, payload = read_message(self.sock)
+                self.on_message(self, kind, payload)
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        log.info('unsubscribed', f"Subscriber {self.address} left", address=str(self.address))
+
+
+class Broker:
+    # Headless owner of the device: a Station acquiring and detecting as in
+    # the GUI, published to every subscriber on a local socket as full rate
+    # samples, a min/max decimated stream, events and the station state.
+    # Subscribers may send the station COMMANDS (calibrate, start, stop, ...),
+    # so a plotter can run the measurement while a logger or a scoring
+    # process only listens. Everything touching the station happens on the
+    # thread running serve_forever().
+    def __init__(self, address=DEFAULT_ADDRESS, device_url=None, window=50, threshold=15000, decimation=10,
+                 interval=0.01, max_pending=1 << 20, filter_spec=None):
+        self.address = address
+        self.station = Station('broker', device_url=device_url, window=window, threshold=threshold,
+                               batch_interval=interval, filter_spec=filter_spec)
+        self.decimator = Decimator(decimation)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.listener = listen(address)
+        self.subscribers = []
+        self.lock = threading.Lock()  # guards subscribers
+        self.commands = queue.Queue()  # (subscriber, command, args) from the reader threads
+        self.published = 0  # session events already sent
+        self.last_state = None  # the last STATE payload sent
+        self._stop = threading.Event()
+        # subscribers are welcome from now on, they get going once serve_forever() runs
+        threading.Thread(target=self.run_accept, name="Broker accept", daemon=True).start()
+
+    def run_accept(self):
+        while not self._stop.is_set():
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return  # listener closed
+            if sock.family != socket.AF_UNIX:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = Subscriber(sock, address or self.address, self.max_pending, self.on_message)
+            subscriber.send(HELLO, struct.pack('<HHH', VERSION, len(FIELDS), self.decimator.factor))
+            subscriber.send(STATE, pack_state(station_state(self.station)))
+            with self.lock:
+                self.subscribers.append(subscriber)
+            subscriber.start()
+            log.info('subscribed', f"Subscriber {subscriber.address} joined", address=str(subscriber.address))
+
+    def on_message(self, subscriber, kind, payload):
+        # called from the subscriber's reader thread
+        if kind == SUBSCRIBE:
+            subscriber.mask = payload[0]
+        elif kind == COMMAND:
+            command, *args = json.loads(payload)
+            self.commands.put((subscriber, command, args))
+
+    def serve_forever(self):
+        log.info('broker', f"Broker listening on {self.address}", address=self.address)
+        try:
+            while not self._stop.is_set():
+                self.step()
+                self._stop.wait(self.interval)
+        finally:
+            self.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def step(self):
+        while True:
+            try:
+                subscriber, command, args = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            self.run_command(subscriber, command, args)
+        times, values, puncture = advance(self.station)
+        if len(values):
+            self.publish(SAMPLES, FULL, pack_samples(times, values, puncture), len(values))
+            times, values, puncture = self.decimator.feed(times, values, puncture)
+            if len(values):
+                self.publish(DECIMATED, DECIMATED_STREAM, pack_samples(times, values, puncture), len(values))
+        events = self.station.session.events[self.published:]
+        if events:
+            self.published += len(events)
+            self.publish(EVENTS, EVENT_STREAM, pack_events(events))
+        self.publish_state()
+
+    def run_command(self, subscriber, command, args):
+        # a failing command, e.g. the port going away during calibrate, is
+        # only that subscriber's error; the broker keeps serving the others
+        error = None
+        try:
+            result = COMMANDS[command](self.station, *args)
+        except (KeyError, TypeError) as e:
+            log.warning('bad_command', f"Bad command {command!r} from {subscriber.address}: {e}", command=command)
+            result = None
+        except (OSError, ValueError) as e:  # serial.SerialException is an OSError
+            log.error('command_failed', f"{command} from {subscriber.address} failed: {e}", command=command)
+            error = f"{command} failed: {e}"
+        if command == 'start':
+            self.decimator.reset()  # the clock starts again
+        self.publish_state()  # the answer only goes out once the state shows it
+        if error is not None:
+            subscriber.send(ERROR, error.encode())
+        else:
+            subscriber.send(REPLY, json.dumps(result, default=float).encode())
+
+    def publish_state(self):
+        # compared as packed, where NaN (no level yet, unknown mode) equals NaN
+        payload = pack_state(station_state(self.station))
+        if payload == self.last_state:
+            return
+        self.last_state = payload
+        self.publish(STATE, STATE_STREAM, payload)
+
+    def publish(self, kind, stream, payload, samples=0):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if not s.closed]
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if subscriber.wants(stream):
+                subscriber.send(kind, payload, samples)
+
+    def close(self):
+        self._stop.set()
+        self.listener.close()
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            subscriber.close()
+        self.station.close()
+        family, target = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+class BrokerClient:
+    # Subscriber side of the wire format, for the plotter or any other
+    # consumer (a logger, a scoring process). A reader thread parses what
+    # arrives and calls on_samples(times, values, puncture),
+    # on_decimated(times, values, puncture), on_events(events),
+    # on_state(state) and on_gap(stream, dropped) when given; request() sends
+    # a command and waits for its reply.
+    def __init__(self, address=DEFAULT_ADDRESS, mask=FULL | EVENT_STREAM | STATE_STREAM, timeout=10,
+                 on_samples=None, on_decimated=None, on_events=None, on_state=None, on_gap=None):
+        self.sock = connect(address)
+        self.timeout = timeout
+        kind, payload = read_message(self.sock)
+        if kind != HELLO:
+            raise ValueError(f"{address} is not a broker")
+        version, fields, self.decimation = struct.unpack('<HHH', payload)
+        if version != VERSION or fields != len(FIELDS):
+            raise ValueError(f"broker at {address} speaks version {version} with {fields} state fields")
+        self.handlers = {SAMPLES: on_samples, DECIMATED: on_decimated, EVENTS: on_events, STATE: on_state,
+                         GAP: on_gap}
+        self.replies = queue.Queue()
+        self.lock = threading.Lock()  # one request at a time
+        self.closed = False
+        self.subscribe(mask)
+        self._thread = threading.Thread(target=self.run, name="Broker client", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, mask):
+        self.sock.sendall(pack_message(SUBSCRIBE, bytes([mask])))
+
+    def request(self, command, *args):
+        with self.lock:
+            self.sock.sendall(pack_message(COMMAND, json.dumps([command, *args], default=float).encode()))
+            try:
+                reply = self.replies.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"no reply to {command}") from None
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def run(self):
+        try:
+            while True:
+                kind, payload = read_message(self.sock)
+                if kind == REPLY:
+                    self.replies.put(json.loads(payload))
+                    continue
+                if kind == ERROR:
+                    self.replies.put(OSError(f"broker: {payload.decode()}"))
+                    continue
+                handler = self.handlers.get(kind)
+                if handler is None:
+                    continue
+                if kind in (SAMPLES, DECIMATED):
+                    handler(*unpack_samples(payload))
+                elif kind == EVENTS:
+                    handler(unpack_events(payload))
+                elif kind == STATE:
+                    handler(unpack_state(payload))
+                elif kind == GAP:
+                    handler(*struct.unpack('<BI', payload))
+        except (EOFError, OSError) as e:
+            self.replies.put(EOFError(f"broker connection lost: {e}"))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class BrokerStation(RemoteStation):
+    # A RemoteStation fed by a Broker: the plotter as one subscriber among
+    # many. Samples are kept while the broker is acquiring, at most
+    # max_pending of them between two reads.
+    def __init__(self, address=DEFAULT_ADDRESS, name='station', window=50, threshold=15000, perf=None,
+                 max_pending=1 << 20):
+        super().__init__(name, device_url=address, window=window, threshold=threshold, perf=perf)
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.batches = deque()  # (times, values, puncture) since the last receive()
+        self.batched = 0
+        self.events = []
+        self.latest = dict(self.remote)
+        self.client = BrokerClient(address, on_samples=self.on_samples, on_events=self.on_events,
+                                   on_state=self.on_state, on_gap=self.on_gap)
+
+    def on_samples(self, times, values, puncture):
+        with self.lock:
+            if self.latest['status'] != STATUSES.index(ACQUIRING):
+                return
+            self.batches.append((times, values, puncture))
+            self.batched += len(values)
+            while self.batched > self.max_pending:
+                self.batched -= len(self.batches.popleft()[1])
+
+    def on_events(self, events):
+        with self.lock:
+            self.events.extend(events)
+
+    def on_state(self, state):
+        with self.lock:
+            self.latest = state
+
+    def on_gap(self, stream, dropped):
+        log.warning('broker_gap', f"{self.name} fell behind the broker, {dropped} samples dropped",
+                    station=self.name, dropped=dropped)
+
+    def request(self, command, *args):
+        return self.client.request(command, *args)
+
+    def receive(self):
+        with self.lock:
+            batches, self.batches, self.batched = self.batches, deque(), 0
+            events, self.events = self.events, []
+            state = dict(self.latest)
+        if not batches:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool), events, state
+        times, values, puncture = (np.concatenate(column) for column in zip(*batches))
+        return times, values, puncture, events, state
+
+    def refresh(self):
+        with self.lock:
+            return dict(self.latest)
+
+    def close(self):
+        self.client.close()
+
+
+def follow(address):
+    # a minimal consumer: prints the events and the sample rate once a second
+    counts = [0]
+
+    def on_samples(times, values, puncture):
+        counts[0] += len(values)
+
+    def on_events(events):
+        for event in events:
+            print(f"{event.time:10.3f} s  {event.kind}")
+
+    client = BrokerClient(address, on_samples=on_samples, on_events=on_events,
+                          on_gap=lambda stream, dropped: print(f"fell behind, {dropped} samples dropped"))
+    try:
+        while not client.closed:
+            time.sleep(1)
+            print(f"{counts[0]} samples/s")
+            counts[0] = 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Own the load cell and publish its samples and events")
+    parser.add_argument('--device', help="serial port or device url instead of auto discovery")
+    parser.add_argument('--listen', default=DEFAULT_ADDRESS, metavar='ADDRESS',
+                        help="host:port on localhost, or unix:/path for a Unix domain socket")
+    parser.add_argument('--decimation', type=int, default=10, help="samples per min/max pair of the decimated stream")
+    parser.add_argument('--filter', metavar='SPEC',
+                        help="filter the samples before detection, e.g. rate:80,median:5,notch:50,lowpass:10")
+    parser.add_argument('--dashboard', metavar='HOST:PORT',
+                        help="also serve the browser dashboard from this process, e.g. 0.0.0.0:8080")
+    parser.add_argument('--follow', metavar='ADDRESS', help="subscribe to a running broker and print what it sends")
+    args = parser.parse_args()
+
+    if args.follow:
+        follow(args.follow)
+    else:
+        broker = Broker(args.listen, device_url=args.device, decimation=args.decimation, filter_spec=args.filter)
+        dashboard = None
+        if args.dashboard:
+            from dashboard import Dashboard
+            dashboard = Dashboard([f'broker={args.listen}'], args.dashboard).start()
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if dashboard is not None:
+                dashboard.close()
@@ -0,0 +1,98 @@
+import numpy as np
+
+IDLE = 'idle'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+
+class Calibrator:
+    # Estimates the resting level from samples fed in by the acquisition
+    # pipeline instead of reading the port itself. It finishes after
+    # max_duration seconds, or earlier once at least min_duration seconds and
+    # min_samples have been seen and the standard error of the mean is below
+    # max_sem_fraction of the mean.
+    def __init__(self, max_duration=10, min_duration=2, min_samples=20, max_sem_fraction=0.00001,
+                 low_margin=0.0012, high_margin=0.00035, punc_margin=0.0003):
+        self.max_duration = max_duration
+        self.min_duration = min_duration
+        self.min_samples = min_samples
+        self.max_sem_fraction = max_sem_fraction
+        self.low_margin = low_margin
+        self.high_margin = high_margin
+        self.punc_margin = punc_margin
+        self.state = IDLE
+        self.start_time = None
+        self.elapsed = 0.0
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.offset = None
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    @property
+    def running(self):
+        return self.state == RUNNING
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return float('nan')
+        return self.offset + self.sum / self.count
+
+    @property
+    def sem(self):
+        if self.count < 2:
+            return float('inf')
+        m = self.sum / self.count
+        var = max(self.sum_sq / self.count - m * m, 0.0) * self.count / (self.count - 1)
+        return (var / self.count) ** 0.5
+
+    @property
+    def progress(self):
+        if self.state == DONE:
+            return 1.0
+        return min(self.elapsed / self.max_duration, 1.0)
+
+    def converged(self):
+        return (self.elapsed >= self.min_duration and self.count >= self.min_samples
+                and self.sem <= self.max_sem_fraction * abs(self.mean))
+
+    def start(self, now):
+        self.reset()
+        self.state = RUNNING
+        self.start_time = now
+        self.elapsed = 0.0
+
+    def cancel(self):
+        if self.state == RUNNING:
+            self.state = CANCELLED
+
+    def feed(self, times, values):
+        if self.state != RUNNING or len(values) == 0:
+            return
+        values = np.asarray(values, dtype=np.float64)
+        if self.offset is None:
+            self.offset = float(values[0])
+        shifted = values - self.offset
+        self.count += len(shifted)
+        self.sum += float(shifted.sum())
+        self.sum_sq += float(np.dot(shifted, shifted))
+        self.check(times[-1])
+
+    def check(self, now):
+        # also called without new samples so a silent device still times out
+        if self.state != RUNNING:
+            return
+        self.elapsed = now - self.start_time
+        if self.converged() or self.elapsed >= self.max_duration:
+            self.state = DONE
+
+    def thresholds(self):
+        # (threshold, highThreshold, puncThreshold), or None if nothing was read
+        if self.state != DONE or self.count == 0:
+            return None
+        mean = self.mean
+        return mean - self.low_margin * mean, mean + self.high_margin * mean, mean - self.punc_margin * mean
@@ -0,0 +1,182 @@
+import threading
+
+import serial
+import serial.tools.list_ports
+
+from logger import log
+from protocol import CMD_POLL, CMD_STOP_STREAM, parse_ascii_line
+from simulator import SimulatedDevice
+
+# USB vendor ids of the boards and USB-serial chips we have seen on the benches
+ARDUINO_VIDS = {
+    0x2341,  # Arduino
+    0x2A03,  # Arduino (arduino.org)
+    0x1A86,  # WCH CH340 clones
+    0x0403,  # FTDI
+    0x10C4,  # Silicon Labs CP210x
+}
+
+BAUD_RATE = 57600  # must match BAUD_RATE in Arduino/HX711_basic_example.ino
+CANDIDATE_BAUD_RATES = (57600, 9600, 115200, 2400)
+
+
+def open_url(url, baudrate=BAUD_RATE, timeout=1):
+    # sim://?... opens a SimulatedDevice, anything else goes to pyserial
+    # (a port name, loop://, socket://host:port, rfc2217://...)
+    if url.startswith('sim://'):
+        return SimulatedDevice.from_url(url, baudrate=baudrate, timeout=timeout)
+    return serial.serial_for_url(url, baudrate=baudrate, timeout=timeout)
+
+
+def discover_ports(limit=None):
+    # port names of every known board attached, one per station
+    ports = sorted(info.device for info in serial.tools.list_ports.comports()
+                   if info.vid in ARDUINO_VIDS or "Arduino" in (info.description or ''))
+    return ports[:limit]
+
+
+class ConnectionManager:
+    # Finds the load cell board once, remembers it by VID/PID/serial number and
+    # keeps its port open across runs. Opening the port resets the board, so
+    # callers flush with flush() instead of reopening. When the port fails,
+    # reconnect() retries in the background with exponential backoff and hands
+    # the new port to on_connect. With a device url (see open_url) discovery is
+    # skipped and that device is opened instead.
+    def __init__(self, baudrate=BAUD_RATE, timeout=1, on_connect=None, backoff_start=0.5, backoff_max=10, url=None):
+        self.url = url
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self.backoff_start = backoff_start
+        self.backoff_max = backoff_max
+        self.device = None  # (vid, pid, serial_number) of the board we talked to last
+        self.port = None
+        self.detected_baudrate = None
+        self.reconnects = 0
+        self.lock = threading.Lock()
+        self._reconnect_thread = None
+        self._closing = threading.Event()
+
+    @staticmethod
+    def identify(info):
+        return info.vid, info.pid, info.serial_number
+
+    def discover(self):
+        # best match first: the same board, the same kind of board, any known
+        # board, and finally the old "Arduino" in the description check
+        ports = list(serial.tools.list_ports.comports())
+        if self.device is not None:
+            for info in ports:
+                if self.identify(info) == self.device:
+                    return info
+            for info in ports:
+                if (info.vid, info.pid) == self.device[:2]:
+                    return info
+        for info in ports:
+            if info.vid in ARDUINO_VIDS:
+                return info
+        for info in ports:
+            if "Arduino" in (info.description or ''):
+                return info
+        return None
+
+    def is_open(self):
+        return self.port is not None and self.port.is_open
+
+    def connect(self):
+        with self.lock:
+            if self.is_open():
+                return self.port
+            if self.url is not None:
+                self.port = open_url(self.url, self.baudrate, self.timeout)
+                self.check_baudrate()
+                return self.port
+            info = self.discover()
+            if info is None:
+                return None
+            self.port = serial.Serial(info.device, self.baudrate, timeout=self.timeout)
+            self.device = self.identify(info)
+            self.check_baudrate()
+            return self.port
+
+    def probe(self, attempts=3):
+        # True if the board answers a poll with a reading at the current baud rate.
+        # The first attempts may fall into the bootloader delay after a reset.
+        self.port.write(CMD_STOP_STREAM)
+        for _ in range(attempts):
+            self.port.reset_input_buffer()
+            self.port.write(CMD_POLL)
+            line = self.port.readline()
+            try:
+                parse_ascii_line(line)
+                return True
+            except (ValueError, UnicodeDecodeError):
+                continue
+        return False
+
+    def check_baudrate(self):
+        # A sketch running at a different baud rate only produces garbage, so
+        # try the usual rates and stay on the one that gives readings.
+        if self.probe():
+            self.detected_baudrate = self.port.baudrate
+            return
+        for baudrate in CANDIDATE_BAUD_RATES:
+            if baudrate == self.baudrate:
+                continue
+            self.port.baudrate = baudrate
+            if self.probe(attempts=2):
+                self.detected_baudrate = baudrate
+                log.warning('baud_mismatch', f"Baud rate mismatch: the sketch runs at {baudrate}, expected {self.baudrate}",
+                            baudrate=baudrate, expected=self.baudrate)
+                return
+        self.port.baudrate = self.baudrate
+        self.detected_baudrate = None
+        log.error('no_readings', f"No readings from {self.port.port} at any known baud rate", port=self.port.port)
+
+    def flush(self):
+        if self.is_open():
+            self.port.reset_input_buffer()
+            self.port.reset_output_buffer()
+
+    def close(self):
+        self._closing.set()
+        with self.lock:
+            if self.port is not None:
+                try:
+                    self.port.close()
+                except OSError:
+                    pass
+                self.port = None
+
+    def reconnect(self):
+        # safe to call from the reader thread; only one reconnect runs at a time
+        with self.lock:
+            if self._reconnect_thread is not None and self._reconnect_thread.is_alive():
+                return
+            self._closing.clear()
+            self._reconnect_thread = threading.Thread(target=self.run_reconnect, name="Reconnect", daemon=True)
+            self._reconnect_thread.start()
+
+    def run_reconnect(self):
+        with self.lock:
+            if self.port is not None:
+                try:
+                    self.port.close()
+                except OSError:
+                    pass
+                self.port = None
+        delay = self.backoff_start
+        while not self._closing.is_set():
+            try:
+                port = self.connect()
+            except (OSError, ValueError) as e:
+                log.warning('reconnect_failed', f"Reconnect failed: {e}", delay=delay)
+                port = None
+            if port is not None:
+                self.reconnects += 1
+                log.info('reconnected', f"Reconnected to {port.port}", port=port.port, reconnects=self.reconnects)
+                if self.on_connect is not None:
+                    self.on_connect(port)
+                return
+            self._closing.wait(delay)
+            delay = min(delay * 2, self.backoff_max)
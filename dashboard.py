@@ -0,0 +1,452 @@
+import argparse
+import base64
+import hashlib
+import json
+import math
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from broker import BrokerClient, DECIMATED_STREAM, EVENT_STREAM, STATE_STREAM, DEFAULT_ADDRESS, parse_address
+from logger import log
+from process_station import STATES, STATUSES
+
+# Read-only browser view of one or more brokers, for watching stations from a
+# tablet. Each broker is subscribed to for its decimated stream, events and
+# state only. Every `frame_interval` one JSON frame with what changed on all
+# stations is encoded once and queued to every viewer over a WebSocket; a
+# newcomer first gets the last `window` seconds. Viewers are served by threads
+# of their own with a bounded queue each, so a slow tablet drops frames
+# instead of holding anything up, and nothing here runs on the thread that
+# acquires.
+DEFAULT_HTTP = '0.0.0.0:8080'
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+TEXT, CLOSE, PING, PONG = 0x1, 0x8, 0x9, 0xA
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Load cell stations</title>
+<style>
+body { font-family: sans-serif; margin: 8px; background: #fafafa; }
+#tiles { display: grid; grid-template-columns: repeat(auto-fill, minmax(420px, 1fr)); gap: 8px; }
+.tile { background: #fff; border: 1px solid #ccc; padding: 6px; }
+.tile h3 { margin: 0 0 4px 0; font-size: 16px; }
+.status { font-family: monospace; font-size: 15px; }
+.puncture { color: #c00; font-weight: bold; }
+canvas { width: 100%; height: 240px; }
+#connection { color: #888; font-size: 12px; }
+</style></head>
+<body><div id="connection">connecting</div><div id="tiles"></div>
+<script>
+const stations = {};
+let windowSeconds = 60;
+
+function tile(s) {
+  if (!stations[s.id]) {
+    const div = document.createElement('div');
+    div.className = 'tile';
+    div.innerHTML = '<h3></h3><div class="status"></div><canvas></canvas>';
+    document.getElementById('tiles').appendChild(div);
+    stations[s.id] = {div: div, t: [], v: [], state: {}, events: [], dirty: true};
+  }
+  const st = stations[s.id];
+  if (s.name) st.div.querySelector('h3').textContent = s.name;
+  return st;
+}
+
+function apply(s) {
+  const st = tile(s);
+  if (s.reset) { st.t = []; st.v = []; st.events = []; }
+  if (s.t) {
+    st.t.push(...s.t); st.v.push(...s.v);
+    const start = st.t.length ? st.t[st.t.length - 1] - windowSeconds : 0;
+    let cut = 0;
+    while (cut < st.t.length && st.t[cut] < start) cut++;
+    if (cut) { st.t.splice(0, cut); st.v.splice(0, cut); }
+  }
+  if (s.events) st.events.push(...s.events);
+  if (s.state) st.state = s.state;
+  st.dirty = true;
+}
+
+function draw(st) {
+  const canvas = st.div.querySelector('canvas');
+  const w = canvas.clientWidth, h = canvas.clientHeight;
+  if (canvas.width !== w || canvas.height !== h) { canvas.width = w; canvas.height = h; }
+  const ctx = canvas.getContext('2d');
+  ctx.clearRect(0, 0, w, h);
+  const s = st.state;
+  const label = st.div.querySelector('.status');
+  const state = s.state ? s.state[0].toUpperCase() + s.state.slice(1) : 'waiting';
+  label.textContent = 'State : ' + state + '   ' + (s.status || '');
+  label.className = 'status' + (s.puncture_active ? ' puncture' : '');
+  if (!st.t.length) return;
+  const t1 = st.t[st.t.length - 1], t0 = t1 - windowSeconds;
+  let lo = Infinity, hi = -Infinity;
+  for (const v of st.v) { if (v < lo) lo = v; if (v > hi) hi = v; }
+  for (const v of [s.threshold, s.high_threshold, s.punc_threshold]) {
+    if (v !== null && v !== undefined && Math.abs(v - lo) < 4 * (hi - lo + 100)) { lo = Math.min(lo, v); hi = Math.max(hi, v); }
+  }
+  const pad = (hi - lo) * 0.05 + 1;
+  lo -= pad; hi += pad;
+  const x = t => (t - t0) / (t1 - t0) * w, y = v => h - (v - lo) / (hi - lo) * h;
+  ctx.strokeStyle = '#1f77b4'; ctx.lineWidth = 1; ctx.beginPath();
+  st.t.forEach((t, i) => i ? ctx.lineTo(x(t), y(st.v[i])) : ctx.moveTo(x(t), y(st.v[i])));
+  ctx.stroke();
+  [[s.threshold, '#d62728'], [s.high_threshold, '#2ca02c'], [s.punc_threshold, '#ff7f0e']].forEach(([v, c]) => {
+    if (v === null || v === undefined) return;
+    ctx.strokeStyle = c; ctx.setLineDash([4, 4]); ctx.beginPath();
+    ctx.moveTo(0, y(v)); ctx.lineTo(w, y(v)); ctx.stroke(); ctx.setLineDash([]);
+  });
+  ctx.fillStyle = '#000'; ctx.font = '11px sans-serif';
+  for (const [t, kind] of st.events) if (t >= t0) { ctx.fillRect(x(t), 0, 1, h); ctx.fillText(kind, x(t) + 2, 12); }
+  ctx.fillText(t1.toFixed(1) + ' s', w - 50, h - 4);
+}
+
+function frame() {
+  for (const id in stations) if (stations[id].dirty) { stations[id].dirty = false; draw(stations[id]); }
+  requestAnimationFrame(frame);
+}
+
+function connect() {
+  const ws = new WebSocket((location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/ws');
+  const status = document.getElementById('connection');
+  ws.onopen = () => { status.textContent = 'live'; };
+  ws.onclose = () => { status.textContent = 'disconnected, retrying'; setTimeout(connect, 2000); };
+  ws.onmessage = e => {
+    const msg = JSON.parse(e.data);
+    if (msg.window) windowSeconds = msg.window;
+    msg.stations.forEach(apply);
+  };
+}
+connect();
+requestAnimationFrame(frame);
+</script></body></html>
+"""
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+
+def ws_frame(payload, opcode=TEXT):
+    # a single unmasked frame, as a server sends them
+    size = len(payload)
+    if size < 126:
+        header = struct.pack('!BB', 0x80 | opcode, size)
+    elif size < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+    return header + payload
+
+
+def read_ws_frame(rfile):
+    # (opcode, payload) of the next frame from a client; client frames are masked
+    header = rfile.read(2)
+    if len(header) < 2:
+        raise EOFError("viewer closed the connection")
+    opcode, size = header[0] & 0x0F, header[1] & 0x7F
+    if size == 126:
+        size, = struct.unpack('!H', rfile.read(2))
+    elif size == 127:
+        size, = struct.unpack('!Q', rfile.read(8))
+    mask = rfile.read(4) if header[1] & 0x80 else b''
+    payload = rfile.read(size)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def finite(value):
+    # JSON has no NaN
+    return None if value is None or math.isnan(value) else value
+
+
+class StationFeed:
+    # What one broker sent since the last frame, and the last `window` seconds
+    # of its decimated stream for viewers joining later. The broker client's
+    # thread fills it, the frame thread takes from it.
+    def __init__(self, index, name, address, window):
+        self.index = index
+        self.name = name
+        self.window = window
+        self.lock = threading.Lock()
+        self.times = np.empty(0, dtype=np.float64)  # history
+        self.values = np.empty(0, dtype=np.int64)
+        self.events = deque(maxlen=256)
+        self.state = None
+        self.new = 0  # samples at the end of the history not sent yet
+        self.new_events = []
+        self.state_changed = False
+        self.reset = False
+        self.client = BrokerClient(address, mask=DECIMATED_STREAM | EVENT_STREAM | STATE_STREAM,
+                                   on_decimated=self.on_decimated, on_events=self.on_events, on_state=self.on_state)
+
+    def on_decimated(self, times, values, puncture):
+        with self.lock:
+            if len(self.times) and times[0] < self.times[-1]:
+                # the broker started a new measurement, its clock restarted
+                self.times, self.values, self.new = self.times[:0], self.values[:0], 0
+                self.events.clear()
+                self.reset = True
+            self.new += len(values)
+            times = np.concatenate((self.times, times))
+            values = np.concatenate((self.values, values))
+            start = np.searchsorted(times, times[-1] - self.window)
+            self.times, self.values = times[start:], values[start:]
+            self.new = min(self.new, len(self.values))
+
+    def on_events(self, events):
+        with self.lock:
+            events = [(round(e.time, 3), e.kind) for e in events]
+            self.events.extend(events)
+            self.new_events.extend(events)
+
+    def on_state(self, state):
+        state = {
+            'status': None if math.isnan(state['status']) else STATUSES[int(state['status'])],
+            'state': None if math.isnan(state['state']) else STATES[int(state['state'])],
+            'threshold': finite(state['threshold']), 'high_threshold': finite(state['high_threshold']),
+            'punc_threshold': finite(state['punc_threshold']), 'puncture_active': state['puncture_active'] == 1,
+        }
+        with self.lock:
+            if state != self.state:
+                self.state = state
+                self.state_changed = True
+
+    @staticmethod
+    def points(times, values):
+        return {'t': np.round(times, 3).tolist(), 'v': values.tolist()}
+
+    def snapshot(self):
+        # everything a new viewer needs up to the last take(); what came since
+        # reaches it with the next frame, like every other viewer
+        with self.lock:
+            sent = len(self.values) - self.new
+            events = list(self.events)[:max(len(self.events) - len(self.new_events), 0)]
+            return {'id': self.index, 'name': self.name, 'reset': True, 'events': events,
+                    'state': self.state, **self.points(self.times[:sent], self.values[:sent])}
+
+    def take(self):
+        # what changed since the last call, None if nothing did
+        with self.lock:
+            if not (self.new or self.new_events or self.state_changed or self.reset):
+                return None
+            update = {'id': self.index}
+            if self.reset:
+                update['reset'] = True
+            if self.new:
+                update.update(self.points(self.times[-self.new:], self.values[-self.new:]))
+            if self.new_events:
+                update['events'] = self.new_events
+            if self.state_changed:
+                update['state'] = self.state
+            self.new, self.new_events, self.state_changed, self.reset = 0, [], False, False
+            return update
+
+    def close(self):
+        self.client.close()
+
+
+class Viewer:
+    # One browser on a WebSocket. Frames are queued and sent by a writer
+    # thread; past max_pending queued bytes new frames are dropped, which the
+    # page only shows as a jump in its plot.
+    def __init__(self, sock, address, max_pending):
+        self.sock = sock
+        self.address = address
+        self.max_pending = max_pending
+        self.queue = deque()
+        self.pending = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self._writer = threading.Thread(target=self.run_writer, name=f"Viewer {address} writer", daemon=True)
+
+    def start(self):
+        self._writer.start()
+        return self
+
+    def send(self, data, droppable=True):
+        with self.condition:
+            if self.closed:
+                return
+            if droppable and self.pending + len(data) > self.max_pending:
+                self.dropped += 1
+                return
+            self.queue.append(data)
+            self.pending += len(data)
+            self.condition.notify()
+
+    def run_writer(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    return  # closed, and everything queued went out
+                data = b''.join(self.queue)
+                self.queue.clear()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                return
+            with self.condition:
+                self.pending -= len(data)
+
+    def join(self, timeout):
+        self._writer.join(timeout)
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    # GET / is the page, GET /ws the WebSocket the page connects to
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/ws' and self.headers.get('Upgrade', '').lower() == 'websocket':
+            self.serve_websocket()
+        elif self.path in ('/', '/index.html'):
+            body = PAGE.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def serve_websocket(self):
+        key = self.headers.get('Sec-WebSocket-Key')
+        if not key:
+            self.send_error(400)
+            return
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        # this thread reads what the viewer sends until it leaves
+        self.server.dashboard.serve_viewer(self.connection, f'{self.client_address[0]}:{self.client_address[1]}',
+                                           self.rfile)
+
+    def log_message(self, format, *args):
+        log.debug('http', format % args, address=self.client_address[0])
+
+
+class DashboardServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 64  # a classroom of tablets connecting at once
+    dashboard = None
+
+
+class Dashboard:
+    def __init__(self, brokers, address=DEFAULT_HTTP, frame_interval=0.1, window=60, max_pending=1 << 20):
+        # brokers: broker addresses, each optionally prefixed 'name=' for its tile title
+        self.frame_interval = frame_interval
+        self.window = window
+        self.max_pending = max_pending
+        self.feeds = []
+        for i, broker in enumerate(brokers):
+            name, _, address_ = broker.rpartition('=')
+            self.feeds.append(StationFeed(i, name or address_, address_, window))
+        self.viewers = []
+        # guards viewers; also held across taking a frame and picking who gets
+        # it, so a new viewer's snapshot ends exactly where its first frame starts
+        self.lock = threading.Lock()
+        _, (host, port) = parse_address(address)
+        self.server = DashboardServer((host, port), DashboardHandler)
+        self.server.dashboard = self
+        self.address = address
+        self._stop = threading.Event()
+        self.frames = 0
+        self.frame_bytes = 0
+
+    def serve_viewer(self, sock, address, rfile):
+        viewer = Viewer(sock, address, self.max_pending)
+        with self.lock:
+            hello = {'window': self.window, 'stations': [feed.snapshot() for feed in self.feeds]}
+            viewer.send(ws_frame(json.dumps(hello, separators=(',', ':')).encode()), droppable=False)
+            self.viewers.append(viewer)
+        viewer.start()
+        log.info('viewer', f"Viewer {address} joined", address=address)
+        try:
+            while not viewer.closed:
+                opcode, payload = read_ws_frame(rfile)
+                if opcode == CLOSE:
+                    viewer.send(ws_frame(payload[:2], CLOSE), droppable=False)
+                    break
+                if opcode == PING:
+                    viewer.send(ws_frame(payload, PONG), droppable=False)
+        except (EOFError, OSError, struct.error):
+            pass
+        finally:
+            viewer.close()
+            viewer.join(1)  # the close frame, before the server closes the socket
+            log.info('viewer', f"Viewer {address} left, {viewer.dropped} frames dropped", address=address,
+                     dropped=viewer.dropped)
+
+    def run_frames(self):
+        # one encoded frame per interval for every viewer, only if something changed
+        while not self._stop.wait(self.frame_interval):
+            with self.lock:
+                updates = [update for update in (feed.take() for feed in self.feeds) if update is not None]
+                self.viewers = [viewer for viewer in self.viewers if not viewer.closed]
+                viewers = list(self.viewers)
+            if not updates:
+                continue
+            data = ws_frame(json.dumps({'stations': updates}, separators=(',', ':')).encode())
+            self.frames += 1
+            self.frame_bytes += len(data)
+            for viewer in viewers:
+                viewer.send(data)
+
+    def start(self):
+        # serves from threads of its own, e.g. inside the broker process
+        threading.Thread(target=self.server.serve_forever, name="Dashboard HTTP", daemon=True).start()
+        threading.Thread(target=self.run_frames, name="Dashboard frames", daemon=True).start()
+        log.info('dashboard', f"Dashboard on http://{self.address}/", address=self.address)
+        return self
+
+    def close(self):
+        self._stop.set()
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            viewers, self.viewers = self.viewers, []
+        for viewer in viewers:
+            viewer.close()
+        for feed in self.feeds:
+            feed.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve running brokers to browsers")
+    parser.add_argument('--broker', action='append', metavar='[NAME=]ADDRESS',
+                        help=f"broker to show, repeat it for one tile per station (default {DEFAULT_ADDRESS})")
+    parser.add_argument('--http', default=DEFAULT_HTTP, metavar='HOST:PORT', help="where browsers connect")
+    parser.add_argument('--window', type=float, default=60, help="seconds of history shown")
+    args = parser.parse_args()
+
+    dashboard = Dashboard(args.broker or [DEFAULT_ADDRESS], args.http, window=args.window).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dashboard.close()
@@ -0,0 +1,159 @@
+import numpy as np
+
+from rolling import RollingStats
+from session import Event
+
+TOUCH = 'touch'
+PUNCTURE = 'puncture'
+PLATEAU = 'plateau'  # stable readings above threshold while in puncture state
+DIP = 'dip'  # the puncture count rule from test1.py
+
+_NO_ACTION = 0
+_TOUCH_ACTION = 1
+_PUNCTURE_ACTION = 2
+_KINDS = {_TOUCH_ACTION: TOUCH, _PUNCTURE_ACTION: PUNCTURE}
+
+
+class DetectionResult:
+    __slots__ = ('events', 'threshold', 'high_threshold', 'punc_threshold', 'puncture_mask', 'plateau_index')
+
+    def __init__(self, events, threshold, high_threshold, punc_threshold, puncture_mask, plateau_index):
+        self.events = events
+        self.threshold = threshold
+        self.high_threshold = high_threshold
+        self.punc_threshold = punc_threshold
+        self.puncture_mask = puncture_mask  # samples recorded while in puncture state
+        self.plateau_index = plateau_index  # first sample that completed a plateau, or None
+
+
+class EventDetector:
+    # The touch / puncture rules that used to run inline in animate(), on whole
+    # arrays. State is carried between calls, so feeding a recording batch by
+    # batch gives exactly the same events as one call over the whole array.
+    #  - thresholds follow the moving average once `window` samples are in,
+    #    before that the calibrated values are used
+    #  - a sample below threshold after the first one of a span is touch, or
+    #    puncture once the span is puncture_after seconds old; the first sample
+    #    back above threshold is touch if the span was shorter than that
+    #  - in puncture state, stable_samples repeats of the same value above
+    #    threshold is a plateau
+    #  - a value below puncThreshold followed by two values at or below
+    #    highThreshold is a dip
+    def __init__(self, window=50, low_margin=0.0015, high_margin=0.00025, punc_margin=0.00029,
+                 puncture_after=3, stable_samples=5, threshold=15000, high_threshold=0, punc_threshold=0):
+        self.low_margin = low_margin
+        self.high_margin = high_margin
+        self.punc_margin = punc_margin
+        self.puncture_after = puncture_after
+        self.stable_samples = stable_samples
+        self.rolling = RollingStats(window)
+        self.set_thresholds(threshold, high_threshold, punc_threshold)
+        self.reset()
+
+    def reset(self):
+        self.rolling.reset()
+        self.below_since = None  # start time of the current below threshold span
+        self.state = None  # TOUCH or PUNCTURE, the last one reported
+        self.puncture_active = False
+        self.last_value = 0
+        self.stable_count = 0
+        self.history = np.empty(0, dtype=np.float64)  # last two values for the dip rule
+        self.dip_count = 0
+
+    def set_thresholds(self, threshold, high_threshold, punc_threshold):
+        self.threshold = threshold
+        self.high_threshold = high_threshold
+        self.punc_threshold = punc_threshold
+
+    def interrupt(self):
+        # acquisition was stopped, a below threshold span cannot continue over the gap
+        self.below_since = None
+
+    def process(self, times, values):
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values)
+        n = len(values)
+        idx = np.arange(n)
+        if n == 0:
+            empty = np.empty(0)
+            return DetectionResult([], empty, empty, empty, np.zeros(0, dtype=bool), None)
+
+        means = self.rolling.update(values)
+        full = ~np.isnan(means)
+        threshold = np.where(full, means - self.low_margin * means, self.threshold)
+        high_threshold = np.where(full, means + self.high_margin * means, self.high_threshold)
+        punc_threshold = np.where(full, means - self.punc_margin * means, self.punc_threshold)
+        self.set_thresholds(float(threshold[-1]), float(high_threshold[-1]), float(punc_threshold[-1]))
+
+        # run length encoding of the below threshold spans
+        below = values < threshold
+        prev_below = np.concatenate(([self.below_since is not None], below[:-1]))
+        starts = below & ~prev_below
+        last_start = np.maximum.accumulate(np.where(starts, idx, -1))
+        carried = np.nan if self.below_since is None else self.below_since
+        span_start = np.where(last_start >= 0, times[np.maximum(last_start, 0)], carried)
+        elapsed = times - span_start
+        self.below_since = float(span_start[-1]) if below[-1] else None
+
+        actions = np.zeros(n, dtype=np.int8)
+        in_span = below & ~starts
+        actions[in_span & (elapsed >= self.puncture_after)] = _PUNCTURE_ACTION
+        actions[in_span & (elapsed < self.puncture_after)] = _TOUCH_ACTION
+        span_end = ~below & prev_below
+        actions[span_end & (elapsed < self.puncture_after)] = _TOUCH_ACTION
+
+        # puncture state holds from a puncture action until the next touch action
+        last_action = np.maximum.accumulate(np.where(actions != _NO_ACTION, idx, -1))
+        puncture_mask = np.where(last_action >= 0, actions[np.maximum(last_action, 0)] == _PUNCTURE_ACTION,
+                                 self.puncture_active)
+        self.puncture_active = bool(puncture_mask[-1])
+
+        found = []  # (sample index, order within the sample, kind)
+        acted = np.flatnonzero(actions)
+        if len(acted):
+            kinds = actions[acted]
+            previous = {None: _NO_ACTION, TOUCH: _TOUCH_ACTION, PUNCTURE: _PUNCTURE_ACTION}[self.state]
+            changed = kinds != np.concatenate(([previous], kinds[:-1]))
+            for i, kind in zip(acted[changed].tolist(), kinds[changed].tolist()):
+                found.append((i, 0, _KINDS[kind]))
+            self.state = _KINDS[int(kinds[-1])]
+
+        # plateau: count of repeated values among puncture samples above threshold
+        plateau_index = None
+        candidates = np.flatnonzero(puncture_mask & (values > threshold))
+        if len(candidates):
+            v = values[candidates]
+            same = v == np.concatenate(([self.last_value], v[:-1]))
+            repeats = np.cumsum(same)
+            reset_at = np.maximum.accumulate(np.where(~same, repeats, -1))
+            count = np.where(reset_at >= 0, repeats - reset_at, self.stable_count + repeats)
+            previous_count = np.concatenate(([self.stable_count], count[:-1]))
+            reached = candidates[(count >= self.stable_samples) & (previous_count < self.stable_samples)]
+            for i in reached.tolist():
+                found.append((i, 1, PLATEAU))
+            if len(reached):
+                plateau_index = int(reached[0])
+            self.last_value = v[-1].item()
+            self.stable_count = int(count[-1])
+
+        # dips need the two samples before each one, carried from the last batch
+        joined = np.concatenate((self.history, values))
+        offset = len(self.history)
+        has_history = idx + offset >= 2
+        first = joined[np.maximum(idx + offset - 2, 0)]
+        second = joined[np.maximum(idx + offset - 1, 0)]
+        dips = np.flatnonzero(has_history & (first < punc_threshold) & (second <= high_threshold)
+                              & (values <= high_threshold))
+        for i in dips.tolist():
+            found.append((i, 2, DIP))
+        self.dip_count += len(dips)
+        self.history = joined[-2:].astype(np.float64)
+
+        found.sort()
+        events = [Event(times[i].item(), kind, values[i].item()) for i, _, kind in found]
+        return DetectionResult(events, threshold, high_threshold, punc_threshold, puncture_mask, plateau_index)
+
+
+def detect_events(times, values, **params):
+    # score a whole recording in one pass
+    return EventDetector(**params).process(times, values).events
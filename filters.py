@@ -0,0 +1,187 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Streaming filters between acquisition and detection. The margins of the
+# thresholds are a few hundredths of a percent of the reading, so a little
+# noise or mains pickup is enough to flip touch / puncture. Every stage keeps
+# its state between chunks and gives the same output however the signal is
+# cut into chunks, so running a FilterChain over a whole recording reproduces
+# what the live pipeline saw sample for sample.
+# Sections are rows of (b0, b1, b2, 1, a1, a2), the layout of scipy's sos.
+DEFAULT_RATE = 80  # samples per second of the HX711 in fast mode
+MAD_SIGMA = 1.4826  # MAD of normal noise times this is its standard deviation
+
+
+def fold(frequency, rate):
+    # where a frequency lands once sampled at `rate`: 50 Hz mains sampled at
+    # 80 Hz shows up at 30 Hz
+    folded = frequency % rate
+    folded = rate - folded if folded > rate / 2 else folded
+    if folded <= 0 or folded >= rate / 2:
+        raise ValueError(f"{frequency} Hz aliases to {folded:g} Hz at {rate:g} samples/s, it cannot be notched")
+    return folded
+
+
+def _section(b, a):
+    return [b[0] / a[0], b[1] / a[0], b[2] / a[0], 1.0, a[1] / a[0], a[2] / a[0]]
+
+
+def lowpass_sections(cutoff, rate, order=2):
+    # Butterworth low-pass of an even order as order / 2 biquads (bilinear transform)
+    if order < 2 or order % 2:
+        raise ValueError(f"low-pass order must be even, got {order}")
+    if not 0 < cutoff < rate / 2:
+        raise ValueError(f"low-pass cutoff {cutoff} Hz must be below half the sample rate, {rate / 2:g} Hz")
+    w0 = 2 * math.pi * cutoff / rate
+    cos_w0, sin_w0 = math.cos(w0), math.sin(w0)
+    sections = []
+    for k in range(order // 2):
+        q = 1 / (2 * math.cos(math.pi * (2 * k + 1) / (2 * order)))  # Q of each Butterworth pole pair
+        alpha = sin_w0 / (2 * q)
+        sections.append(_section(((1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2),
+                                 (1 + alpha, -2 * cos_w0, 1 - alpha)))
+    return np.array(sections)
+
+
+def notch_sections(frequency, rate, q=30):
+    # one biquad with a zero at `frequency` (folded into the sampled band);
+    # the notch is frequency / q wide
+    w0 = 2 * math.pi * fold(frequency, rate) / rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / (2 * q)
+    return np.array([_section((1, -2 * cos_w0, 1), (1 + alpha, -2 * cos_w0, 1 - alpha))])
+
+
+class SosFilter:
+    # IIR filter as a cascade of biquads in transposed direct form II. It
+    # starts in the steady state of its first sample, so the ~650000 count
+    # baseline does not ring through the detector as a giant step. The
+    # recursion runs per sample over Python floats (numpy has no vectorized
+    # IIR); with the same operations in the same order for every sample, the
+    # chunking cannot change the result.
+    def __init__(self, sections):
+        self.sections = [tuple(float(c) for c in section) for section in np.atleast_2d(sections)]
+        self.reset()
+
+    def reset(self):
+        self.state = None  # [z1, z2] per section, from the next sample on
+
+    def steady_state(self, x):
+        state = []
+        for b0, b1, b2, _, a1, a2 in self.sections:
+            y = x * (b0 + b1 + b2) / (1 + a1 + a2)
+            z2 = b2 * x - a2 * y
+            state.append([b1 * x - a1 * y + z2, z2])
+            x = y
+        return state
+
+    def process(self, values):
+        x = np.asarray(values, dtype=np.float64).tolist()
+        if not x:
+            return np.empty(0, dtype=np.float64)
+        if self.state is None:
+            self.state = self.steady_state(x[0])
+        for (b0, b1, b2, _, a1, a2), z in zip(self.sections, self.state):
+            z1, z2 = z
+            y = []
+            append = y.append
+            for v in x:
+                out = b0 * v + z1
+                z1 = b1 * v - a1 * out + z2
+                z2 = b2 * v - a2 * out
+                append(out)
+            z[0], z[1] = z1, z2
+            x = y
+        return np.array(x)
+
+
+class MedianDespiker:
+    # Causal Hampel filter: a sample more than `sigmas` robust standard
+    # deviations (MAD_SIGMA * MAD) from the median of the last `width`
+    # samples, itself included, is replaced by that median. Deviations up to
+    # min_deviation counts always pass, for windows where the MAD is 0. Only
+    # raw samples go into the windows, so all a chunk needs from the one
+    # before is its last width - 1 samples; the first ones of a signal pass
+    # unchanged until a window is full.
+    def __init__(self, width=5, sigmas=3.0, min_deviation=1.0):
+        if width < 3:
+            raise ValueError(f"median width must be at least 3, got {width}")
+        self.width = int(width)
+        self.sigmas = sigmas
+        self.min_deviation = min_deviation
+        self.spikes = 0  # samples replaced so far
+        self.reset()
+
+    def reset(self):
+        self.history = np.empty(0, dtype=np.float64)
+
+    def process(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        joined = np.concatenate((self.history, values))
+        self.history = joined[max(len(joined) - (self.width - 1), 0):]
+        if len(joined) < self.width:
+            return values
+        windows = sliding_window_view(joined, self.width)[-len(values):]
+        skip = len(values) - len(windows)  # samples without a full window yet
+        median = np.median(windows, axis=1)
+        mad = np.median(np.abs(windows - median[:, None]), axis=1)
+        spikes = np.abs(values[skip:] - median) > np.maximum(self.sigmas * MAD_SIGMA * mad, self.min_deviation)
+        self.spikes += int(spikes.sum())
+        out = values.copy()
+        out[skip:] = np.where(spikes, median, values[skip:])
+        return out
+
+
+def _stage(name, args, rate):
+    if name == 'median':
+        return MedianDespiker(int(args[0]), *map(float, args[1:])) if args else MedianDespiker()
+    if name == 'lowpass':
+        return SosFilter(lowpass_sections(float(args[0]), rate, *(int(a) for a in args[1:])))
+    if name == 'notch':
+        return SosFilter(notch_sections(float(args[0]), rate, *(float(a) for a in args[1:])))
+    raise ValueError(f"unknown filter stage {name!r}, use median, lowpass or notch")
+
+
+class FilterChain:
+    # The stages of a spec string in order, with the output rounded back to
+    # integer counts like the raw readings (the plateau rule compares values
+    # for equality). Spec items are name:arg[:arg], comma separated:
+    #   rate:HZ               sample rate the frequencies refer to (DEFAULT_RATE)
+    #   median:WIDTH[:SIGMAS[:MIN]]   see MedianDespiker
+    #   notch:HZ[:Q]          e.g. notch:50 for mains pickup
+    #   lowpass:HZ[:ORDER]    Butterworth, ORDER even
+    # e.g. "rate:80,median:5,notch:50,lowpass:10"
+    def __init__(self, spec):
+        self.spec = spec
+        items = [item.strip().split(':') for item in spec.split(',') if item.strip()]
+        rate = DEFAULT_RATE
+        try:
+            for name, *args in items:
+                if name == 'rate':
+                    rate = float(args[0])
+                    if not rate > 0:
+                        raise ValueError(f"sample rate must be positive, got {args[0]}")
+            self.stages = [_stage(name, args, rate) for name, *args in items if name != 'rate']
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"bad filter spec {spec!r}: {e}") from None
+        self.rate = rate
+
+    def reset(self):
+        # after a gap in the signal, start over from the next sample
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, values):
+        if not self.stages or len(values) == 0:
+            return values
+        x = values
+        for stage in self.stages:
+            x = stage.process(x)
+        return np.rint(x).astype(np.int64)
+
+
+def filter_signal(values, spec):
+    # a whole recorded array through a fresh chain, as the live pipeline would filter it
+    return FilterChain(spec).process(np.asarray(values))
@@ -0,0 +1,210 @@
+import csv
+import json
+import os
+
+import numpy as np
+
+from archive import SUFFIX as ARCHIVE_SUFFIX, SessionArchive
+from recorder import read_recording
+from session import THRESHOLD_NAMES, Event, SessionBuffer, match_puncture
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet / Arrow export is optional
+    pa = None
+
+# Export formats besides CSV. Every format keeps four tables:
+#   samples     time, value, puncture (True for samples taken in puncture state)
+#   events      time, kind, value
+#   meta        key, value (JSON), e.g. the calibrated thresholds
+#   thresholds  time, threshold, high_threshold, punc_threshold as they changed
+# .npz holds them as arrays named <table>_<column> in one compressed file.
+# Parquet and Arrow (Feather v2) write one file per table, <base>.<table>.parquet
+# or <base>.<table>.arrow. CSV keeps only the samples and the threshold history,
+# in <base>.csv and <base>.thresholds.csv.
+FORMATS = ('csv', 'npz', 'parquet', 'arrow')
+TABLES = ('samples', 'events', 'meta', 'thresholds')
+THRESHOLD_CSV_HEADER = ['Time (s)', 'Threshold', 'High Threshold', 'Puncture Threshold']
+
+
+def available_formats():
+    return FORMATS if pa is not None else ('csv', 'npz')
+
+
+def tables(session):
+    # the tables as dicts of columns, straight from the session arrays
+    samples = {
+        'time': session.samples.times,
+        'value': session.samples.values,
+        'puncture': session.puncture_mask.flags,
+    }
+    events = {
+        'time': np.array([e.time for e in session.events], dtype=np.float64),
+        'kind': np.array([e.kind for e in session.events], dtype=str),
+        'value': np.array([np.nan if e.value is None else e.value for e in session.events], dtype=np.float64),
+    }
+    meta = {
+        'key': np.array(list(session.meta), dtype=str),
+        'value': np.array([json.dumps(v) for v in session.meta.values()], dtype=str),
+    }
+    # the three threshold series are always appended together
+    thresholds = {'time': session.thresholds[THRESHOLD_NAMES[0]].times}
+    thresholds.update((name, session.thresholds[name].values) for name in THRESHOLD_NAMES)
+    return {'samples': samples, 'events': events, 'meta': meta, 'thresholds': thresholds}
+
+
+def from_tables(data):
+    session = SessionBuffer()
+    samples = data['samples']
+    times = np.asarray(samples['time'], dtype=np.float64)
+    values = np.asarray(samples['value'])
+    session.add_samples(times, values, np.asarray(samples['puncture'], dtype=bool))
+    events = data['events']
+    for t, kind, value in zip(np.asarray(events['time']).tolist(), np.asarray(events['kind']).tolist(),
+                              np.asarray(events['value'], dtype=np.float64).tolist()):
+        session.events.append(Event(t, kind, None if np.isnan(value) else int(value)))
+    meta = data['meta']
+    for key, value in zip(np.asarray(meta['key']).tolist(), np.asarray(meta['value']).tolist()):
+        session.meta[key] = json.loads(value)
+    add_thresholds(session, data.get('thresholds'))
+    return session
+
+
+def add_thresholds(session, columns):
+    # exports from before the thresholds table have none
+    if not columns or 'time' not in columns:
+        return
+    times = np.asarray(columns['time'], dtype=np.float64)
+    for name in THRESHOLD_NAMES:
+        session.thresholds[name].extend(times, np.asarray(columns[name], dtype=np.float64))
+
+
+def table_path(base, table, suffix):
+    return f'{base}.{table}.{suffix}'
+
+
+def export_thresholds_csv(session, path):
+    series = [session.thresholds[name] for name in THRESHOLD_NAMES]
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(THRESHOLD_CSV_HEADER)
+        writer.writerows(zip(series[0].times.tolist(), *(s.values.tolist() for s in series)))
+    return path
+
+
+def export_npz(session, path):
+    arrays = {f'{table}_{column}': values
+              for table, columns in tables(session).items() for column, values in columns.items()}
+    with open(path, 'wb') as f:  # np.savez_compressed would append .npz to other names
+        np.savez_compressed(f, **arrays)
+    return [path]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet and Arrow export need pyarrow (pip install pyarrow)")
+
+
+def export_parquet(session, base):
+    _require_pyarrow()
+    paths = []
+    for table, columns in tables(session).items():
+        path = table_path(base, table, 'parquet')
+        pq.write_table(pa.table(columns), path, compression='zstd')
+        paths.append(path)
+    return paths
+
+
+def export_arrow(session, base):
+    _require_pyarrow()
+    paths = []
+    for table, columns in tables(session).items():
+        path = table_path(base, table, 'arrow')
+        feather.write_feather(pa.table(columns), path, compression='zstd')
+        paths.append(path)
+    return paths
+
+
+def export_session(session, base, fmt):
+    # writes base.csv, base.npz or the per-table Parquet / Arrow files; returns the paths
+    if fmt == 'csv':
+        session.export_csv(base + '.csv')
+        return [base + '.csv', export_thresholds_csv(session, table_path(base, 'thresholds', 'csv'))]
+    if fmt == 'npz':
+        return export_npz(session, base + '.npz')
+    if fmt == 'parquet':
+        return export_parquet(session, base)
+    if fmt == 'arrow':
+        return export_arrow(session, base)
+    raise ValueError(f"unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+def load_npz(path):
+    with np.load(path) as data:
+        return from_tables({table: {name[len(table) + 1:]: data[name] for name in data.files
+                                    if name.startswith(table + '_')} for table in TABLES})
+
+
+def load_tables(base, suffix):
+    _require_pyarrow()
+    read = pq.read_table if suffix == 'parquet' else feather.read_table
+    data = {}
+    for table in TABLES:
+        path = table_path(base, table, suffix)
+        if table == 'thresholds' and not os.path.exists(path):
+            continue
+        columns = read(path).to_pydict()
+        data[table] = {name: np.array(values) for name, values in columns.items()}
+    return from_tables(data)
+
+
+def load_csv(path):
+    # CSV from Export Data: Time, Value and the shorter puncture columns, and
+    # the threshold history from <base>.thresholds.csv if there is one
+    base, suffix = os.path.splitext(path)
+    if base.endswith('.thresholds'):
+        base = base[:-len('.thresholds')]
+        path = base + suffix
+    data = np.genfromtxt(path, delimiter=',', skip_header=1, usecols=(0, 1, 2, 3), ndmin=2)
+    session = SessionBuffer()
+    session.samples.extend(data[:, 0], data[:, 1].astype(np.int64))
+    puncture = data[~np.isnan(data[:, 2])]
+    session.puncture.extend(puncture[:, 2], puncture[:, 3].astype(np.int64))
+    session.puncture_mask.extend(match_puncture(session.samples.times, session.puncture.times))
+    path = table_path(base, 'thresholds', 'csv')
+    if os.path.exists(path):
+        with open(path, newline='') as csvfile:
+            rows = list(csv.reader(csvfile))[1:]
+        data = np.array(rows, dtype=np.float64).reshape(-1, 1 + len(THRESHOLD_NAMES))
+        add_thresholds(session, dict(zip(('time',) + THRESHOLD_NAMES, data.T)))
+    return session
+
+
+def split_table_path(path):
+    # 'x.samples.parquet' or 'x.parquet' -> ('x', 'parquet')
+    root, suffix = os.path.splitext(path)
+    base, table = os.path.splitext(root)
+    if table[1:] in TABLES:
+        root = base
+    return root, suffix[1:].lower()
+
+
+def load_session(path):
+    # A SessionBuffer from any exported or recorded session: .csv, .npz,
+    # .parquet / .arrow (any of the table files, or the base name plus the
+    # suffix), .rec recordings and .archive directories.
+    path = str(path).rstrip('/\\')
+    if path.endswith(ARCHIVE_SUFFIX):
+        return SessionArchive(path).to_session()
+    base, suffix = split_table_path(path)
+    if suffix == 'rec':
+        return read_recording(path)
+    if suffix == 'npz':
+        return load_npz(path)
+    if suffix in ('parquet', 'arrow'):
+        return load_tables(base, suffix)
+    if suffix == 'csv':
+        return load_csv(path)
+    raise ValueError(f"unknown session file {path}")
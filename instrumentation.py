@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+_DISABLED = nullcontext()
+
+
+class _Stage:
+    # context manager timing one stage into Instrumentation.record
+    __slots__ = ('perf', 'name', 'start')
+
+    def __init__(self, perf, name):
+        self.perf = perf
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.perf.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation:
+    # Stage latencies of the hot paths, kept as the last `window` durations per
+    # stage so p50/p99 follow what is happening now. Also the samples waiting
+    # in the buffer at each frame, for the effective sample rate and the queue
+    # depth.
+    # Disabled, stage() returns one shared no-op context manager and count()
+    # returns straight away, so the calls can stay in the hot paths.
+    def __init__(self, window=512, enabled=False):
+        self.window = window
+        self.enabled = enabled
+        self.lock = threading.Lock()  # stages are recorded from the reader thread too
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}  # stage -> ring of seconds
+            self.counts = {}  # stage -> total number recorded
+            self.frame_times = np.full(self.window, np.nan)
+            self.frame_samples = np.zeros(self.window, dtype=np.int64)
+            self.frames = 0
+
+    def stage(self, name):
+        if not self.enabled:
+            return _DISABLED
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            ring = self.durations.get(name)
+            if ring is None:
+                ring = self.durations[name] = np.full(self.window, np.nan)
+                self.counts[name] = 0
+            ring[self.counts[name] % self.window] = seconds
+            self.counts[name] += 1
+
+    def count(self, samples):
+        # once per frame, with the number of samples drained from the buffer
+        if not self.enabled:
+            return
+        with self.lock:
+            i = self.frames % self.window
+            self.frame_times[i] = time.perf_counter()
+            self.frame_samples[i] = samples
+            self.frames += 1
+
+    def sample_rate(self):
+        # samples per second over the frames still in the window
+        with self.lock:
+            n = min(self.frames, self.window)
+            if n < 2:
+                return 0.0
+            order = np.argsort(self.frame_times[:n])
+            span = self.frame_times[order[-1]] - self.frame_times[order[0]]
+            # the samples of the oldest frame arrived before the span started
+            samples = self.frame_samples[:n].sum() - self.frame_samples[order[0]]
+            return float(samples / span) if span > 0 else 0.0
+
+    def summary(self):
+        stages = {}
+        with self.lock:
+            for name, ring in self.durations.items():
+                seconds = ring[:min(self.counts[name], self.window)]
+                p50, p99 = np.percentile(seconds, [50, 99]) * 1000
+                stages[name] = {
+                    'count': self.counts[name],
+                    'p50_ms': float(p50),
+                    'p99_ms': float(p99),
+                    'max_ms': float(seconds.max() * 1000),
+                }
+            depths = self.frame_samples[:min(self.frames, self.window)]
+            queue = {
+                'p50': float(np.percentile(depths, 50)) if len(depths) else 0.0,
+                'max': int(depths.max()) if len(depths) else 0,
+            }
+        return {'stages': stages, 'sample_rate': self.sample_rate(), 'queue_depth': queue, 'frames': self.frames}
+
+    def overlay_text(self):
+        summary = self.summary()
+        lines = [f"{name:<11} p50 {s['p50_ms']:6.2f}  p99 {s['p99_ms']:6.2f} ms"
+                 for name, s in summary['stages'].items()]
+        lines.append(f"rate {summary['sample_rate']:7.1f} S/s  queue p50 {summary['queue_depth']['p50']:.0f} "
+                     f"max {summary['queue_depth']['max']}")
+        return '\n'.join(lines)
+
+    def dump(self, path, **extra):
+        # summary plus the raw durations still in the window, as JSON
+        report = self.summary()
+        report['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        report.update(extra)
+        with self.lock:
+            report['durations_ms'] = {name: (ring[:min(self.counts[name], self.window)] * 1000).tolist()
+                                      for name, ring in self.durations.items()}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
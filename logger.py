@@ -0,0 +1,172 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+
+class SessionLogger:
+    # Levelled logger that never touches a file or the console on the calling
+    # thread: records go on a queue and a writer thread appends them in batches
+    # as JSON lines to the current session file (start_session), echoing INFO
+    # and above to stderr. Each event name may log `burst` records per
+    # `interval` seconds, the rest are counted and reported as one
+    # 'suppressed' record. The level can be changed at any time, e.g. to turn
+    # the DEBUG sample records on while running.
+    def __init__(self, directory='logs', level=INFO, burst=20, interval=1.0, echo_level=INFO,
+                 flush_interval=0.2):
+        self.directory = directory
+        self.level = level
+        self.burst = burst
+        self.interval = interval
+        self.echo_level = echo_level
+        self.flush_interval = flush_interval
+        self.path = None
+        self.records = 0
+        self.suppressed = 0
+        self._limits = {}  # event -> [window start, count in window, suppressed in window]
+        self._limits_lock = threading.Lock()  # any thread may log
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._closed = False
+        self._thread = threading.Thread(target=self.run, name="SessionLogger", daemon=True)
+        self._thread.start()
+
+    def is_enabled_for(self, level):
+        return level >= self.level
+
+    def set_level(self, level):
+        self.level = level
+        self.info('log_level', f"Log level {LEVEL_NAMES.get(level, level)}")
+
+    def start_session(self, name=None):
+        # later records go to a new file logs/<name>.jsonl, default session-<time>
+        name = name or time.strftime('session-%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f'{name}.jsonl')
+        self._queue.put(('open', path))
+        self.path = path
+        return path
+
+    def log(self, level, event, message='', limit=True, **fields):
+        if level < self.level or self._closed:
+            return
+        now = time.time()
+        if limit and not self._allow(event, now):
+            return
+        record = {'t': now, 'level': LEVEL_NAMES.get(level, level), 'event': event}
+        if message:
+            record['msg'] = message
+        record.update(fields)
+        self.records += 1
+        self._queue.put(('record', (level, record)))
+
+    def debug(self, event, message='', **fields):
+        self.log(DEBUG, event, message, **fields)
+
+    def info(self, event, message='', **fields):
+        self.log(INFO, event, message, **fields)
+
+    def warning(self, event, message='', **fields):
+        self.log(WARNING, event, message, **fields)
+
+    def error(self, event, message='', **fields):
+        self.log(ERROR, event, message, **fields)
+
+    def _allow(self, event, now):
+        with self._limits_lock:
+            state = self._limits.get(event)
+            if state is None or now - state[0] >= self.interval:
+                if state is not None and state[2]:
+                    record = {'t': now, 'level': 'INFO', 'event': 'suppressed', 'key': event, 'count': state[2],
+                              'msg': f"{state[2]} '{event}' records suppressed"}
+                    self._queue.put(('record', (INFO, record)))
+                self._limits[event] = [now, 1, 0]
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            self.suppressed += 1
+            return False
+
+    def flush(self, timeout=2):
+        # blocks until everything queued so far is written
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(('close', None))
+        self._thread.join(2)
+
+    def open_file(self, path):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8')
+        except OSError as e:
+            sys.stderr.write(f"Cannot open log file {path}: {e}\n")
+
+    def write(self, batch):
+        lines = []
+        echo = []
+        for level, record in batch:
+            lines.append(json.dumps(record, default=str))
+            if level >= self.echo_level:
+                echo.append(record.get('msg') or record['event'])
+        if self._file is not None:
+            try:
+                self._file.write('\n'.join(lines) + '\n')
+                self._file.flush()
+            except OSError as e:
+                sys.stderr.write(f"Log file write failed: {e}\n")
+        if echo:
+            sys.stderr.write('\n'.join(echo) + '\n')
+
+    def run(self):
+        while True:
+            # block for the first item, then take whatever else is queued
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while items[-1][0] == 'record':
+                try:
+                    items.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            batch = []
+            for kind, payload in items:
+                if kind == 'record':
+                    batch.append(payload)
+                    continue
+                if batch:
+                    self.write(batch)
+                    batch = []
+                if kind == 'open':
+                    self.open_file(payload)
+                elif kind == 'flush':
+                    payload.set()
+                elif kind == 'close':
+                    if self._file is not None:
+                        self._file.close()
+                        self._file = None
+                    return
+            if batch:
+                self.write(batch)
+
+
+# shared by the GUI and the acquisition modules
+log = SessionLogger()
+atexit.register(log.close)
@@ -0,0 +1,133 @@
+import numpy as np
+
+from detector import TOUCH, PUNCTURE, PLATEAU
+from session import THRESHOLD_NAMES
+
+GREAT_SECONDS = 6  # puncture to lowest reading longer than this is a great blood drawing
+
+
+class OutcomeMetrics:
+    # What a measurement is judged by, kept up to date batch by batch from
+    # the samples the pipeline keeps, so Stop has the verdict without scanning
+    # the session: the lowest reading in puncture state and when it came, the
+    # time spent in puncture state and below each threshold, event counts,
+    # the longest run of equal readings and the plateau. Every interval
+    # between two samples counts for the state of the first one; after
+    # interrupt() the next sample starts afresh, so a pause is not counted.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.start_time = None
+        self.end_time = None
+        self.puncture_start = None  # time of the first sample in puncture state
+        self.min_value = None  # lowest reading in puncture state, the first one on a tie
+        self.min_time = None
+        self.puncture_samples = 0
+        self.puncture_seconds = 0.0
+        self.below_seconds = dict.fromkeys(THRESHOLD_NAMES, 0.0)
+        self.touches = 0
+        self.punctures = 0
+        self.longest_run = 0  # samples in the longest run of equal readings
+        self.run = 0  # repeats of last_value so far
+        self.last_value = None
+        self.plateau_time = None
+        self.plateau_value = None
+        self.last = None  # (time, puncture, below each threshold) of the last sample
+
+    def interrupt(self):
+        self.last = None
+
+    def update(self, times, values, puncture, thresholds, events=()):
+        # one batch as kept in the session; thresholds are the per sample
+        # (threshold, high_threshold, punc_threshold) arrays
+        n = len(values)
+        if n == 0:
+            return
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values)
+        puncture = np.asarray(puncture, dtype=bool)
+        if self.start_time is None:
+            self.start_time = float(times[0])
+        self.end_time = float(times[-1])
+        self.samples += n
+
+        # state of each sample and the interval up to the next one
+        flags = np.vstack([puncture] + [values < np.asarray(t) for t in thresholds])
+        if self.last is None:
+            dt = np.diff(times)
+            starts = flags[:, :-1]
+        else:
+            dt = np.diff(times, prepend=self.last[0])
+            starts = np.hstack((np.array(self.last[1:], dtype=bool)[:, None], flags[:, :-1]))
+        seconds = (starts * dt).sum(axis=1)
+        self.puncture_seconds += float(seconds[0])
+        for name, value in zip(THRESHOLD_NAMES, seconds[1:].tolist()):
+            self.below_seconds[name] += value
+        self.last = (self.end_time, *flags[:, -1].tolist())
+
+        if puncture.any():
+            in_puncture = np.flatnonzero(puncture)
+            if self.puncture_start is None:
+                self.puncture_start = float(times[in_puncture[0]])
+            lowest = in_puncture[np.argmin(values[in_puncture])]
+            if self.min_value is None or values[lowest] < self.min_value:
+                self.min_value = values[lowest].item()
+                self.min_time = float(times[lowest])
+            self.puncture_samples += len(in_puncture)
+
+        # runs of equal readings, carried over from the last batch
+        previous = np.concatenate(([values[0] if self.last_value is None else self.last_value], values[:-1]))
+        same = values == previous
+        if self.last_value is None:
+            same[0] = False
+        repeats = np.cumsum(same)
+        reset_at = np.maximum.accumulate(np.where(~same, repeats, -1))
+        count = np.where(reset_at >= 0, repeats - reset_at, self.run + repeats)
+        self.longest_run = max(self.longest_run, int(count.max()) + 1)
+        self.run = int(count[-1])
+        self.last_value = values[-1].item()
+
+        for event in events:
+            if event.kind == TOUCH:
+                self.touches += 1
+            elif event.kind == PUNCTURE:
+                self.punctures += 1
+            elif event.kind == PLATEAU and self.plateau_time is None:
+                self.plateau_time, self.plateau_value = event.time, event.value
+
+    @property
+    def puncture_to_min(self):
+        # seconds from the puncture to the lowest reading, None without a puncture
+        if self.puncture_start is None:
+            return None
+        return self.min_time - self.puncture_start
+
+    def summary(self):
+        # plain numbers, for the session meta, the recording and the log
+        elapsed = self.puncture_to_min
+        return {
+            'samples': self.samples,
+            'duration': None if self.start_time is None else self.end_time - self.start_time,
+            'puncture_start': self.puncture_start,
+            'min_value': self.min_value,
+            'min_time': self.min_time,
+            'puncture_to_min': elapsed,
+            'great': None if elapsed is None else elapsed > GREAT_SECONDS,
+            'puncture_samples': self.puncture_samples,
+            'puncture_seconds': self.puncture_seconds,
+            **{f'below_{name}_seconds': seconds for name, seconds in self.below_seconds.items()},
+            'touches': self.touches,
+            'punctures': self.punctures,
+            'longest_stable_run': self.longest_run,
+            'plateau_time': self.plateau_time,
+            'plateau_value': self.plateau_value,
+        }
+
+
+def verdict(outcome):
+    # the text shown on Stop for a summary() (None if the station did not answer)
+    if not outcome or outcome['puncture_to_min'] is None:
+        return 'No puncture detected'
+    return 'Great blood drawing!!!' if outcome['great'] else 'Try again'
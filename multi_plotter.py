@@ -0,0 +1,251 @@
+import atexit
+import math
+import time
+import tkinter as tk
+
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+
+from detector import PUNCTURE
+from instrumentation import Instrumentation
+from logger import log
+from metrics import verdict
+from recorder import recover_all
+from renderer import BlitRenderer
+from station import Station, CALIBRATING, ACQUIRING, STOPPED
+from process_station import ProcessStation
+from viewer import ReviewWindow
+
+
+class MultiStationPlotter:
+    # Several load cells in one window, a tile each. Every station has its own
+    # reader thread, pipeline, thresholds and recording (see Station); one Tk
+    # frame loop schedules them all. Each frame first drains and processes
+    # every station, so no ring buffer overflows whatever the drawing costs,
+    # then redraws the tiles with new samples round robin until `budget` of
+    # the frame interval is used: with many stations a tile may show its data
+    # a frame later, but no sample is lost. Tiles whose axis limits move share
+    # one full canvas draw per frame. Double click a tile to review it. With
+    # multiprocess every station acquires in a process of its own.
+    def __init__(self, root, device_urls, perf=False, recording_dir='recordings', frame_interval=50, budget=0.6,
+                 duration=60, window=10, multiprocess=False, filter_spec=None):
+        self.root = root
+        self.root.title(f"Real-Time Plotter - {len(device_urls)} stations")
+        self.frame_interval = frame_interval
+        self.budget = budget * frame_interval / 1000  # seconds of each frame the tiles may take
+        self.duration = duration  # seconds of acquisition per measurement, like the single station countdown
+        self.recording_dir = recording_dir
+        self.chart_threshold = 650000
+        self.perf = Instrumentation(enabled=perf)
+        # readers wake every 10 ms for a batch instead of once per frame of every device
+        station = ProcessStation if multiprocess else Station
+        self.stations = [station(f'station{i + 1}', device_url=url, perf=self.perf, batch_interval=0.01,
+                                 filter_spec=filter_spec) for i, url in enumerate(device_urls)]
+        self.dirty = [False] * len(self.stations)  # new samples since the tile was last drawn
+        self.cursor = 0  # first tile to draw next frame
+        recover_all(self.recording_dir)  # recordings left unfinished by a crash
+        atexit.register(self.close)
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+
+        columns = math.ceil(math.sqrt(len(self.stations)))
+        rows = math.ceil(len(self.stations) / columns)
+        self.fig = Figure(figsize=(4 * columns, 3 * rows))
+        axes = list(self.fig.subplots(rows, columns, squeeze=False).flat)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=root)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.renderers = []
+        for i, (station, ax) in enumerate(zip(self.stations, axes)):
+            title = f"Station {i + 1}" + (f" ({station.device_url})" if station.device_url else '')
+            self.renderers.append(BlitRenderer(self.fig, ax, window=window, title=title, legend=False))
+        for ax in axes[len(self.stations):]:
+            ax.set_visible(False)  # the unused cells of the last row
+        first = self.renderers[0]
+        self.fig.legend(handles=[first.threshold_line, first.high_threshold_line, first.punc_threshold_line],
+                        loc='upper right')
+        self.fig.tight_layout()
+        self.canvas.mpl_connect('button_press_event', self.on_click)
+
+        frame = tk.Frame(root)
+        frame.pack()
+        tk.Button(frame, text="Start All", command=self.start_all).pack(side=tk.LEFT, padx=10, pady=10)
+        tk.Button(frame, text="Stop All", command=self.stop_all).pack(side=tk.LEFT, padx=10, pady=10)
+        for text, seconds in (("10 s", 10), ("60 s", 60), ("All", None)):
+            tk.Button(frame, text=text, command=lambda w=seconds: self.set_view_window(w)).pack(side=tk.LEFT, pady=10)
+
+        status = tk.Frame(root)
+        status.pack()
+        self.status_labels = []
+        for i, station in enumerate(self.stations):
+            label = tk.Label(status, text=f'{station.name}: waiting', font=('Courier', 12), anchor=tk.W, width=60)
+            label.grid(row=i // 2, column=i % 2, padx=10, sticky=tk.W)
+            self.status_labels.append(label)
+        self.perf_label = tk.Label(root, text='', font=('Courier', 10), justify=tk.LEFT)
+        if self.perf.enabled:
+            self.perf_label.pack()
+        self.root.bind('<F12>', self.toggle_instrumentation)
+
+        self.frame_count = 0
+        self.root.after(self.frame_interval, self.next_frame)
+
+    def set_status(self, i, text):
+        self.status_labels[i].config(text=f'{self.stations[i].name}: {text}')
+
+    def start_all(self):
+        # calibrates every idle station; each starts acquiring once its own calibration is done
+        name = time.strftime('session-%Y%m%d-%H%M%S')
+        log.start_session(name)  # one log file for all stations, records carry the station name
+        for i, station in enumerate(self.stations):
+            if station.status in (CALIBRATING, ACQUIRING):
+                continue
+            if station.status == STOPPED:
+                station.reset_graph()  # a new measurement, time restarts at 0
+            station.start_recording(self.recording_dir, f'{name}-{station.name}')
+            if station.start_calibration():
+                self.set_status(i, 'calibrating')
+            else:
+                self.set_status(i, 'Arduino not found')
+
+    def stop_all(self):
+        for i, station in enumerate(self.stations):
+            if station.status in (CALIBRATING, ACQUIRING):
+                self.stop_station(i)
+
+    def stop_station(self, i):
+        station = self.stations[i]
+        if station.calibrating:
+            station.stop()
+            self.set_status(i, 'calibration cancelled')
+            return
+        outcome = station.stop()
+        if outcome and outcome['puncture_to_min'] is not None:
+            elapsed = outcome['puncture_to_min']
+            log.info('result', f"Puncture to minimum {elapsed:.2f} s", station=station.name, elapsed=elapsed)
+        else:
+            log.info('result', "No puncture detected", station=station.name)
+        self.set_status(i, f'stopped, {verdict(outcome)}')  # set_status puts the station name in front
+
+    def calibrated(self, i):
+        station = self.stations[i]
+        thresholds = station.calibrated_thresholds()
+        if thresholds:
+            station.install_thresholds(*thresholds)
+        else:
+            station.set_thresholds(1500, station.high_threshold, station.punc_threshold)
+        self.renderers[i].reset([6000, self.chart_threshold], draw=False)
+        if station.start():
+            self.set_status(i, f'acquiring, threshold {station.threshold:.2f}')
+        else:
+            self.set_status(i, 'Arduino not found')
+
+    def next_frame(self):
+        self.animate(self.frame_count)
+        self.frame_count += 1
+        self.root.after(self.frame_interval, self.next_frame)
+
+    def animate(self, i):
+        if self.perf.enabled and i % 10 == 0:
+            self.perf_label.config(text=self.perf.overlay_text())
+        frame_start = time.perf_counter()
+        samples = 0
+        for k, station in enumerate(self.stations):
+            if station.calibrating:
+                with self.perf.stage('calibration'):
+                    if station.update_calibration():
+                        self.calibrated(k)
+                continue
+            if not station.acquiring:
+                continue
+            with self.perf.stage('read'):
+                times, values = station.read()
+            samples += len(values)
+            if len(values) == 0:
+                continue
+            with self.perf.stage('detect'):
+                result, kept, events = station.process(times, values)
+            self.dirty[k] = True
+            if events:
+                self.set_status(k, 'Puncture' if events[-1].kind == PUNCTURE else 'Touch')
+            if station.stopped or times[kept - 1] >= self.duration:
+                self.stop_station(k)  # data is stable or the time is up
+        self.perf.count(samples)
+        with self.perf.stage('render'):
+            self.draw_tiles(frame_start + self.budget)
+
+    def draw_tiles(self, deadline):
+        # Round robin over the tiles with new samples until the deadline, at
+        # least one tile per frame; blits go straight to the screen. When the
+        # limits of a tile move, full_draw() takes over for this frame.
+        count = len(self.stations)
+        drawn = 0
+        for step in range(count):
+            k = (self.cursor + step) % count
+            if not self.dirty[k]:
+                continue
+            if drawn and time.perf_counter() > deadline:
+                self.cursor = k
+                return
+            drawn += 1
+            changed = self.update_tile(k)
+            if changed:
+                self.cursor = (k + 1) % count
+                self.full_draw()
+                return
+            if changed is not None:
+                self.renderers[k].blit()
+        self.cursor = (self.cursor + 1) % count
+
+    def update_tile(self, k):
+        # sets tile k to its latest samples; True if its limits moved, None if it has none
+        station, renderer = self.stations[k], self.renderers[k]
+        self.dirty[k] = False
+        if len(station.session.samples) == station.pyramid.offset:
+            return None
+        times, values, current_time = station.visible(renderer, int(renderer.ax.bbox.width))
+        if len(values) == 0:
+            return None
+        return renderer.update(times, values, station.threshold, station.high_threshold, station.punc_threshold,
+                               y_center=station.level, current_time=current_time)
+
+    def full_draw(self):
+        # One canvas.draw() for every tile. All tiles move to their next x span
+        # here, so from then on their axes jump on the same frame instead of
+        # costing a full draw each.
+        for k, (station, renderer) in enumerate(zip(self.stations, self.renderers)):
+            if self.dirty[k]:
+                self.update_tile(k)
+            if len(station.session.samples) > station.pyramid.offset:
+                renderer.ax.set_xlim(renderer.next_span(float(station.session.samples.times[-1])))
+            renderer.full_redraws += 1
+        self.canvas.draw()  # every renderer grabs its new background in on_draw
+
+    def set_view_window(self, window):
+        for renderer in self.renderers:
+            renderer.set_window(window)
+        self.dirty = [len(station.session.samples) > station.pyramid.offset for station in self.stations]
+
+    def on_click(self, event):
+        if not event.dblclick:
+            return
+        for station, renderer in zip(self.stations, self.renderers):
+            if event.inaxes is renderer.ax:
+                session = station.session.since(station.graph_mark)
+                if len(session.samples):
+                    ReviewWindow(self.root, session.samples, session.events, session.thresholds,
+                                 title=f"Session Review - {station.name}")
+
+    def toggle_instrumentation(self, event=None):
+        self.perf.enabled = not self.perf.enabled
+        if self.perf.enabled:
+            self.perf.reset()
+            self.perf_label.config(text='')
+            self.perf_label.pack()
+        else:
+            self.perf_label.pack_forget()
+
+    def close(self):
+        for station in self.stations:
+            station.close()
+
+    def on_close(self):
+        self.close()
+        self.root.destroy()
@@ -0,0 +1,76 @@
+from detector import EventDetector, TOUCH, PUNCTURE, PLATEAU
+from instrumentation import Instrumentation
+from metrics import OutcomeMetrics
+from session import SessionBuffer
+
+
+class Pipeline:
+    # Everything between the sample buffer and the screen: detection and the
+    # session record. RealTimePlotter and the headless tools (replay.py) feed
+    # it the same way, with batches of (time since start, value). With a
+    # SessionRecorder everything kept in the session is also written to disk.
+    # With a signal_filter (filters.FilterChain) the detector, the session and
+    # the recording get the filtered values; its spec goes into the meta.
+    # metrics follows the outcome of the session as it goes (OutcomeMetrics).
+    def __init__(self, window=50, threshold=15000, stop_on_plateau=True, recorder=None, signal_filter=None,
+                 perf=None):
+        self.session = SessionBuffer()  # all samples, puncture state samples and events
+        self.detector = EventDetector(window=window, threshold=threshold)
+        self.stop_on_plateau = stop_on_plateau
+        self.recorder = recorder
+        self.signal_filter = signal_filter
+        self.perf = perf or Instrumentation()
+        self.metrics = OutcomeMetrics()
+        self.stopped = False
+        if signal_filter is not None:
+            self.session.meta['filter'] = signal_filter.spec
+
+    @property
+    def thresholds(self):
+        return self.detector.threshold, self.detector.high_threshold, self.detector.punc_threshold
+
+    def process(self, times, values):
+        # Returns (result, kept): the detection result and how many samples of
+        # the batch belong to the session. With stop_on_plateau the session
+        # ends on the sample that completed a plateau.
+        if self.signal_filter is not None:
+            with self.perf.stage('filter'):
+                values = self.signal_filter.process(values)
+        result = self.detector.process(times, values)
+        kept = len(values)
+        if self.stop_on_plateau and result.plateau_index is not None:
+            kept = result.plateau_index + 1
+            self.stopped = True
+        if kept == 0:
+            return result, kept
+        times, values = times[:kept], values[:kept]
+
+        puncture_mask = result.puncture_mask[:kept]
+        self.session.add_samples(times, values, puncture_mask)
+        end_time = float(times[-1])
+        events = []
+        for event in result.events:
+            if event.time > end_time:
+                break
+            if event.kind in (TOUCH, PUNCTURE, PLATEAU):
+                events.append(event)
+        self.session.events.extend(events)
+        # one threshold history point per batch is plenty to draw it later
+        thresholds = (float(result.threshold[kept - 1]), float(result.high_threshold[kept - 1]),
+                      float(result.punc_threshold[kept - 1]))
+        self.session.add_thresholds(end_time, *thresholds)
+        self.metrics.update(times, values, puncture_mask, (result.threshold[:kept], result.high_threshold[:kept],
+                                                           result.punc_threshold[:kept]), events)
+        if self.recorder is not None:
+            self.recorder.append_samples(times, values)
+            self.recorder.append_puncture(times[puncture_mask], values[puncture_mask])
+            self.recorder.append_events(events)
+            self.recorder.append_thresholds(end_time, *thresholds)
+        return result, kept
+
+    def interrupt(self):
+        # acquisition stopped: neither a below threshold span nor the filter state carry over the gap
+        self.detector.interrupt()
+        self.metrics.interrupt()
+        if self.signal_filter is not None:
+            self.signal_filter.reset()
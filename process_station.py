@@ -0,0 +1,310 @@
+import multiprocessing
+import time
+
+import numpy as np
+
+from detector import TOUCH, PUNCTURE
+from logger import log
+from protocol import POLL, STREAM, BINARY
+from shared_ring import SharedRing
+from station import Station, WAITING, CALIBRATING, ACQUIRING, STOPPED
+
+STATUSES = (WAITING, CALIBRATING, ACQUIRING, STOPPED)
+MODES = (POLL, STREAM, BINARY)
+STATES = (None, TOUCH, PUNCTURE)  # Station.state, the last state detected
+# state the acquisition process keeps current in the ring
+FIELDS = ('status', 'calibrating', 'progress', 'count', 'calibrated_threshold', 'calibrated_high', 'calibrated_punc',
+          'threshold', 'high_threshold', 'punc_threshold', 'level', 'puncture_active', 'stopped', 'mode', 'dropped',
+          'lost', 'state')
+
+
+def station_state(station):
+    thresholds = station.calibrated_thresholds() or (np.nan,) * 3
+    progress, count = station.calibration_progress()
+    stats = station.stats()
+    return {
+        'status': STATUSES.index(station.status), 'calibrating': station.calibrating, 'progress': progress,
+        'count': count, 'calibrated_threshold': thresholds[0], 'calibrated_high': thresholds[1],
+        'calibrated_punc': thresholds[2], 'threshold': station.threshold, 'high_threshold': station.high_threshold,
+        'punc_threshold': station.punc_threshold, 'level': station.level, 'puncture_active': station.puncture_active,
+        'stopped': station.stopped, 'mode': MODES.index(stats['mode']) if stats['mode'] in MODES else np.nan,
+        'dropped': stats['dropped'], 'lost': stats['lost'], 'state': STATES.index(station.state),
+    }
+
+
+def start_recording(station, directory, name):
+    log.start_session(f'{name}-{station.name}')  # the acquisition process logs to a file of its own
+    recorder = station.start_recording(directory, name)
+    return recorder.path if recorder is not None else None
+
+
+def install_thresholds(station, *thresholds):
+    station.install_thresholds(*thresholds)
+    return {key: station.session.meta[key] for key in ('threshold', 'high_threshold', 'punc_threshold',
+                                                       'calibrated_at')}
+
+
+# what the GUI process may ask for; every answer is sent back over the pipe
+COMMANDS = {
+    'connect': lambda station: station.connect() is not None,
+    'calibrate': Station.start_calibration,
+    'cancel': Station.cancel_calibration,
+    'start': Station.start,
+    'stop': Station.stop,
+    'outcome': Station.outcome,
+    'reset_graph': Station.reset_graph,
+    'stop_reader': Station.stop_reader,
+    'thresholds': Station.set_thresholds,
+    'install': install_thresholds,
+    'record': start_recording,
+}
+
+
+def advance(station):
+    # One step of a headless station: calibration, or reading and detection.
+    # Returns the samples kept in the session, (times, values, puncture mask),
+    # the values as filtered when the station has a filter.
+    if station.calibrating:
+        station.update_calibration()
+    elif station.acquiring:
+        times, values = station.read()
+        if len(values):
+            result, kept, _ = station.process(times, values)
+            if station.stopped:
+                station.stop()  # plateau: nothing after it belongs to the session
+            if kept:
+                samples = station.session.samples
+                return samples.times[-kept:], samples.values[-kept:], result.puncture_mask[:kept]
+    return (), (), ()
+
+
+def run_station(ring_name, commands, name, device_url, window, threshold, mode, batch_interval, filter_spec,
+                interval):
+    # Body of the acquisition process: a Station driven by the commands from
+    # the GUI process, publishing what it reads and detects to the ring every
+    # `interval` seconds. 'shutdown' or a closed pipe ends it.
+    ring = SharedRing.attach(ring_name, FIELDS)
+    station = Station(name, device_url=device_url, window=window, threshold=threshold, mode=mode,
+                      batch_interval=batch_interval, filter_spec=filter_spec)
+    published = 0  # session events already in the ring
+    try:
+        while True:
+            while commands.poll():
+                command, *args = commands.recv()
+                if command == 'shutdown':
+                    return
+                result = COMMANDS[command](station, *args)
+                ring.publish(**station_state(station))  # the answer only goes out once the state shows it
+                commands.send(result)
+            times, values, puncture = advance(station)
+            events = station.session.events[published:]
+            published += len(events)
+            ring.publish(times, values, puncture, events, **station_state(station))
+            commands.poll(interval)
+    except (EOFError, OSError):
+        pass  # the GUI process is gone
+    finally:
+        station.close()
+        ring.close()
+
+
+class RemoteStation(Station):
+    # A Station whose acquisition, parsing and detection run somewhere else,
+    # with the commands of COMMANDS and the state of FIELDS going back and
+    # forth. Subclasses provide the transport: request(command, *args) runs a
+    # command remotely and returns its answer, receive() returns (times,
+    # values, puncture mask, events, state) published since the last call and
+    # refresh() the current state. What stays here is the session as
+    # published, the pyramid and the plot side.
+    def __init__(self, name='station', **kwargs):
+        super().__init__(name, **kwargs)
+        self.remote = dict.fromkeys(FIELDS, np.nan)  # the state as last published
+        self.pending = (np.zeros(0, dtype=bool), [])  # puncture flags and events of the last read()
+
+    def request(self, command, *args):
+        raise NotImplementedError
+
+    def receive(self):
+        raise NotImplementedError
+
+    def refresh(self):
+        raise NotImplementedError
+
+    def call(self, command, *args):
+        # runs a command remotely and returns its answer, None if the other side is gone
+        try:
+            result = self.request(command, *args)
+        except (EOFError, OSError) as e:
+            log.error('remote_station', f"{self.name} not answering: {e!r}", station=self.name)
+            return None
+        self.remote = self.refresh()
+        return result
+
+    @property
+    def calibrating(self):
+        return self.remote['calibrating'] == 1  # NaN before the first state is published
+
+    @property
+    def stopped(self):
+        return self.remote['stopped'] == 1
+
+    @property
+    def level(self):
+        return self.remote['level']
+
+    def calibration_progress(self):
+        return self.remote['progress'], int(np.nan_to_num(self.remote['count']))
+
+    def calibrated_thresholds(self):
+        thresholds = (self.remote['calibrated_threshold'], self.remote['calibrated_high'],
+                      self.remote['calibrated_punc'])
+        return None if np.isnan(thresholds[0]) else thresholds
+
+    def stats(self):
+        mode = self.remote['mode']
+        return {'mode': None if np.isnan(mode) else MODES[int(mode)],
+                'dropped': int(np.nan_to_num(self.remote['dropped'])), 'lost': int(np.nan_to_num(self.remote['lost']))}
+
+    def connect(self):
+        return self.call('connect')
+
+    def start_reader(self):
+        raise NotImplementedError("the reader runs in the acquisition process, use start_calibration() or start()")
+
+    def stop_reader(self):
+        self.call('stop_reader')
+
+    def start_calibration(self):
+        ok = self.call('calibrate')
+        if ok:
+            self.status = CALIBRATING
+        return bool(ok)
+
+    def update_calibration(self):
+        self.remote = self.refresh()
+        if self.calibrating:
+            return False
+        self.status = WAITING
+        return True
+
+    def cancel_calibration(self):
+        self.call('cancel')
+        self.status = WAITING
+
+    def set_thresholds(self, threshold, high_threshold, punc_threshold):
+        self.threshold, self.high_threshold, self.punc_threshold = threshold, high_threshold, punc_threshold
+        self.call('thresholds', threshold, high_threshold, punc_threshold)
+
+    def install_thresholds(self, threshold, high_threshold, punc_threshold):
+        self.threshold, self.high_threshold, self.punc_threshold = threshold, high_threshold, punc_threshold
+        meta = self.call('install', threshold, high_threshold, punc_threshold)
+        if meta:
+            self.session.meta.update(meta)
+
+    def start(self, elapsed=0.0):
+        if not self.call('start', elapsed):
+            return False
+        self.start_time = time.monotonic() - elapsed
+        self.status = ACQUIRING
+        return True
+
+    def stop(self):
+        if self.calibrating:
+            self.cancel_calibration()
+            return None
+        outcome = self.call('stop')  # metrics are kept where detection runs
+        self.status = STOPPED
+        if outcome:
+            self.session.meta['outcome'] = outcome
+        return outcome
+
+    def outcome(self):
+        return self.call('outcome')
+
+    def reset_graph(self):
+        super().reset_graph()
+        self.call('reset_graph')
+
+    def read(self):
+        times, values, puncture, events, self.remote = self.receive()
+        self.pending = (puncture, events)
+        return times, values
+
+    def process(self, times, values):
+        # files the batch from read() into the session; detection already ran
+        # remotely. Returns (None, kept, events) like Station.process.
+        puncture, events = self.pending
+        if len(values):
+            self.session.add_samples(times, values, puncture)
+            self.session.add_thresholds(float(times[-1]), self.remote['threshold'], self.remote['high_threshold'],
+                                        self.remote['punc_threshold'])
+        self.session.events.extend(events)
+        self.threshold = self.remote['threshold']
+        self.high_threshold = self.remote['high_threshold']
+        self.punc_threshold = self.remote['punc_threshold']
+        self.puncture_active = bool(self.remote['puncture_active'])
+        events = [event for event in events if event.kind in (TOUCH, PUNCTURE)]
+        if events:
+            self.state = events[-1].kind
+        return None, len(values), events
+
+    def start_recording(self, directory, name):
+        # the remote side records, so the recording survives the GUI
+        path = self.call('record', directory, name)
+        if path:
+            log.info('recording', f"{self.name} records to {path}", station=self.name, path=path)
+        return None
+
+    def close_recording(self):
+        pass  # closed by the remote side
+
+
+class ProcessStation(RemoteStation):
+    # A RemoteStation in a process of its own (run_station), so serial reads
+    # keep their timing however long the GUI holds the interpreter. Samples,
+    # puncture flags, events and the detector state come back through a
+    # SharedRing this side only maps and reads; commands go over a pipe and
+    # are answered once carried out.
+    def __init__(self, name='station', device_url=None, window=50, threshold=15000, mode=BINARY, perf=None,
+                 buffer_size=4096, batch_interval=0.0, filter_spec=None, capacity=1 << 18, interval=0.005):
+        super().__init__(name, device_url=device_url, window=window, threshold=threshold, mode=mode, perf=perf,
+                         buffer_size=buffer_size, batch_interval=batch_interval, filter_spec=filter_spec)
+        self.ring = SharedRing.create(FIELDS, capacity=capacity)
+        context = multiprocessing.get_context('spawn')  # the same on every platform, and no Tk state is forked
+        self.commands, child = context.Pipe()
+        self.worker = context.Process(target=run_station, name=f"Acquisition {name}", daemon=True,
+                                      args=(self.ring.name, child, name, device_url, window, threshold, mode,
+                                            batch_interval, filter_spec, interval))
+        self.worker.start()
+        child.close()
+        self.remote = self.ring.snapshot()
+        self.closed = False
+
+    def request(self, command, *args):
+        self.commands.send((command, *args))
+        return self.commands.recv()
+
+    def receive(self):
+        return self.ring.read()
+
+    def refresh(self):
+        return self.ring.snapshot()
+
+    def close(self, timeout=5):
+        # ends the acquisition process (it stops the reader and closes the
+        # recording and the port) and frees the shared memory
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.commands.send(('shutdown',))
+        except OSError:
+            pass
+        self.worker.join(timeout)
+        if self.worker.is_alive():
+            log.warning('acquisition_process', f"Acquisition process of {self.name} did not stop, terminating",
+                        station=self.name)
+            self.worker.terminate()
+            self.worker.join(timeout)
+        self.commands.close()
+        self.ring.close()
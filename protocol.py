@@ -0,0 +1,172 @@
+import numpy as np
+
+# Serial protocol spoken by Arduino/HX711_basic_example.ino
+
+POLL = 'poll'
+STREAM = 'stream'
+
+CMD_POLL = b'g'  # reply with one "<value>" line
+CMD_START_STREAM = b's'  # send "<seq>,<value>" for every conversion
+CMD_STOP_STREAM = b'x'
+
+SEQ_MODULO = 1 << 16  # the firmware sequence counter is an unsigned 16 bit int
+
+
+def parse_ascii_line(line):
+    # returns (seq, value); seq is None for a polled reply.
+    # Raises ValueError for anything that is not a reading.
+    text = line.decode('ascii').strip()
+    if ',' in text:
+        seq, value = text.split(',', 1)
+        return int(seq), int(value)
+    return None, int(text)
+
+
+def missing_samples(last_seq, seq):
+    # number of samples lost between two consecutive sequence numbers
+    return (seq - last_seq - 1) % SEQ_MODULO
+
+
+# Binary framing, enabled with CMD_START_BINARY. Every conversion is sent as one
+# little endian frame:
+#   sync (0xA5) | seq u16 | reading i24 | device time u32 (micros) | crc8
+# The CRC (poly 0x07, init 0) covers everything between sync and crc.
+BINARY = 'binary'
+CMD_START_BINARY = b'b'
+
+SYNC = 0xA5
+FRAME_SIZE = 11
+CRC_POLY = 0x07
+
+FRAME_DTYPE = np.dtype([('seq', '<u2'), ('reading', '<i4'), ('device_time', '<u4')])
+
+
+def _crc8_table():
+    table = np.zeros(256, dtype=np.uint8)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC_POLY) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[i] = crc
+    return table
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    crc = 0
+    for byte in bytes(data):
+        crc = int(CRC8_TABLE[crc ^ byte])
+    return crc
+
+
+def encode_frame(seq, reading, device_time):
+    body = (seq % SEQ_MODULO).to_bytes(2, 'little') + (reading & 0xFFFFFF).to_bytes(3, 'little') + \
+        (device_time & 0xFFFFFFFF).to_bytes(4, 'little')
+    return bytes([SYNC]) + body + bytes([crc8(body)])
+
+
+def encode_frames(seq, reading, device_time):
+    # vectorized encode_frame for whole arrays, returns the frames as bytes
+    seq = np.asarray(seq, dtype=np.int64) % SEQ_MODULO
+    reading = np.asarray(reading, dtype=np.int64) & 0xFFFFFF
+    device_time = np.asarray(device_time, dtype=np.int64) & 0xFFFFFFFF
+    frames = np.empty((len(seq), FRAME_SIZE), dtype=np.uint8)
+    frames[:, 0] = SYNC
+    for i in range(2):
+        frames[:, 1 + i] = (seq >> (8 * i)) & 0xFF
+    for i in range(3):
+        frames[:, 3 + i] = (reading >> (8 * i)) & 0xFF
+    for i in range(4):
+        frames[:, 6 + i] = (device_time >> (8 * i)) & 0xFF
+    crc = np.zeros(len(seq), dtype=np.uint8)
+    for column in range(1, FRAME_SIZE - 1):
+        crc = CRC8_TABLE[crc ^ frames[:, column]]
+    frames[:, FRAME_SIZE - 1] = crc
+    return frames.tobytes()
+
+
+def reading_to_value(reading):
+    # the ASCII protocol sends reading / 100 with C truncation, keep the same scale
+    return np.sign(reading) * (np.abs(reading) // 100)
+
+
+class BinaryFrameDecoder:
+    # Decodes whole read() chunks at once. Sync candidates are checked with a
+    # CRC computed column by column over all candidates, so the Python work per
+    # chunk does not grow with the number of frames in it. Partial frames are
+    # carried over to the next chunk.
+    def __init__(self):
+        self.pending = b''
+        self.frames = 0
+        self.bad_frames = 0  # sync byte found but CRC did not match
+        self.resyncs = 0  # bytes had to be skipped to find the next frame
+        self.skipped_bytes = 0
+        self.out_of_sync = False  # bytes were skipped since the last frame, maybe in an earlier chunk
+
+    def feed(self, chunk):
+        data = np.frombuffer(self.pending + chunk, dtype=np.uint8)
+        n = len(data)
+        last_start = n - FRAME_SIZE
+        if last_start < 0:
+            self.pending = data.tobytes()
+            return np.empty(0, dtype=FRAME_DTYPE)
+
+        candidates = np.flatnonzero(data[:last_start + 1] == SYNC)
+        rows = data[candidates[:, None] + np.arange(FRAME_SIZE)]
+        crc = np.zeros(len(rows), dtype=np.uint8)
+        for column in range(1, FRAME_SIZE - 1):
+            crc = CRC8_TABLE[crc ^ rows[:, column]]
+        valid = crc == rows[:, FRAME_SIZE - 1]
+
+        starts = candidates[valid]
+        if len(starts) > 1 and np.any(np.diff(starts) < FRAME_SIZE):
+            starts = self._drop_overlapping(starts)
+        rows = rows[np.isin(candidates, starts)]
+
+        # sync candidates outside accepted frames that failed the CRC
+        failed = candidates[~valid]
+        if len(starts):
+            j = np.searchsorted(starts, failed, side='right') - 1
+            inside = (j >= 0) & (failed < starts[np.maximum(j, 0)] + FRAME_SIZE)
+            failed = failed[~inside]
+        self.bad_frames += len(failed)
+
+        # where decoding resumes next time. One resync per run of skipped
+        # bytes, counted at the frame that ends it, whichever chunks the run
+        # was spread over.
+        end = starts[-1] + FRAME_SIZE if len(starts) else 0
+        keep_from = max(end, last_start + 1)
+        if len(starts):
+            gaps = np.diff(np.concatenate(([0], starts))) - np.concatenate(([0], np.full(len(starts) - 1, FRAME_SIZE)))
+            resynced = gaps != 0
+            resynced[0] |= self.out_of_sync
+            self.resyncs += int(np.count_nonzero(resynced))
+            self.skipped_bytes += int(gaps.sum())
+            self.out_of_sync = False
+        if keep_from > end:
+            self.skipped_bytes += keep_from - end
+            self.out_of_sync = True
+        self.pending = data[keep_from:].tobytes()
+        self.frames += len(starts)
+
+        out = np.empty(len(rows), dtype=FRAME_DTYPE)
+        out['seq'] = rows[:, 1].astype(np.uint16) | (rows[:, 2].astype(np.uint16) << 8)
+        reading = rows[:, 3].astype(np.int32) | (rows[:, 4].astype(np.int32) << 8) | \
+            (rows[:, 5].astype(np.int32) << 16)
+        out['reading'] = np.where(reading & 0x800000, reading - (1 << 24), reading)
+        out['device_time'] = rows[:, 6].astype(np.uint32) | (rows[:, 7].astype(np.uint32) << 8) | \
+            (rows[:, 8].astype(np.uint32) << 16) | (rows[:, 9].astype(np.uint32) << 24)
+        return out
+
+    @staticmethod
+    def _drop_overlapping(starts):
+        # rare: a sync byte plus a matching CRC inside a real frame
+        kept = []
+        next_free = -1
+        for start in starts.tolist():
+            if start >= next_free:
+                kept.append(start)
+                next_free = start + FRAME_SIZE
+        return np.array(kept, dtype=starts.dtype)
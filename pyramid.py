@@ -0,0 +1,119 @@
+import numpy as np
+
+from session import SampleSeries
+
+
+class MinMaxPyramid:
+    # Min/max level of detail over a growing (times, values) series. Level k
+    # keeps, for every run of base * 2**k samples, the minimum and the maximum
+    # with their times, so a window is drawn from the coarsest level that
+    # still gives about two points per pixel: the cost of query() depends on
+    # the number of pixels, not on the window length, and every peak and dip
+    # survives. update() only folds in what was appended since the last call.
+    # `series` is anything with times / values arrays (SampleSeries,
+    # SessionArchive); samples before `offset` are left out.
+    def __init__(self, series, base=8, offset=0):
+        self.series = series
+        self.base = base
+        self.offset = offset
+        self.levels = []  # (mins, maxs) SampleSeries per level
+
+    def raw(self):
+        return self.series.times[self.offset:], self.series.values[self.offset:]
+
+    def __len__(self):
+        return len(self.series.values) - self.offset
+
+    def update(self):
+        times, values = self.raw()
+        if not self.levels:
+            self.dtype = np.float64 if values.dtype.kind == 'f' else np.int64
+            self.levels.append((SampleSeries(self.dtype), SampleSeries(self.dtype)))
+        mins, maxs = self.levels[0]
+        done = len(mins) * self.base
+        new = (len(values) - done) // self.base
+        if new > 0:
+            block_t = np.asarray(times[done:done + new * self.base]).reshape(new, self.base)
+            block_v = np.asarray(values[done:done + new * self.base]).reshape(new, self.base)
+            rows = np.arange(new)
+            i = block_v.argmin(axis=1)
+            mins.extend(block_t[rows, i], block_v[rows, i])
+            i = block_v.argmax(axis=1)
+            maxs.extend(block_t[rows, i], block_v[rows, i])
+
+        k = 1
+        while len(self.levels[k - 1][0]) >= 2:
+            if k == len(self.levels):
+                self.levels.append((SampleSeries(self.dtype), SampleSeries(self.dtype)))
+            child_mins, child_maxs = self.levels[k - 1]
+            mins, maxs = self.levels[k]
+            have, can = len(mins), len(child_mins) // 2
+            if can > have:
+                self._merge(child_mins, mins, have, can, np.argmin)
+                self._merge(child_maxs, maxs, have, can, np.argmax)
+            k += 1
+
+    @staticmethod
+    def _merge(child, parent, have, can, pick):
+        pair_t = child.times[2 * have:2 * can].reshape(-1, 2)
+        pair_v = child.values[2 * have:2 * can].reshape(-1, 2)
+        rows = np.arange(len(pair_v))
+        i = pick(pair_v, axis=1)
+        parent.extend(pair_t[rows, i], pair_v[rows, i])
+
+    def level_for(self, samples, pixels):
+        # coarsest level with at least `pixels` buckets over `samples` samples
+        if not self.levels or samples <= 2 * pixels:
+            return None
+        k = int(np.floor(np.log2(max(samples / (pixels * self.base), 1))))
+        return min(k, len(self.levels) - 1)
+
+    def query(self, t0, t1, pixels):
+        # (times, values) to draw for t0 <= time <= t1 on `pixels` columns; the
+        # raw samples when there are few enough
+        times, values = self.raw()
+        start = int(np.searchsorted(times, t0, side='left'))
+        end = int(np.searchsorted(times, t1, side='right'))
+        k = self.level_for(end - start, pixels)
+        if k is None:
+            return np.asarray(times[start:end]), np.asarray(values[start:end])
+
+        # buckets that lie wholly inside the window come from the level; the
+        # partly visible ones at either end and the samples not folded into
+        # the level yet are reduced from the raw samples, so nothing outside
+        # the window is drawn and no extreme inside it is lost
+        size = self.base << k
+        mins, maxs = self.levels[k]
+        first = -(-start // size)
+        last = max(first, min(end // size, len(mins)))
+        t_min, v_min = mins.times[first:last], mins.values[first:last]
+        t_max, v_max = maxs.times[first:last], maxs.values[first:last]
+        head = min(first * size, end)
+        if start < head:
+            i, j = self._extremes(values, start, head)
+            t_min, v_min = np.insert(t_min, 0, times[i]), np.insert(v_min, 0, values[i])
+            t_max, v_max = np.insert(t_max, 0, times[j]), np.insert(v_max, 0, values[j])
+        tail = max(last * size, head)
+        if tail < end:
+            i, j = self._extremes(values, tail, end)
+            t_min, v_min = np.append(t_min, times[i]), np.append(v_min, values[i])
+            t_max, v_max = np.append(t_max, times[j]), np.append(v_max, values[j])
+        return interleave(t_min, v_min, t_max, v_max)
+
+    @staticmethod
+    def _extremes(values, start, end):
+        # indices of the minimum and the maximum of values[start:end]
+        part = np.asarray(values[start:end])
+        return start + int(part.argmin()), start + int(part.argmax())
+
+
+def interleave(t_min, v_min, t_max, v_max):
+    # one min and one max point per bucket, in time order
+    min_first = t_min <= t_max
+    times = np.empty(2 * len(t_min), dtype=np.float64)
+    values = np.empty(2 * len(t_min), dtype=np.result_type(v_min, v_max))
+    times[0::2] = np.where(min_first, t_min, t_max)
+    times[1::2] = np.where(min_first, t_max, t_min)
+    values[0::2] = np.where(min_first, v_min, v_max)
+    values[1::2] = np.where(min_first, v_max, v_min)
+    return times, values
@@ -0,0 +1,401 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from archive import ArchiveWriter
+from logger import log
+from session import THRESHOLD_NAMES, Event, SessionBuffer, match_puncture
+
+# Append-only session file, written while acquiring:
+#   MAGIC, then chunks of  sync 'CHNK' | kind u8 | count u32 | length u32 | crc32 u32 | payload
+# SAMPLES and PUNCTURE payloads are RECORD_DTYPE arrays, THRESHOLDS are
+# THRESHOLD_DTYPE arrays, EVENTS and META are JSON. A clean close ends with an END chunk. After a crash the file ends in
+# whatever was last written; every chunk carries its own CRC, so readers stop
+# at the first incomplete one and recover() truncates the file there.
+# Next to it, <path>.idx holds one INDEX_RECORD per chunk (offset, kind, count,
+# first and last time) so a time range can be found without reading payloads.
+# While a recorder writes, it holds an OS lock on <path>.lock. The lock goes
+# away with the writer, even when its process dies, so an unfinished file
+# without a held lock was cut short by a crash; one with a held lock is being
+# written, maybe by another process (ProcessStation, a broker).
+MAGIC = b'HXREC\x00\x01\x00'
+SYNC = b'CHNK'
+CHUNK_HEADER = struct.Struct('<4sBIII')
+INDEX_RECORD = struct.Struct('<QBIdd')
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('value', '<i4')])
+THRESHOLD_DTYPE = np.dtype([('time', '<f8')] + [(name, '<f8') for name in THRESHOLD_NAMES])
+
+LOCK_SUFFIX = '.lock'
+
+SAMPLES = 1
+PUNCTURE = 2
+EVENTS = 3
+META = 4
+END = 5
+THRESHOLDS = 6
+
+
+def _lock(f):
+    # non-blocking exclusive lock on an open file, OSError if someone holds it
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def is_recording(path):
+    # True while a SessionRecorder, in any process, is writing `path`
+    lock_path = path + LOCK_SUFFIX
+    if not os.path.exists(lock_path):
+        return False
+    try:
+        f = open(lock_path, 'a')
+    except OSError:
+        return True  # e.g. the owner is removing it right now
+    try:
+        _lock(f)
+    except OSError:
+        return True
+    else:
+        _unlock(f)
+        return False
+    finally:
+        f.close()
+
+
+class SessionRecorder:
+    # Writes samples, puncture samples, events and metadata to `path` from a
+    # background thread. The append_* calls only queue; the writer coalesces
+    # what arrived in the last flush_interval into one chunk per kind and
+    # fsyncs the file and index at most every fsync_interval seconds, so a
+    # crash loses at most that much. With archive_path the same data is also
+    # written as a memory mappable archive (see archive.py).
+    def __init__(self, path, flush_interval=0.5, fsync_interval=2.0, archive_path=None):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.archive_path = archive_path
+        self.archive = None
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.chunks = 0
+        self.samples = 0
+        self.bytes_written = 0
+        self.failed = None  # the OSError that stopped the writer, if any
+        self._queue = queue.SimpleQueue()
+        self._lock = None
+        self._file = None
+        self._index = None
+        self._thread = None
+        self._last_fsync = 0.0
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # the lock first: opening the file truncates it
+        self._lock = open(self.path + LOCK_SUFFIX, 'a')
+        try:
+            _lock(self._lock)
+        except OSError:
+            self._lock.close()
+            self._lock = None
+            raise OSError(f"{self.path} is being recorded by another recorder") from None
+        self._lock.truncate(0)
+        self._lock.write(f'{os.getpid()}\n')  # for whoever wonders who holds it
+        self._lock.flush()
+        try:
+            self._file = open(self.path, 'wb')
+            self._index = open(self.index_path, 'wb')
+            self._file.write(MAGIC)
+            self.bytes_written = len(MAGIC)
+            if self.archive_path is not None:
+                self.archive = ArchiveWriter(self.archive_path)
+        except OSError:
+            for f in (self._file, self._index):
+                if f is not None:
+                    f.close()
+            self.release_lock()
+            raise
+        self._thread = threading.Thread(target=self.run, name="SessionRecorder", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def append_samples(self, times, values):
+        if len(values):
+            self._queue.put((SAMPLES, (np.array(times, dtype=np.float64), np.array(values))))
+
+    def append_puncture(self, times, values):
+        if len(values):
+            self._queue.put((PUNCTURE, (np.array(times, dtype=np.float64), np.array(values))))
+
+    def append_events(self, events):
+        if events:
+            self._queue.put((EVENTS, [(e.time, e.kind, e.value) for e in events]))
+
+    def append_thresholds(self, time, threshold, high_threshold, punc_threshold):
+        self._queue.put((THRESHOLDS, (time, threshold, high_threshold, punc_threshold)))
+
+    def write_meta(self, **fields):
+        # e.g. calibration results; readers merge META chunks in order
+        self._queue.put((META, fields))
+
+    def flush(self, timeout=5):
+        # blocks until everything queued so far is on disk
+        if not self.running:
+            return
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        done.wait(timeout)
+
+    def close(self, timeout=5):
+        if not self.running:
+            return
+        self._queue.put((END, None))
+        self._thread.join(timeout)
+        self._thread = None
+
+    def write_chunk(self, kind, count, payload, first=np.nan, last=np.nan):
+        offset = self.bytes_written
+        self._file.write(CHUNK_HEADER.pack(SYNC, kind, count, len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self._index.write(INDEX_RECORD.pack(offset, kind, count, first, last))
+        self.bytes_written += CHUNK_HEADER.size + len(payload)
+        self.chunks += 1
+
+    def write_batch(self, items):
+        series = {SAMPLES: [], PUNCTURE: []}
+        thresholds = []
+        for kind, payload in items:
+            if kind in series:
+                series[kind].append(payload)
+            elif kind == THRESHOLDS:
+                thresholds.append(payload)
+            elif kind == EVENTS:
+                self.write_chunk(EVENTS, len(payload), json.dumps(payload).encode(), payload[0][0], payload[-1][0])
+                if self.archive is not None:
+                    self.archive.append_events(payload)
+            elif kind == META:
+                self.write_chunk(META, 1, json.dumps(payload, default=str).encode())
+                if self.archive is not None:
+                    self.archive.write_meta(payload)
+        for kind, parts in series.items():
+            if not parts:
+                continue
+            records = np.empty(sum(len(t) for t, _ in parts), dtype=RECORD_DTYPE)
+            records['time'] = np.concatenate([t for t, _ in parts])
+            records['value'] = np.concatenate([v for _, v in parts])
+            self.write_chunk(kind, len(records), records.tobytes(), records['time'][0], records['time'][-1])
+            if kind == SAMPLES:
+                self.samples += len(records)
+            if self.archive is not None:
+                append = self.archive.append_samples if kind == SAMPLES else self.archive.append_puncture
+                append(records['time'], records['value'])
+        if thresholds:
+            records = np.array(thresholds, dtype=THRESHOLD_DTYPE)
+            self.write_chunk(THRESHOLDS, len(records), records.tobytes(), records['time'][0], records['time'][-1])
+
+    def sync(self):
+        self._file.flush()
+        self._index.flush()
+        os.fsync(self._file.fileno())
+        os.fsync(self._index.fileno())
+        if self.archive is not None:
+            self.archive.sync()
+        self._last_fsync = time.monotonic()
+
+    def run(self):
+        try:
+            self.sync()
+            while True:
+                items = [self._queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while items[-1][0] not in ('flush', END):
+                    try:
+                        items.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                kind, payload = items[-1]
+                if kind in ('flush', END):
+                    items.pop()
+                self.write_batch(items)
+                if kind == END:
+                    self.write_chunk(END, 0, b'')
+                    self.sync()
+                    break
+                if kind == 'flush' or time.monotonic() - self._last_fsync >= self.fsync_interval:
+                    self.sync()
+                else:
+                    self._file.flush()
+                    self._index.flush()
+                    if self.archive is not None:
+                        self.archive.flush()
+                if kind == 'flush':
+                    payload.set()
+        except (OSError, ValueError) as e:
+            self.failed = e
+            log.error('recorder_failed', f"Recording to {self.path} failed: {e}", path=self.path)
+        finally:
+            self._file.close()
+            self._index.close()
+            if self.archive is not None:
+                self.archive.close()
+            self.release_lock()
+            # wake up anyone waiting in flush()
+            while True:
+                try:
+                    kind, payload = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'flush':
+                    payload.set()
+
+
+    def release_lock(self):
+        _unlock(self._lock)
+        self._lock.close()
+        self._lock = None
+        try:
+            os.remove(self.path + LOCK_SUFFIX)
+        except OSError:
+            pass  # someone else is checking it, is_recording() sees it is free
+
+
+def scan(path):
+    # Yields (offset, kind, count, payload) for every intact chunk, stopping at
+    # the first incomplete or corrupted one. The file offset where reading
+    # stopped is returned as the generator's value.
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+        offset = len(MAGIC)
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return offset
+            sync, kind, count, length, crc = CHUNK_HEADER.unpack(header)
+            if sync != SYNC:
+                return offset
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return offset
+            yield offset, kind, count, payload
+            offset += CHUNK_HEADER.size + length
+
+
+def read_recording(path):
+    # A SessionBuffer with everything intact in the file, also for a file that
+    # is still being written or was cut short by a crash.
+    session = SessionBuffer()
+    for _, kind, count, payload in scan(path):
+        if kind in (SAMPLES, PUNCTURE):
+            records = np.frombuffer(payload, dtype=RECORD_DTYPE)
+            series = session.samples if kind == SAMPLES else session.puncture
+            series.extend(records['time'], records['value'])
+        elif kind == EVENTS:
+            session.events.extend(Event(t, kind_, value) for t, kind_, value in json.loads(payload))
+        elif kind == META:
+            session.meta.update(json.loads(payload))
+        elif kind == THRESHOLDS:
+            records = np.frombuffer(payload, dtype=THRESHOLD_DTYPE)
+            for name in THRESHOLD_NAMES:
+                session.thresholds[name].extend(records['time'], records[name])
+    session.puncture_mask.extend(match_puncture(session.samples.times, session.puncture.times))
+    return session
+
+
+def is_complete(path):
+    # True if the recording was closed cleanly (ends with an END chunk)
+    last = None
+    for _, kind, _, _ in scan(path):
+        last = kind
+    return last == END
+
+
+def recover(path):
+    # Truncates a crashed recording after its last intact chunk, closes it
+    # with an END chunk and rewrites the index. Returns the bytes dropped.
+    index = []
+    chunks = scan(path)
+    while True:
+        try:
+            offset, kind, count, payload = next(chunks)
+        except StopIteration as stop:
+            end = stop.value
+            break
+        if kind == END:
+            continue
+        first = last = np.nan
+        if kind in (SAMPLES, PUNCTURE, THRESHOLDS) and count:
+            times = np.frombuffer(payload, dtype=THRESHOLD_DTYPE if kind == THRESHOLDS else RECORD_DTYPE)['time']
+            first, last = times[0], times[-1]
+        elif kind == EVENTS and count:
+            events = json.loads(payload)
+            first, last = events[0][0], events[-1][0]
+        index.append(INDEX_RECORD.pack(offset, kind, count, first, last))
+    dropped = os.path.getsize(path) - end
+    with open(path, 'r+b') as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(CHUNK_HEADER.pack(SYNC, END, 0, 0, zlib.crc32(b'')))
+        f.flush()
+        os.fsync(f.fileno())
+    index.append(INDEX_RECORD.pack(end, END, 0, np.nan, np.nan))
+    with open(path + '.idx', 'wb') as f:
+        f.write(b''.join(index))
+    return dropped
+
+
+def read_index(path):
+    # (offset, kind, count, first time, last time) per chunk, from <path>.idx
+    with open(path + '.idx', 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % INDEX_RECORD.size
+    return list(INDEX_RECORD.iter_unpack(data[:usable]))
+
+
+def recover_all(directory):
+    # recovers every recording in `directory` that was not closed cleanly and
+    # that no recorder is writing any more, in this process or another one
+    recovered = []
+    if not os.path.isdir(directory):
+        return recovered
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith('.rec'):
+            continue
+        try:
+            if is_recording(path) or is_complete(path):
+                continue
+            dropped = recover(path)
+            if os.path.exists(path + LOCK_SUFFIX):
+                os.remove(path + LOCK_SUFFIX)  # left behind by the crashed writer
+        except (OSError, ValueError) as e:
+            log.error('recover_failed', f"Cannot recover {path}: {e}", path=path)
+            continue
+        log.warning('recovered', f"Recovered unfinished recording {path} ({dropped} bytes cut)", path=path,
+                    dropped=dropped)
+        recovered.append(path)
+    return recovered
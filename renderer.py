@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class BlitRenderer:
+    # Keeps the data line, the three threshold lines and the legend alive for the
+    # whole session and only repaints them over a cached background. The full
+    # figure (ticks, labels, grid) is redrawn only when the axis limits move.
+    # window=None shows the whole session, growing in steps of a tenth.
+    def __init__(self, fig, ax, window=10, x_step=2, y_margin=0.002, y_tolerance=0.25, title="Arduino Data",
+                 legend=True):
+        self.fig = fig
+        self.ax = ax
+        self.canvas = fig.canvas
+        self.window = window  # seconds of data visible on the x axis
+        self.x_step = x_step  # x axis jumps ahead in steps instead of every frame
+        self.y_margin = y_margin  # half height of the y axis as a fraction of the mean
+        self.y_tolerance = y_tolerance  # fraction of the half height the mean may drift before rescaling
+        self.background = None
+        self.full_redraws = 0
+        self.blits = 0
+
+        self.line, = ax.plot([], [], animated=True)
+        self.threshold_line = ax.axhline(y=0, color='r', linestyle='--', animated=True, label='Threshold')
+        self.high_threshold_line = ax.axhline(y=0, color='k', linestyle='--', animated=True,
+                                              label='High Threshold')
+        self.punc_threshold_line = ax.axhline(y=0, color='m', linestyle='--', animated=True,
+                                              label='Puncture Threshold')
+        # static labels so the legend stays in the cached background; re-laying out
+        # its text every frame costs more than everything else together
+        self.legend = None
+        if legend:
+            self.legend = ax.legend(handles=[self.threshold_line, self.high_threshold_line, self.punc_threshold_line])
+        self.artists = [self.line, self.threshold_line, self.high_threshold_line, self.punc_threshold_line]
+
+        ax.set_title(title)
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Value")
+
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        # a full draw (first show, resize or limit change) invalidates the background
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+
+    def set_window(self, window):
+        self.window = window
+        self.background = None  # new limits on the next frame
+
+    def next_span(self, current_time):
+        # x limits to jump to once current_time is off the axis
+        if self.window is None:
+            return 0, current_time + max(self.x_step, 0.1 * current_time)
+        xmax = current_time + self.x_step
+        return max(0, xmax - self.window - self.x_step), xmax
+
+    def visible_span(self, current_time):
+        # (start, end) of the x axis on the frame that shows current_time
+        xmin, xmax = self.ax.get_xlim()
+        if self.background is None or current_time > xmax or current_time < xmin:
+            return self.next_span(current_time)
+        return xmin, xmax
+
+    def update_limits(self, current_time, y_center):
+        changed = False
+        xmin, xmax = self.ax.get_xlim()
+        if self.background is None or current_time > xmax or current_time < xmin:
+            self.ax.set_xlim(self.next_span(current_time))
+            changed = True
+
+        half_height = self.y_margin * abs(y_center)
+        ymin, ymax = self.ax.get_ylim()
+        old_center = (ymin + ymax) / 2
+        old_half_height = (ymax - ymin) / 2
+        if (abs(y_center - old_center) > self.y_tolerance * old_half_height
+                or abs(half_height - old_half_height) > self.y_tolerance * old_half_height):
+            self.ax.set_ylim([y_center - half_height, y_center + half_height])
+            changed = True
+        return changed
+
+    def set_thresholds(self, threshold, high_threshold, punc_threshold):
+        self.threshold_line.set_ydata([threshold, threshold])
+        self.high_threshold_line.set_ydata([high_threshold, high_threshold])
+        self.punc_threshold_line.set_ydata([punc_threshold, punc_threshold])
+
+    def update(self, times, values, threshold, high_threshold, punc_threshold, y_center=None, current_time=None):
+        # Sets the artists for the next frame without drawing. True when the
+        # limits moved and the figure needs a full draw instead of a blit;
+        # several renderers on one canvas then share a single canvas.draw().
+        # current_time defaults to the last point; pass it when values are decimated
+        times = np.asarray(times)
+        values = np.asarray(values)
+        self.line.set_data(times, values)
+        self.set_thresholds(threshold, high_threshold, punc_threshold)
+        if y_center is None:
+            y_center = float(np.mean(values))
+
+        if current_time is None:
+            current_time = times[-1]
+        return self.update_limits(current_time, y_center) or self.background is None
+
+    def blit(self):
+        self.blits += 1
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.ax.bbox)
+
+    def render(self, times, values, threshold, high_threshold, punc_threshold, y_center=None, current_time=None):
+        if len(values) == 0:
+            return
+        if self.update(times, values, threshold, high_threshold, punc_threshold, y_center, current_time):
+            self.full_redraws += 1
+            self.canvas.draw()  # on_draw grabs the new background and paints the artists
+        else:
+            self.blit()
+
+    def reset(self, ylim, draw=True):
+        # draw=False leaves the full draw to the next frame, e.g. one draw for several renderers
+        self.line.set_data([], [])
+        self.ax.set_xlim([0, self.window or 10])
+        self.ax.set_ylim(ylim)
+        self.background = None
+        if draw:
+            self.canvas.draw()
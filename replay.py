@@ -0,0 +1,155 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from acquisition import SampleRingBuffer
+from filters import FilterChain
+from metrics import verdict
+from pipeline import Pipeline
+from formats import load_session
+from protocol import BinaryFrameDecoder, reading_to_value
+
+
+def load_capture(path):
+    # raw bytes captured from the port in binary mode, timed by the device clock
+    decoder = BinaryFrameDecoder()
+    with open(path, 'rb') as f:
+        frames = decoder.feed(f.read())
+    device_time = frames['device_time'].astype(np.int64)
+    wraps = np.concatenate(([0], np.cumsum(np.diff(device_time) < 0)))
+    seconds = (device_time + (wraps << 32)) / 1e6
+    return seconds - seconds[0], reading_to_value(frames['reading'])
+
+
+def load_recording(path):
+    # (times, values) of a binary capture or any session file formats.load_session
+    # reads; puncture samples and events are recomputed by the pipeline
+    if str(path).lower().endswith('.bin'):
+        return load_capture(path)
+    session = load_session(path)
+    return session.samples.times.copy(), session.samples.values.astype(np.int64)
+
+
+class ReplaySource:
+    # Plays a recording into a SampleRingBuffer from its own thread, standing in
+    # for SerialReader. speed=1 is real time, N is N times faster and 0 is as
+    # fast as possible. Sample times keep the recording's spacing whatever the
+    # speed, so the 3 s rules still see recording time; they are shifted onto
+    # the monotonic clock at start unless base_time is given (0 keeps them
+    # as recorded). Unlike a real device it waits for the consumer instead of
+    # dropping samples when the buffer is full.
+    def __init__(self, times, values, buffer, speed=1.0, chunk_size=256, base_time=None):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.values = np.asarray(values)
+        self.buffer = buffer
+        self.speed = speed
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.base_time = base_time
+        self.mode = 'replay'
+        self.late = self.lost = self.parse_errors = self.bad_frames = self.resyncs = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def dropped(self):
+        return self.buffer.dropped
+
+    @property
+    def finished(self):
+        return self.position >= len(self.values)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name="ReplaySource", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def run(self):
+        if len(self.values) == 0:
+            return
+        start = time.monotonic()
+        if self.base_time is None:
+            self.base_time = start - self.times[0]
+        while not self._stop_event.is_set() and not self.finished:
+            if self.speed:
+                # everything that is due by now at this speed
+                due = self.times[0] + (time.monotonic() - start) * self.speed
+                end = int(np.searchsorted(self.times, due, side='right'))
+                if end <= self.position:
+                    self._stop_event.wait(min(0.005, (self.times[self.position] - due) / self.speed))
+                    continue
+            else:
+                end = min(self.position + self.chunk_size, len(self.values))
+                while len(self.buffer) + (end - self.position) > self.buffer.capacity:
+                    if self._stop_event.wait(0.001):
+                        return
+            times = self.times[self.position:end]
+            self.buffer.push_many(times + self.base_time if self.base_time else times, self.values[self.position:end])
+            self.position = end
+
+
+def replay(times, values, speed=0, pipeline=None, buffer_size=65536):
+    # Headless run of a recording through ReplaySource -> SampleRingBuffer ->
+    # Pipeline, the same path animate() drains. Returns the pipeline and stats.
+    pipeline = pipeline or Pipeline()
+    buffer = SampleRingBuffer(buffer_size)
+    source = ReplaySource(times, values, buffer, speed=speed, base_time=0.0)
+    wall_start = time.perf_counter()
+    source.start()
+    processed = 0
+    while not pipeline.stopped:
+        alive = source.is_alive()
+        batch_times, batch_values = buffer.drain()
+        if len(batch_values):
+            _, kept = pipeline.process(batch_times, batch_values)
+            processed += kept
+        elif not alive:
+            break
+        elif speed:
+            time.sleep(0.01)
+    source.stop()
+    wall = time.perf_counter() - wall_start
+    stats = {
+        'samples': processed,
+        'seconds': wall,
+        'samples_per_second': processed / wall if wall > 0 else float('inf'),
+        'dropped': buffer.dropped,
+    }
+    return pipeline, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded session through the detection pipeline")
+    parser.add_argument('path', help="session file (.csv, .npz, .parquet, .arrow, .rec) or a .bin binary capture")
+    parser.add_argument('--speed', type=float, default=0, help="1 = real time, N = N times faster, 0 = flat out")
+    parser.add_argument('--filter', metavar='SPEC', help="filter like the live pipeline, see filters.FilterChain")
+    parser.add_argument('--no-stop', action='store_true', help="keep going after a plateau ends the session")
+    args = parser.parse_args()
+
+    times, values = load_recording(args.path)
+    pipeline = Pipeline(stop_on_plateau=not args.no_stop,
+                        signal_filter=FilterChain(args.filter) if args.filter else None)
+    pipeline, stats = replay(times, values, speed=args.speed, pipeline=pipeline)
+    for event in pipeline.session.events:
+        print(f"{event.time:10.3f}  {event.kind:<9} {event.value}")
+    outcome = pipeline.metrics.summary()
+    if outcome['puncture_to_min'] is not None:
+        print(f"puncture to minimum {outcome['puncture_to_min']:.2f} s, {outcome['puncture_seconds']:.2f} s in "
+              f"puncture: {verdict(outcome)}")
+    else:
+        print(verdict(outcome))
+    print(f"{stats['samples']} samples in {stats['seconds']:.3f} s "
+          f"({stats['samples_per_second']:.0f} samples/s), dropped {stats['dropped']}")
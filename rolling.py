@@ -0,0 +1,143 @@
+from bisect import bisect_left, insort
+
+import numpy as np
+
+
+class RollingStats:
+    # Moving window statistics updated in O(1) per sample from a running sum and
+    # sum of squares. Values are stored relative to the first sample so the sums
+    # stay small, and the sums are recomputed from the window every `window`
+    # updates so float error cannot pile up over a long session.
+    # Optional extras: an exponential moving average (ema_alpha) and a rolling
+    # median / MAD kept in a sorted copy of the window (track_median).
+    def __init__(self, window, ema_alpha=None, track_median=False):
+        self.window = window
+        self.ema_alpha = ema_alpha
+        self.track_median = track_median
+        self.buffer = np.zeros(window, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # total samples seen
+        self.offset = None
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.ema = None
+        self.sorted_window = []
+        self.updates_since_resync = 0
+
+    def __len__(self):
+        return min(self.count, self.window)
+
+    @property
+    def full(self):
+        return self.count >= self.window
+
+    @property
+    def mean(self):
+        n = len(self)
+        if n == 0:
+            return float('nan')
+        return self.offset + self.sum / n
+
+    @property
+    def var(self):
+        n = len(self)
+        if n == 0:
+            return float('nan')
+        m = self.sum / n
+        return max(self.sum_sq / n - m * m, 0.0)
+
+    @property
+    def std(self):
+        return self.var ** 0.5
+
+    def median(self):
+        if not self.sorted_window:
+            return float('nan')
+        n = len(self.sorted_window)
+        middle = n // 2
+        if n % 2:
+            return self.offset + self.sorted_window[middle]
+        return self.offset + (self.sorted_window[middle - 1] + self.sorted_window[middle]) / 2
+
+    def mad(self):
+        if not self.sorted_window:
+            return float('nan')
+        median = self.median() - self.offset
+        return float(np.median(np.abs(np.asarray(self.sorted_window) - median)))
+
+    def push(self, x):
+        if self.offset is None:
+            self.offset = float(x)
+        x = x - self.offset
+        i = self.count % self.window
+        if self.count >= self.window:
+            old = self.buffer[i]
+            self.sum -= old
+            self.sum_sq -= old * old
+            if self.track_median:
+                del self.sorted_window[bisect_left(self.sorted_window, old)]
+        self.buffer[i] = x
+        self.sum += x
+        self.sum_sq += x * x
+        if self.track_median:
+            insort(self.sorted_window, x)
+        if self.ema_alpha is not None:
+            x_abs = x + self.offset
+            self.ema = x_abs if self.ema is None else self.ema + self.ema_alpha * (x_abs - self.ema)
+        self.count += 1
+        self.updates_since_resync += 1
+        if self.updates_since_resync >= self.window:
+            self.resync()
+
+    def resync(self):
+        window = self.buffer[:len(self)]
+        self.sum = float(window.sum())
+        self.sum_sq = float(np.dot(window, window))
+        self.updates_since_resync = 0
+
+    def window_values(self):
+        # current window in arrival order, relative to self.offset
+        n = len(self)
+        if self.count <= self.window:
+            return self.buffer[:n]
+        i = self.count % self.window
+        return np.concatenate((self.buffer[i:], self.buffer[:i]))
+
+    def update(self, values):
+        # Push a batch and return the moving average after each of its samples
+        # (NaN until the window is full), from one cumulative sum over the
+        # previous window plus the batch.
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return np.empty(0)
+        if self.offset is None:
+            self.offset = float(values[0])
+        shifted = values - self.offset
+        history = self.window_values()
+        joined = np.concatenate((history, shifted))
+        cumulative = np.concatenate(([0.0], np.cumsum(joined)))
+        ends = np.arange(len(history) + 1, len(joined) + 1)
+        starts = np.maximum(ends - self.window, 0)
+        means = self.offset + (cumulative[ends] - cumulative[starts]) / (ends - starts)
+        means[self.count + np.arange(1, n + 1) < self.window] = np.nan
+
+        if self.ema_alpha is not None:
+            for x in values.tolist():
+                self.ema = x if self.ema is None else self.ema + self.ema_alpha * (x - self.ema)
+
+        # keep the last `window` samples as the new state
+        tail = joined[-self.window:]
+        self.count += n
+        self.buffer[:] = 0.0
+        if self.count <= self.window:
+            self.buffer[:len(tail)] = tail
+        else:
+            positions = (self.count - len(tail) + np.arange(len(tail))) % self.window
+            self.buffer[positions] = tail
+        if self.track_median:
+            self.sorted_window = sorted(tail.tolist())
+        self.resync()
+        return means
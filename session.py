@@ -0,0 +1,186 @@
+import csv
+from itertools import zip_longest
+
+import numpy as np
+
+
+class SampleSeries:
+    # (time, value) pairs in preallocated NumPy arrays. Capacity doubles when
+    # full, so appends are amortized O(1) and times/values are views, not copies.
+    def __init__(self, value_dtype=np.int32, chunk_size=4096):
+        self._times = np.empty(chunk_size, dtype=np.float64)
+        self._values = np.empty(chunk_size, dtype=value_dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def times(self):
+        return self._times[:self.size]
+
+    @property
+    def values(self):
+        return self._values[:self.size]
+
+    @property
+    def nbytes(self):
+        return self._times.nbytes + self._values.nbytes
+
+    def reserve(self, n):
+        capacity = len(self._times)
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        times = np.empty(capacity, dtype=self._times.dtype)
+        values = np.empty(capacity, dtype=self._values.dtype)
+        times[:self.size] = self._times[:self.size]
+        values[:self.size] = self._values[:self.size]
+        self._times = times
+        self._values = values
+
+    def append(self, t, value):
+        if self.size == len(self._times):
+            self.reserve(1)
+        self._times[self.size] = t
+        self._values[self.size] = value
+        self.size += 1
+
+    def extend(self, times, values):
+        n = len(values)
+        self.reserve(n)
+        self._times[self.size:self.size + n] = times
+        self._values[self.size:self.size + n] = values
+        self.size += n
+
+    def clear(self):
+        self.size = 0
+
+
+class FlagSeries:
+    # One bool per sample, next to a SampleSeries and grown the same way
+    def __init__(self, chunk_size=4096):
+        self._flags = np.empty(chunk_size, dtype=bool)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def flags(self):
+        return self._flags[:self.size]
+
+    def extend(self, flags):
+        n = len(flags)
+        if self.size + n > len(self._flags):
+            capacity = len(self._flags)
+            while capacity < self.size + n:
+                capacity *= 2
+            grown = np.empty(capacity, dtype=bool)
+            grown[:self.size] = self._flags[:self.size]
+            self._flags = grown
+        self._flags[self.size:self.size + n] = flags
+        self.size += n
+
+    def clear(self):
+        self.size = 0
+
+
+def match_puncture(times, puncture_times):
+    # Puncture mask of the samples from the separate puncture series, for
+    # files that only keep that series (recordings, archives, CSV). Each holds
+    # one measurement, so time only increases and every puncture sample is
+    # the sample with its time.
+    times = np.asarray(times)
+    at = np.searchsorted(times, puncture_times)
+    at = at[at < len(times)]
+    at = at[times[at] == np.asarray(puncture_times)[:len(at)]]
+    mask = np.zeros(len(times), dtype=bool)
+    mask[at] = True
+    return mask
+
+
+THRESHOLD_NAMES = ('threshold', 'high_threshold', 'punc_threshold')
+
+
+class Event:
+    __slots__ = ('time', 'kind', 'value')
+
+    def __init__(self, time, kind, value=None):
+        self.time = time
+        self.kind = kind
+        self.value = value
+
+    def __repr__(self):
+        return f"Event({self.time!r}, {self.kind!r}, {self.value!r})"
+
+
+class SessionBuffer:
+    # Everything recorded during one session: all samples with the puncture
+    # state of each, the samples taken while in puncture state, state
+    # transitions as Event records, the thresholds over time and metadata
+    # such as the calibrated thresholds.
+    def __init__(self, chunk_size=4096):
+        self.samples = SampleSeries(chunk_size=chunk_size)
+        self.puncture_mask = FlagSeries(chunk_size=chunk_size)  # per sample, True in puncture state
+        self.puncture = SampleSeries(chunk_size=chunk_size)
+        self.events = []
+        self.thresholds = {name: SampleSeries(np.float64) for name in THRESHOLD_NAMES}
+        self.meta = {}
+
+    def add_samples(self, times, values, puncture_mask):
+        # a batch of samples and their puncture state; the puncture state ones
+        # also go to the puncture series
+        puncture_mask = np.asarray(puncture_mask, dtype=bool)
+        self.samples.extend(times, values)
+        self.puncture_mask.extend(puncture_mask)
+        self.puncture.extend(times[puncture_mask], values[puncture_mask])
+
+    def add_event(self, time, kind, value=None):
+        self.events.append(Event(time, kind, value))
+
+    def add_thresholds(self, time, threshold, high_threshold, punc_threshold):
+        for name, value in zip(THRESHOLD_NAMES, (threshold, high_threshold, punc_threshold)):
+            self.thresholds[name].append(time, value)
+
+    def mark(self):
+        # position to pass to since() later
+        return len(self.samples), len(self.puncture), len(self.events), \
+            {name: len(series) for name, series in self.thresholds.items()}
+
+    def since(self, mark):
+        # a copy of everything recorded after mark()
+        samples, puncture, events, thresholds = mark
+        session = SessionBuffer()
+        session.samples.extend(self.samples.times[samples:], self.samples.values[samples:])
+        session.puncture_mask.extend(self.puncture_mask.flags[samples:])
+        session.puncture.extend(self.puncture.times[puncture:], self.puncture.values[puncture:])
+        session.events.extend(self.events[events:])
+        for name, series in self.thresholds.items():
+            session.thresholds[name].extend(series.times[thresholds[name]:], series.values[thresholds[name]:])
+        session.meta.update(self.meta)
+        return session
+
+    def clear(self):
+        self.samples.clear()
+        self.puncture_mask.clear()
+        self.puncture.clear()
+        self.events.clear()
+        for series in self.thresholds.values():
+            series.clear()
+        self.meta.clear()
+
+    def export_csv(self, path, block_size=65536):
+        # rows are written block by block straight from the arrays; the shorter
+        # puncture series is left empty once it runs out
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Time (s)', 'Value', 'Puncture Time (s)', 'Puncture Value'])
+            length = max(len(self.samples), len(self.puncture))
+            for start in range(0, length, block_size):
+                end = start + block_size
+                writer.writerows(zip_longest(self.samples.times[start:end].tolist(),
+                                             self.samples.values[start:end].tolist(),
+                                             self.puncture.times[start:end].tolist(),
+                                             self.puncture.values[start:end].tolist()))
@@ -0,0 +1,148 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from detector import TOUCH, PUNCTURE, PLATEAU
+from session import Event
+
+# Single writer, single reader ring of samples and events in one block of
+# shared memory, for handing acquisition results from one process to another:
+#   prefix  u8[4]   magic, capacity, event capacity, number of state fields
+#   header  u8[3]   seq, head (samples written), event head (events written)
+#   state   f8[n]   named values the writer keeps current (thresholds, status...)
+#   samples         time f8, value i8, puncture u1, `capacity` slots each
+#   events          time f8, kind i8, value f8 (NaN for None), `event_capacity` slots
+# seq is a seqlock: the writer makes it odd, writes the slots, the heads and
+# the state, then makes it even again. The reader copies everything it needs
+# and keeps the copy only if seq was even and unchanged across it, so it never
+# sees a half written batch and never blocks the writer.
+MAGIC = 0x48585348  # 'HXSH'
+EVENT_KINDS = (TOUCH, PUNCTURE, PLATEAU)
+_PREFIX = 4
+_HEADER = 3
+
+
+def _layout(capacity, event_capacity, fields):
+    # (name, dtype, count, offset) of every array in the block, and its size
+    arrays = [('prefix', np.uint64, _PREFIX), ('header', np.uint64, _HEADER), ('state', np.float64, fields),
+              ('times', np.float64, capacity), ('values', np.int64, capacity),
+              ('event_times', np.float64, event_capacity), ('event_kinds', np.int64, event_capacity),
+              ('event_values', np.float64, event_capacity), ('puncture', np.uint8, capacity)]
+    layout, offset = [], 0
+    for name, dtype, count in arrays:
+        layout.append((name, dtype, count, offset))
+        offset += np.dtype(dtype).itemsize * count
+    return layout, offset
+
+
+class SharedRing:
+    # Use create() in the owning process and attach(name) in the other one.
+    # The creator unlinks the memory in close(); the other side only closes.
+    def __init__(self, shm, fields, owner):
+        self.shm = shm
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.owner = owner
+        prefix = np.ndarray(_PREFIX, dtype=np.uint64, buffer=shm.buf)
+        if int(prefix[0]) != MAGIC or int(prefix[3]) != len(self.fields):
+            raise ValueError(f"{shm.name} is not a shared ring with {len(self.fields)} state fields")
+        self.capacity = int(prefix[1])
+        self.event_capacity = int(prefix[2])
+        layout, _ = _layout(self.capacity, self.event_capacity, len(self.fields))
+        for name, dtype, count, offset in layout:
+            setattr(self, name, np.ndarray(count, dtype=dtype, buffer=shm.buf, offset=offset))
+        self.tail = 0  # samples read so far, reader side
+        self.event_tail = 0
+        self.overruns = 0  # samples the reader fell behind by more than the capacity
+
+    @classmethod
+    def create(cls, fields, capacity=1 << 18, event_capacity=4096):
+        _, size = _layout(capacity, event_capacity, len(fields))
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        prefix = np.ndarray(_PREFIX, dtype=np.uint64, buffer=shm.buf)
+        prefix[:] = (MAGIC, capacity, event_capacity, len(fields))
+        np.ndarray(_HEADER, dtype=np.uint64, buffer=shm.buf, offset=prefix.nbytes)[:] = 0
+        ring = cls(shm, fields, owner=True)
+        ring.state[:] = np.nan
+        return ring
+
+    @classmethod
+    def attach(cls, name, fields):
+        return cls(shared_memory.SharedMemory(name=name), fields, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # writer side
+
+    def publish(self, times=(), values=(), puncture=(), events=(), **state):
+        # appends a batch of samples and events and updates the state, atomically for the reader
+        header = self.header
+        header[0] += 1  # odd: writing
+        head = int(header[1])
+        n = len(values)
+        if n:
+            slots = (head + np.arange(n)) % self.capacity
+            self.times[slots] = times
+            self.values[slots] = values
+            self.puncture[slots] = puncture
+        event_head = int(header[2])
+        if len(events):
+            slots = (event_head + np.arange(len(events))) % self.event_capacity
+            self.event_times[slots] = [e.time for e in events]
+            self.event_kinds[slots] = [EVENT_KINDS.index(e.kind) for e in events]
+            self.event_values[slots] = [np.nan if e.value is None else e.value for e in events]
+        for name, value in state.items():
+            self.state[self.index[name]] = value
+        header[1] = head + n
+        header[2] = event_head + len(events)
+        header[0] += 1  # even: consistent again
+
+    # reader side
+
+    def read(self):
+        # (times, values, puncture mask, events, state) published since the
+        # last read; state is a dict of the current values
+        while True:
+            seq = int(self.header[0])
+            if seq & 1:
+                time.sleep(0)  # the writer is halfway through a batch
+                continue
+            head, event_head = int(self.header[1]), int(self.header[2])
+            start = max(self.tail, head - self.capacity)
+            slots = np.arange(start, head) % self.capacity
+            times, values, puncture = self.times[slots], self.values[slots], self.puncture[slots].astype(bool)
+            event_start = max(self.event_tail, event_head - self.event_capacity)
+            slots = np.arange(event_start, event_head) % self.event_capacity
+            event_times, event_kinds = self.event_times[slots], self.event_kinds[slots]
+            event_values = self.event_values[slots]
+            state = dict(zip(self.fields, self.state.tolist()))
+            if int(self.header[0]) == seq:
+                break
+        self.overruns += start - self.tail
+        self.tail, self.event_tail = head, event_head
+        events = [Event(t, EVENT_KINDS[kind], None if np.isnan(value) else int(value))
+                  for t, kind, value in zip(event_times.tolist(), event_kinds.tolist(), event_values.tolist())]
+        return times, values, puncture, events, state
+
+    def snapshot(self):
+        # the current state only, consistent like read()
+        while True:
+            seq = int(self.header[0])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            state = dict(zip(self.fields, self.state.tolist()))
+            if int(self.header[0]) == seq:
+                return state
+
+    def close(self):
+        # the arrays are views on the buffer and must go first
+        for name in ('prefix', 'header', 'state', 'times', 'values', 'puncture', 'event_times', 'event_kinds',
+                     'event_values'):
+            setattr(self, name, None)
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,188 @@
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+import numpy as np
+import serial
+
+from protocol import encode_frames
+
+# (kind, start s, duration s, depth) repeated every `period` seconds:
+# a short touch, a puncture that keeps sinking for longer than 3 s, then the
+# needle held still (no noise) so the plateau rule can fire
+DEFAULT_EVENTS = (
+    ('touch', 8, 1, 200),
+    ('puncture', 20, 6, 1000),
+    ('plateau', 26, 2, 0),
+)
+
+
+class LoadCellModel:
+    # Synthetic load cell signal in the units the sketch sends (reading / 100)
+    def __init__(self, baseline=50000, noise=5.0, drift=0.0, mains=0.0, mains_hz=50, events=DEFAULT_EVENTS,
+                 period=40, seed=None):
+        self.baseline = baseline
+        self.noise = noise
+        self.drift = drift  # counts per second
+        self.mains = mains  # amplitude of the mains pickup
+        self.mains_hz = mains_hz
+        self.events = events
+        self.period = period
+        self.rng = np.random.default_rng(seed)
+
+    def values(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        v = self.baseline + self.drift * t + self.rng.normal(0, self.noise, len(t))
+        if self.mains:
+            v += self.mains * np.sin(2 * np.pi * self.mains_hz * t)
+        local = t % self.period if self.period else t
+        for kind, start, duration, depth in self.events:
+            inside = (local >= start) & (local < start + duration)
+            phase = (local[inside] - start) / duration
+            if kind == 'touch':
+                v[inside] -= depth * np.sin(np.pi * phase)
+            elif kind == 'puncture':
+                v[inside] -= depth * phase
+            elif kind == 'plateau':
+                v[inside] = self.baseline + depth
+        return np.round(v).astype(np.int64)
+
+
+class SimulatedDevice:
+    # In-process stand-in for serial.Serial running Arduino/HX711_basic_example.ino.
+    # Samples are generated against the real clock at `rate` per second and
+    # answer 'g' polls or stream as ASCII ('s') or binary ('b') frames until 'x'.
+    # Faults: garbage (probability a sample is sent corrupted), dropout
+    # (probability a sample is never sent) and disconnect_after (seconds after
+    # opening, every call then raises SerialException like an unplugged board).
+    def __init__(self, rate=80, model=None, garbage=0.0, dropout=0.0, disconnect_after=None,
+                 port='sim://', baudrate=57600, timeout=1, seed=None):
+        self.rate = rate
+        self.model = model or LoadCellModel(seed=seed)
+        self.garbage = garbage
+        self.dropout = dropout
+        self.disconnect_after = disconnect_after
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.rng = np.random.default_rng(seed)
+        self.is_open = True
+        self.streaming = None  # None, 'ascii' or 'binary'
+        self.seq = 0
+        self.polls = 0  # 'g' commands waiting for the next conversion
+        self.opened_at = time.monotonic()
+        self.next_sample = 0  # index of the next conversion since opening
+        self.out = bytearray()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        # sim://?rate=1000&noise=5&garbage=0.001&dropout=0.001&disconnect_after=30
+        params = dict(parse_qsl(urlsplit(url).query))
+        model_args = {}
+        for name in ('baseline', 'noise', 'drift', 'mains', 'period'):
+            if name in params:
+                model_args[name] = float(params.pop(name))
+        seed = int(params.pop('seed')) if 'seed' in params else None
+        model = LoadCellModel(seed=seed, **model_args)
+        for name in ('rate', 'garbage', 'dropout', 'disconnect_after'):
+            if name in params:
+                kwargs[name] = float(params.pop(name))
+        return cls(model=model, port=url, seed=seed, **kwargs)
+
+    def check_alive(self):
+        if self.disconnect_after is not None and time.monotonic() - self.opened_at >= self.disconnect_after:
+            self.is_open = False
+        if not self.is_open:
+            raise serial.SerialException("simulated device disconnected")
+
+    def generate(self):
+        due = int((time.monotonic() - self.opened_at) * self.rate)
+        if due <= self.next_sample:
+            return
+        index = np.arange(self.next_sample, due)
+        self.next_sample = due
+        if self.polls:
+            # like scale.read(), a poll is answered with the next conversion
+            answered = min(self.polls, len(index))
+            self.polls -= answered
+            values = self.model.values(index[-answered:] / self.rate)
+            self.out += b''.join(b"%d\r\n" % v for v in values.tolist())
+        if self.streaming is None:
+            return
+        times = index / self.rate
+        values = self.model.values(times)
+        seq = self.seq + np.arange(len(index))
+        self.seq += len(index)
+        sent = self.rng.random(len(index)) >= self.dropout
+        corrupt = self.rng.random(len(index)) < self.garbage
+        if self.streaming == 'ascii':
+            lines = [b"#!garbage?\r\n" if bad else b"%d,%d\r\n" % (s % 65536, v)
+                     for s, v, bad in zip(seq[sent].tolist(), values[sent].tolist(), corrupt[sent].tolist())]
+            self.out += b''.join(lines)
+        else:
+            frames = np.frombuffer(encode_frames(seq[sent], values[sent] * 100, (times[sent] * 1e6).astype(np.int64)),
+                                   dtype=np.uint8).reshape(-1, 11).copy()
+            bad = np.flatnonzero(corrupt[sent])
+            frames[bad, self.rng.integers(1, 11, len(bad))] ^= 0x5A
+            self.out += frames.tobytes()
+
+    def wait_for(self, ready):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self.lock:
+                self.check_alive()
+                self.generate()
+                if ready():
+                    return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(min(0.005, 1 / self.rate))
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self.check_alive()
+            self.generate()
+            return len(self.out)
+
+    def read(self, size=1):
+        self.wait_for(lambda: len(self.out) >= size)
+        with self.lock:
+            data = bytes(self.out[:size])
+            del self.out[:size]
+        return data
+
+    def readline(self):
+        self.wait_for(lambda: b'\n' in self.out)
+        with self.lock:
+            end = self.out.find(b'\n') + 1 or len(self.out)
+            data = bytes(self.out[:end])
+            del self.out[:end]
+        return data
+
+    def write(self, data):
+        with self.lock:
+            self.check_alive()
+            self.generate()
+            for command in bytes(data):
+                if command == ord('g'):
+                    self.polls += 1
+                elif command in (ord('s'), ord('b')):
+                    self.streaming = 'ascii' if command == ord('s') else 'binary'
+                    self.seq = 0
+                elif command == ord('x'):
+                    self.streaming = None
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.check_alive()
+            self.generate()
+            self.out.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
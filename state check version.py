@@ -1,22 +1,32 @@
+import argparse
+import atexit
+import threading
 import time
-import serial
-import serial.tools.list_ports
 import tkinter as tk
 from tkinter import filedialog
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.animation as animation
 from tkinter import messagebox
-import numpy as np
-import csv
 import os
-from collections import deque
 import tkinter.simpledialog as simpledialog
-from itertools import islice
+from renderer import BlitRenderer
+from detector import TOUCH, PUNCTURE
+from connection import discover_ports
+from instrumentation import Instrumentation
+from metrics import verdict
+from logger import log, DEBUG, INFO
+from recorder import read_recording, recover_all
+from formats import available_formats, export_session
+from viewer import ReviewWindow, SessionViewer
+from station import Station
+from process_station import ProcessStation
+from broker import BrokerStation
+from multi_plotter import MultiStationPlotter
 
 
 class RealTimePlotter:
-    def __init__(self, root):
+    def __init__(self, root, device_url=None, perf=False, perf_dump=None, recording_dir='recordings',
+                 multiprocess=False, broker=None, filter_spec=None):
         self.root = root
         self.root.title("Real-Time Plotter")
         self.root.state('zoomed')
@@ -24,10 +34,6 @@ class RealTimePlotter:
         self.running = False
         self.paused = False
         self.start_time = None
-        self.time_list = []
-        self.time_list_plot = deque([], maxlen=50)
-        self.data_list = []
-        self.data_list_plot = deque([], maxlen=50)
         self.threshold = 15000
         self.chart_threshold = 650000
         self.first_exceeding_time = None
@@ -39,28 +45,43 @@ class RealTimePlotter:
         self.puncThreshold = 0
         self.countdown_time = 60
         self.countdown_start_time = None
-        self.last_below_threshold_time = None
         self.great_flag = False
         self.puncCount = 0
-        self.dataQueue = deque([], maxlen=4)
         self.puncLabel = 0
         self.puncEvent = False
         self.startpuncflag = None
         self.Mawindow = 50
-        self.malist = deque([], maxlen=50)
-
-        self.punctureStateList = []
-        self.punctureStateTime = []
+        self.perf = Instrumentation(enabled=perf)  # stage timings, F12 toggles the overlay
+        # port, reader thread, calibration, detection and recording of the load cell; with
+        # multiprocess all of that runs in a child process and only the session is kept here; with a
+        # broker address the broker at that address owns the load cell and this window subscribes to it
+        if broker:
+            self.station = BrokerStation(broker, window=self.Mawindow, threshold=self.threshold, perf=self.perf)
+        else:
+            station = ProcessStation if multiprocess else Station
+            self.station = station(device_url=device_url, window=self.Mawindow, threshold=self.threshold,
+                                   perf=self.perf, filter_spec=filter_spec)
+        self.pipeline = self.station.pipeline  # session record
+        self.session = self.pipeline.session
 
         self.event_list = []  # List to store important events
         self.puncture_state_active = False
-        self.last_data_value = 0
-        self.stable_data_count = 0
-        self.stable_data_threshold = 5
+
+        self.perf_dump = perf_dump  # timings are written here on Stop
+        self.recording_dir = recording_dir  # the session is streamed there from the first Start on
+        self.export_thread = None
+        if not broker:
+            # recordings left unfinished by a crash; with a broker the
+            # recordings in it are the broker's, written by its process
+            recover_all(self.recording_dir)
+        atexit.register(self.station.close)
+        self.root.protocol('WM_DELETE_WINDOW', self.close)
 
         self.fig, self.ax = plt.subplots()
         self.canvas = FigureCanvasTkAgg(self.fig, master=root)
         self.canvas.get_tk_widget().pack()
+        self.renderer = BlitRenderer(self.fig, self.ax)
+        self.frame_interval = 50
 
         frame = tk.Frame(root)
         frame.pack()
@@ -71,6 +92,9 @@ class RealTimePlotter:
         tk.Button(frame, text="Stop", command=self.stop_animation).pack(side=tk.LEFT, padx=10, pady=10)
         tk.Button(frame, text="Reset Graph", command=self.reset_graph).pack(side=tk.LEFT, padx=10, pady=10)
         tk.Button(frame, text="Export Data", command=self.export_data).pack(side=tk.LEFT, padx=10, pady=10)
+        tk.Button(frame, text="Review", command=self.open_review).pack(side=tk.LEFT, padx=10, pady=10)
+        for text, window in (("10 s", 10), ("60 s", 60), ("All", None)):
+            tk.Button(frame, text=text, command=lambda w=window: self.set_view_window(w)).pack(side=tk.LEFT, pady=10)
 
         self.threshold_label = tk.Label(frame, text=f"Threshold: {self.threshold}", font=("Courier", 16))
         self.threshold_label.pack(side=tk.BOTTOM, padx=10, pady=10)
@@ -84,130 +108,144 @@ class RealTimePlotter:
         self.state_label = tk.Label(root , text="State : waiting" , font=('Courier' , 20))
         self.state_label.place(x=10 , y=50)
 
+        self.perf_label = tk.Label(root, text='', font=('Courier', 10), justify=tk.LEFT)
+        if self.perf.enabled:
+            self.perf_label.place(x=330, y=50)
+        self.root.bind('<F12>', self.toggle_instrumentation)
+        self.root.bind('<Control-F12>', self.dump_instrumentation)
+        self.root.bind('<F11>', self.toggle_sample_logging)
 
         self.setup_animation()
 
+    @property
+    def serial_port(self):
+        return self.station.serial_port
+
+    @property
+    def reader(self):
+        return self.station.reader
+
+    @property
+    def recorder(self):
+        return self.station.recorder
+
     def find_arduino_port(self):
-        ports = list(serial.tools.list_ports.comports())
-        for port in ports:
-            if "Arduino" in port.description:
-                return serial.Serial(port.device, 57600, timeout=1)
-        return None
+        return self.station.connect()
+
+    def start_reader(self):
+        self.station.start_reader()
 
     def setup_animation(self):
-        self.ani = animation.FuncAnimation(self.fig, self.animate, interval=50)
+        # driven by Tk directly: FuncAnimation would force a full draw_idle() every frame
+        self.frame_count = 0
+        self.root.after(self.frame_interval, self.next_frame)
+
+    def next_frame(self):
+        self.animate(self.frame_count)
+        self.frame_count += 1
+        self.root.after(self.frame_interval, self.next_frame)
 
     def animate(self, i):
-        if not self.running or self.paused or not self.serial_port:
+        if self.perf.enabled and i % 10 == 0:
+            self.perf_label.config(text=self.perf.overlay_text())
+        if self.station.calibrating:
+            with self.perf.stage('calibration'):
+                self.update_calibration()
+            return
+        if not self.running or self.paused or not self.station.acquiring:
             return
 
-        self.serial_port.write(b'g')
-        arduino_data_string = self.serial_port.readline().decode('ascii').strip()
-        current_time = time.time() - self.start_time
-        print(f"Received data: {arduino_data_string}")
+        # everything the reader thread collected since the last frame
+        with self.perf.stage('read'):
+            times, values = self.station.read()
+        self.perf.count(len(values))
+        if len(values) == 0:
+            return
 
-        try:
-            arduino_data_int = int(arduino_data_string)
-            self.time_list.append(current_time)
-            self.time_list_plot.append(current_time)
-            self.data_list.append(arduino_data_int)
-            self.data_list_plot.append(arduino_data_int)
-            self.dataQueue.append(arduino_data_int)
-            self.malist.append(arduino_data_int)
-
-            if len(self.malist) == self.Mawindow:
-                Mavg = np.mean(self.malist)
-                self.threshold = Mavg - (0.0015 * Mavg)
-                self.highThreshold = Mavg + (0.00025 * Mavg)
-                self.puncThreshold = Mavg - (0.00029 * Mavg)
-
-            # check state
-            if arduino_data_int < self.threshold:
-                if self.last_below_threshold_time is None:
-                    self.last_below_threshold_time = time.time()
-                else:
-                    elapsed_time = time.time() - self.last_below_threshold_time
-                    if elapsed_time >= 3:
-                        self.puncture_state()
-                    elif elapsed_time < 3:
-                        self.touch_state()
-            else:
-                if self.last_below_threshold_time is not None:
-                    elapsed_time = time.time() - self.last_below_threshold_time
-                    if elapsed_time < 3:
-                        self.touch_state()
-                    self.last_below_threshold_time = None
-                    #self.puncture_state_active = False
-                    #print('reset puncture state')
-
-
-            # detect data in puncture state
-            if self.puncture_state_active:
-                self.punctureStateList.append(arduino_data_int)
-                self.punctureStateTime.append(current_time)
-                if arduino_data_int > self.threshold:
-                    if arduino_data_int == self.last_data_value:
-                        self.stable_data_count += 1
-                        if self.stable_data_count >= self.stable_data_threshold:
-                            self.stop_animation()  # Stop the animation if data is stable
-
-                    else:
-                        self.stable_data_count = 0
-                        print('reset stable count')
-                    self.last_data_value = arduino_data_int
-                    print('record last data')
-            #else: #puncture state false
-                    # if data goes above threshold, reset puncture state
-                    #print('reset puncture state')
-                    #self.puncture_state_active = False
-                    #self.last_data_value = 0
-
-        except ValueError as e:
-            print(f"Error parsing data: {e}")
+        with self.perf.stage('detect'):
+            self.process_batch(times, values)
+
+        with self.perf.stage('render'):
+            plot_times, plot_values, current_time = self.station.visible(self.renderer, int(self.ax.bbox.width))
+            self.renderer.render(plot_times, plot_values, self.threshold, self.highThreshold,
+                                 self.puncThreshold, y_center=self.station.level, current_time=current_time)
+        self.threshold_label.config(text=f'Threshold: {self.threshold:.2f}  High: {self.highThreshold:.2f}  '
+                                         f'Puncture: {self.puncThreshold:.2f}')
+
+    def open_review(self):
+        # overview and zoom of the current graph, from the session in memory
+        session = self.session.since(self.station.graph_mark)
+        if len(session.samples) == 0:
+            messagebox.showinfo("Review", "Nothing recorded yet.")
             return
+        ReviewWindow(self.root, session.samples, session.events, session.thresholds)
+
+    def set_view_window(self, window):
+        # seconds of history on screen, None for the whole session
+        self.renderer.set_window(window)
+
+    def toggle_instrumentation(self, event=None):
+        self.perf.enabled = not self.perf.enabled
+        if self.perf.enabled:
+            self.perf.reset()
+            self.perf_label.config(text='')
+            self.perf_label.place(x=330, y=50)
+        else:
+            self.perf_label.place_forget()
 
-        # while self.time_list_plot and (current_time - self.time_list_plot[0]) > 10:
-        # self.time_list_plot.pop(0)
-        # self.data_list_plot.pop(0)
+    def dump_instrumentation(self, event=None):
+        path = self.perf_dump or time.strftime('perf-%Y%m%d-%H%M%S.json')
+        self.perf.dump(path, **self.station.stats())
+        log.info('timings', f"Timings written to {path}", path=path)
 
-        self.ax.clear()
-        self.ax.plot(self.time_list_plot, self.data_list_plot)
+    def toggle_sample_logging(self, event=None):
+        # DEBUG adds every received sample to the session log
+        log.set_level(INFO if log.is_enabled_for(DEBUG) else DEBUG)
 
-        if len(self.data_list_plot) >= 50:
-            slicedata = list(islice(self.data_list_plot, len(self.data_list_plot) - 50, len(self.data_list_plot)))
-            mean = np.mean(slicedata)
-            self.ax.set_ylim([mean - 0.002 * mean, mean + 0.002 * mean])
-        else:
-            mean = np.mean(self.data_list_plot)
-            self.ax.set_ylim([mean - 0.002 * mean, mean + 0.002 * mean])
-        self.ax.set_xlim([max(0, current_time - 10), current_time])
+    def process_batch(self, times, values):
+        result, kept, events = self.station.process(times, values)
+        self.threshold = self.station.threshold
+        self.highThreshold = self.station.high_threshold
+        self.puncThreshold = self.station.punc_threshold
 
-        self.ax.axhline(y=self.threshold, color='r', linestyle='--', label=f'Threshold: {self.threshold}')
-        self.ax.axhline(y=self.highThreshold, color='k', linestyle='--', label=f'High Threshold :{self.highThreshold}')
-        self.ax.axhline(y=self.puncThreshold, color='m', linestyle='--',
-                        label=f'Puncture Threshold : {self.puncThreshold}')
-        self.ax.legend()
+        for event in events:
+            if event.kind == TOUCH:
+                self.touch_state()
+            elif event.kind == PUNCTURE:
+                self.puncture_state()
+        self.puncture_state_active = self.station.puncture_active
 
-        self.ax.set_title("Arduino Data")
-        self.ax.set_xlabel("Time (s)")
-        self.ax.set_ylabel("Value")
-        self.canvas.draw()
+        if self.station.stopped:
+            self.stop_animation()  # Stop the animation if data is stable
 
     def touch_state(self):
-        print("Touch State detected")
         self.puncture_state_active = False
         self.state_label.config(text='State : Touch')
 
     def puncture_state(self):
-        print("Puncture State detected")
         self.puncture_state_active = True
         self.state_label.config(text="State : Puncture")
 
     def start_sequence(self):
-        self.calibrate_threshold()
-        self.start_countdown()
+        if self.station.calibrating:
+            return
+        name = time.strftime('session-%Y%m%d-%H%M%S')
+        log.start_session(name)  # one log file per measurement
+        self.start_recording(name)
+        self.calibrate_threshold()  # the countdown starts once calibration finishes
         # self.start_animation()
 
+    def start_recording(self, name):
+        self.station.start_recording(self.recording_dir, name)
+
+    def close_recording(self):
+        self.station.close_recording()
+
+    def close(self):
+        # window closed: stops acquisition, the recording and an acquisition process
+        self.station.close()
+        self.root.destroy()
+
     def start_countdown(self):
         if self.countdown_label is None:
             self.countdown_label = tk.Label(self.root, font=("Courier", 36))
@@ -225,11 +263,11 @@ class RealTimePlotter:
             self.countdown_seconds -= 1
             self.root.after(1000, self.countdown_tick)
         elif self.countdown_seconds <= 0:
-            print('finish countdown')
+            log.debug('countdown', 'finish countdown')
             self.countdown_label.pack_forget()
             self.start_animation()
             self.countdown_animation()
-            print('start animation')
+            log.debug('countdown', 'start animation')
 
     def countdown_animation(self):
         if self.countdown_label is None:
@@ -256,35 +294,37 @@ class RealTimePlotter:
 
     def start_animation(self):
         if not self.running:
-            self.start_time = time.time() - (self.time_list_plot[-1] if self.time_list_plot else 0)
-            # port flushing
-            self.serial_port.close()
-            time.sleep(0.5)
-            self.serial_port = self.find_arduino_port()
-            if self.serial_port:
-                print(f"Connected to {self.serial_port.port}")
-            else:
-                print("Arduino not found")
-            # finish port flushing
+            # keeps streaming from calibration, only drops what arrived during the countdown;
+            # resumes the clock where the current graph ended
+            samples = self.session.samples
+            self.station.start(float(samples.times[-1]) if len(samples) > self.station.graph_mark[0] else 0)
+            self.start_time = self.station.start_time
             self.running = True
             self.paused = False
 
+    def stop_reader(self):
+        self.station.stop_reader()
+
     def stop_animation(self):
+        if self.station.calibrating:
+            self.station.cancel_calibration()
+            self.calibration_label.config(text='Calibration cancelled')
+            return
         self.running = False
         self.paused = True
-        self.last_below_threshold_time = None
+        outcome = self.station.stop()  # kept up to date while acquiring, nothing left to scan
+        if self.perf.enabled and self.perf_dump:
+            self.dump_instrumentation()
         #self.serial_port.close()
         #time.sleep(0.5)
-        puncture_start_time = self.punctureStateTime[0]
-        min_value = min(self.punctureStateList)
-        min_value_index = self.punctureStateList.index(min_value)
-        min_value_time = self.punctureStateTime[min_value_index]
-        elapsed_time = min_value_time - puncture_start_time
-        if elapsed_time > 6 :
-            messagebox.showinfo('Result', 'Great blood drawing!!!')
-            self.great_flag = False
+        if outcome and outcome['puncture_to_min'] is not None:
+            elapsed_time = outcome['puncture_to_min']
+            log.info('result', f"Puncture to minimum {elapsed_time:.2f} s", elapsed=elapsed_time)
         else:
-            messagebox.showinfo('Result', 'Try again')
+            log.info('result', "No puncture detected")
+        if outcome and outcome['great']:
+            self.great_flag = False
+        messagebox.showinfo('Result', verdict(outcome))
 
 
 
@@ -292,92 +332,131 @@ class RealTimePlotter:
     def reset_graph(self):
         self.running = False
         self.paused = False
-        self.time_list_plot.clear()
-        self.data_list_plot.clear()
         self.first_exceeding_value = None
         self.notified = False
-        self.ax.clear()
-        self.ax.set_ylim([6000, self.chart_threshold])
-        self.ax.set_title("Arduino Data")
-        self.ax.set_xlabel("Time (s)")
-        self.ax.set_ylabel("Value")
-        self.serial_port.close()
-        time.sleep(0.5)
+        self.renderer.reset([6000, self.chart_threshold])
+        self.station.reset_graph()  # time restarts at 0
+        self.stop_reader()
         self.start_sequence()
 
     def calibrate_threshold(self):
+        # Starts calibration and returns; animate() feeds the calibrator from the
+        # reader thread each frame, so the window stays responsive and Stop cancels.
         self.calibration_label.config(text='Calibrating threshold')
-        self.root.update_idletasks()
+        if not self.station.start_calibration():
+            self.calibration_label.config(text='Arduino not found')
 
-        self.serial_port = self.find_arduino_port()
-        if self.serial_port:
-            print(f"Connected to {self.serial_port.port}")
-        else:
-            print("Arduino not found")
+    def update_calibration(self):
+        if not self.station.update_calibration():
+            progress, count = self.station.calibration_progress()
+            self.calibration_label.config(text=f'Calibrating threshold {progress:.0%} ({count} samples)')
+            return
 
-        initial_data = []
-        start_time = time.time()
-        while time.time() - start_time < 10:
-            self.serial_port.write(b'g')
-            arduino_data_string = self.serial_port.readline().decode('ascii').strip()
-            try:
-                arduino_data_int = int(arduino_data_string)
-                initial_data.append(arduino_data_int)
-            except ValueError:
-                pass
-        if initial_data:
-            mean = np.mean(initial_data)
-            self.threshold = mean - 0.0012 * mean
-            self.highThreshold = mean + 0.00035 * mean
-            self.puncThreshold = mean - 0.0003 * mean
-            self.threshold_label.config(text=f'Threshold: {self.threshold:.2f}')
+        thresholds = self.station.calibrated_thresholds()
+        if thresholds:
+            self.install_thresholds(*thresholds)
         else:
             self.threshold = 1500
+            self.station.set_thresholds(self.threshold, self.highThreshold, self.puncThreshold)
             self.threshold_label.config(text=f"Threshold: {self.threshold}")
         self.calibration_label.config(text='')
+        self.start_countdown()
 
-    import tkinter.simpledialog as simpledialog
+    def install_thresholds(self, threshold, high_threshold, punc_threshold):
+        self.threshold, self.highThreshold, self.puncThreshold = threshold, high_threshold, punc_threshold
+        self.station.install_thresholds(threshold, high_threshold, punc_threshold)
+        self.threshold_label.config(text=f'Threshold: {self.threshold:.2f}')
 
     def export_data(self):
-        # Prompt the user to enter a file name
-        file_name = simpledialog.askstring("Input", "Enter file name for export (without extension):")
+        # Prompt the user to enter a file name; the extension picks the format
+        formats = available_formats()
+        file_name = simpledialog.askstring("Input", "Enter file name for export "
+                                                    f"(.{', .'.join(formats)}; without extension: .csv):")
 
         if not file_name:
             messagebox.showwarning("Export Canceled", "No file name provided. Export canceled.")
             return
+        file_name, extension = os.path.splitext(file_name)
+        fmt = extension[1:].lower() or 'csv'
+        if fmt not in formats:
+            messagebox.showwarning("Export Canceled", f"Cannot export .{fmt}, use one of .{', .'.join(formats)}")
+            return
 
         export_path = filedialog.askdirectory(title="Select Export Directory")
-        if export_path:
+        if not export_path:
+            return
+        if self.export_thread is not None and self.export_thread.is_alive():
+            messagebox.showwarning("Export Busy", "An export is still running.")
+            return
+        base = os.path.join(export_path, file_name)
+        if self.recorder is None:
             try:
-                combined_data_path = os.path.join(export_path, f"{file_name}.csv")
-                with open(combined_data_path, 'w', newline='') as csvfile:
-                    writer = csv.writer(csvfile)
-                    # Write header
-                    writer.writerow(['Time (s)', 'Value', 'Puncture Time (s)', 'Puncture Value'])
-
-                    # Determine the maximum length among the lists
-                    max_length = max(len(self.time_list), len(self.data_list), len(self.punctureStateTime),
-                                     len(self.punctureStateList))
-
-                    # Pad lists to ensure they all have the same length
-                    time_list_padded = self.time_list + [None] * (max_length - len(self.time_list))
-                    data_list_padded = self.data_list + [None] * (max_length - len(self.data_list))
-                    punctureStateTime_padded = self.punctureStateTime + [None] * (
-                                max_length - len(self.punctureStateTime))
-                    punctureStateList_padded = self.punctureStateList + [None] * (
-                                max_length - len(self.punctureStateList))
-
-                    # Write rows
-                    for t, d, pt, pd in zip(time_list_padded, data_list_padded, punctureStateTime_padded,
-                                            punctureStateList_padded):
-                        writer.writerow([t, d, pt, pd])
-
+                export_session(self.session, base, fmt)
                 messagebox.showinfo("Export Successful", f"Data exported to {os.path.join(export_path, file_name)}")
             except Exception as e:
                 messagebox.showerror("Export Failed", str(e))
+            return
+        # everything is on disk already, convert the recording without blocking the window
+        self.export_result = None
+        self.export_thread = threading.Thread(target=self.run_export, args=(self.recorder, base, fmt),
+                                              name="Export", daemon=True)
+        self.export_thread.start()
+        self.root.after(100, self.check_export, os.path.join(export_path, file_name))
+
+    def run_export(self, recorder, base, fmt):
+        # the flush waits for the recorder thread, so it runs here and not on the Tk thread
+        try:
+            recorder.flush()
+            export_session(read_recording(recorder.path), base, fmt)
+            self.export_result = None
+        except Exception as e:
+            self.export_result = e
+
+    def check_export(self, display_path):
+        if self.export_thread.is_alive():
+            self.root.after(100, self.check_export, display_path)
+        elif self.export_result is None:
+            messagebox.showinfo("Export Successful", f"Data exported to {display_path}")
+        else:
+            messagebox.showerror("Export Failed", str(self.export_result))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', action='append', help="serial port or device url instead of auto discovery, "
+                                                          "e.g. COM5 or sim://?rate=1000&noise=5&garbage=0.001; "
+                                                          "repeat it for one station per device")
+    parser.add_argument('--stations', type=int, metavar='N',
+                        help="acquire from the first N boards found, a tile per station")
+    parser.add_argument('--perf', action='store_true', help="time the frame stages and show the overlay (F12)")
+    parser.add_argument('--perf-dump', metavar='PATH', help="write the timings as JSON here on Stop (Ctrl+F12)")
+    parser.add_argument('--multiprocess', action='store_true',
+                        help="acquire and detect in a separate process, the window only reads its results")
+    parser.add_argument('--filter', metavar='SPEC',
+                        help="filter the samples before detection: comma separated rate:HZ, median:WIDTH, "
+                             "notch:HZ, lowpass:HZ, e.g. rate:80,median:5,notch:50,lowpass:10")
+    parser.add_argument('--broker', metavar='ADDRESS',
+                        help="subscribe to a running broker (python broker.py) instead of opening the device, "
+                             "e.g. 127.0.0.1:8765 or unix:/tmp/loadcell.sock")
+    parser.add_argument('--view', metavar='PATH', help="open a recorded session read-only instead of acquiring")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    plotter = RealTimePlotter(root)
+    if args.view:
+        SessionViewer(root, args.view)
+        root.mainloop()
+        raise SystemExit
+    devices = args.device or []
+    if args.stations and not devices:
+        devices = discover_ports(args.stations)
+        if not devices:
+            raise SystemExit("No boards found")
+    # the windows stay alive through their Tk callbacks
+    if args.broker:
+        RealTimePlotter(root, perf=args.perf, perf_dump=args.perf_dump, broker=args.broker)
+    elif len(devices) > 1:
+        MultiStationPlotter(root, devices, perf=args.perf, multiprocess=args.multiprocess, filter_spec=args.filter)
+    else:
+        RealTimePlotter(root, device_url=devices[0] if devices else None, perf=args.perf,
+                        perf_dump=args.perf_dump, multiprocess=args.multiprocess, filter_spec=args.filter)
     root.mainloop()
@@ -0,0 +1,285 @@
+import os
+import time
+
+from acquisition import SampleRingBuffer, SerialReader
+from archive import SUFFIX as ARCHIVE_SUFFIX
+from calibration import Calibrator
+from connection import ConnectionManager
+from detector import TOUCH, PUNCTURE
+from filters import FilterChain
+from instrumentation import Instrumentation
+from logger import log, DEBUG
+from pipeline import Pipeline
+from protocol import BINARY
+from pyramid import MinMaxPyramid
+from recorder import SessionRecorder
+
+WAITING = 'waiting'
+CALIBRATING = 'calibrating'
+ACQUIRING = 'acquiring'
+STOPPED = 'stopped'
+
+
+class Station:
+    # One load cell and everything that belongs to it: the port and its
+    # reconnects, the reader thread and its ring buffer, calibration, the
+    # detection pipeline with its thresholds, the recording and the pyramid
+    # the plot is drawn from. No Tk here; RealTimePlotter drives one station,
+    # MultiStationPlotter several from a single frame loop. The reader thread
+    # fills the buffer on its own, so a station only loses samples if nobody
+    # calls read() for buffer.capacity samples. batch_interval is handed to
+    # the SerialReader; filter_spec is a filters.FilterChain spec applied
+    # before detection.
+    def __init__(self, name='station', device_url=None, window=50, threshold=15000, mode=BINARY, perf=None,
+                 buffer_size=4096, batch_interval=0.0, filter_spec=None):
+        self.name = name
+        self.device_url = device_url
+        self.perf = perf or Instrumentation()
+        self.filter_spec = filter_spec
+        self.pipeline = Pipeline(window=window, threshold=threshold, perf=self.perf,
+                                 signal_filter=FilterChain(filter_spec) if filter_spec else None)
+        self.connection = ConnectionManager(on_connect=self.on_reconnect, url=device_url)
+        self.buffer = SampleRingBuffer(buffer_size)
+        self.calibrator = Calibrator()
+        self.mode = mode  # falls back to ASCII streaming, then polling, with old firmware
+        self.batch_interval = batch_interval
+        self.serial_port = None
+        self.reader = None
+        self.recorder = None
+        self.status = WAITING
+        self.start_time = None
+        self.threshold, self.high_threshold, self.punc_threshold = threshold, 0, 0
+        self.state = None  # TOUCH or PUNCTURE, the last state detected
+        self.puncture_active = False
+        self.pyramid = MinMaxPyramid(self.session.samples)
+        self.graph_mark = self.session.mark()  # where the current graph starts
+
+    @property
+    def session(self):
+        return self.pipeline.session
+
+    @property
+    def detector(self):
+        return self.pipeline.detector
+
+    @property
+    def acquiring(self):
+        return self.status == ACQUIRING
+
+    @property
+    def calibrating(self):
+        return self.calibrator.running
+
+    @property
+    def stopped(self):
+        # True once the pipeline saw a plateau
+        return self.pipeline.stopped
+
+    @property
+    def level(self):
+        # the rolling mean the plot is centred on
+        return self.detector.rolling.mean
+
+    def calibration_progress(self):
+        return self.calibrator.progress, self.calibrator.count
+
+    def calibrated_thresholds(self):
+        # (threshold, high, puncture) from the last calibration, or None
+        return self.calibrator.thresholds()
+
+    def stats(self):
+        reader = self.reader
+        return {'mode': reader.mode if reader else None, 'dropped': self.buffer.dropped,
+                'lost': reader.lost if reader else 0}
+
+    def connect(self):
+        # the connection manager keeps the port open, so only the first call discovers and opens it
+        self.serial_port = self.connection.connect()
+        return self.serial_port
+
+    def start_reader(self):
+        # (re)start acquisition on the open port, dropping anything stale
+        self.stop_reader()
+        self.connection.flush()
+        self.buffer.clear()
+        self.reader = SerialReader(self.serial_port, self.buffer, mode=self.mode, on_error=self.on_port_error,
+                                   perf=self.perf, batch_interval=self.batch_interval)
+        self.reader.start()
+
+    def stop_reader(self):
+        if self.reader is not None:
+            self.reader.stop()
+            reader = self.reader
+            log.info('reader_stopped', f"Reader stopped ({reader.mode}): dropped={reader.dropped} late={reader.late} "
+                     f"lost={reader.lost} parse errors={reader.parse_errors} bad frames={reader.bad_frames} "
+                     f"resyncs={reader.resyncs}", station=self.name, mode=reader.mode, dropped=reader.dropped,
+                     late=reader.late, lost=reader.lost, parse_errors=reader.parse_errors,
+                     bad_frames=reader.bad_frames, resyncs=reader.resyncs)
+            self.reader = None
+
+    def reader_alive(self):
+        return self.reader is not None and self.reader.is_alive()
+
+    def on_port_error(self, error):
+        # called from the reader thread, e.g. when the board is unplugged
+        self.connection.reconnect()
+
+    def on_reconnect(self, port):
+        # called from the reconnect thread
+        log.info('connected', f"Connected to {port.port}", station=self.name, port=port.port)
+        self.serial_port = port
+        if self.acquiring or self.calibrator.running:
+            self.start_reader()
+
+    def start_calibration(self):
+        # False if the device cannot be opened
+        if not self.connect():
+            log.error('not_found', "Arduino not found", station=self.name)
+            return False
+        log.info('connected', f"Connected to {self.serial_port.port}", station=self.name, port=self.serial_port.port)
+        self.start_reader()
+        self.calibrator.start(time.monotonic())
+        self.status = CALIBRATING
+        return True
+
+    def update_calibration(self):
+        # feeds what the reader collected; True once calibration is over
+        times, values = self.buffer.drain()
+        self.calibrator.feed(times, values)
+        self.calibrator.check(time.monotonic())
+        if self.calibrator.running:
+            return False
+        self.status = WAITING
+        return True
+
+    def cancel_calibration(self):
+        self.calibrator.cancel()
+        self.stop_reader()
+        self.status = WAITING
+
+    def set_thresholds(self, threshold, high_threshold, punc_threshold):
+        # all three change together, between two frames
+        self.threshold, self.high_threshold, self.punc_threshold = threshold, high_threshold, punc_threshold
+        self.detector.set_thresholds(threshold, high_threshold, punc_threshold)
+
+    def install_thresholds(self, threshold, high_threshold, punc_threshold):
+        # calibrated thresholds, also kept in the session meta and the recording
+        self.set_thresholds(threshold, high_threshold, punc_threshold)
+        meta = {'threshold': float(threshold), 'high_threshold': float(high_threshold),
+                'punc_threshold': float(punc_threshold), 'calibrated_at': time.time()}
+        self.session.meta.update(meta)
+        if self.recorder is not None:
+            self.recorder.write_meta(**meta)
+        log.info('thresholds', f"Calibrated threshold {threshold:.2f}", station=self.name, threshold=threshold,
+                 high_threshold=high_threshold, punc_threshold=punc_threshold)
+
+    def start(self, elapsed=0.0):
+        # starts (or resumes) acquisition with the clock at `elapsed` seconds;
+        # False if the device cannot be opened
+        self.start_time = time.monotonic() - elapsed
+        if self.reader_alive():
+            # keep streaming from calibration, only drop what arrived since
+            self.buffer.clear()
+        elif self.connect():
+            self.start_reader()
+        else:
+            log.error('not_found', "Arduino not found", station=self.name)
+            return False
+        self.pipeline.stopped = False
+        self.status = ACQUIRING
+        return True
+
+    def stop(self):
+        # Returns the outcome of the measurement (OutcomeMetrics.summary()),
+        # also kept in the session meta and the recording; None if it only
+        # cancelled calibration.
+        if self.calibrator.running:
+            self.cancel_calibration()
+            return None
+        self.status = STOPPED
+        self.pipeline.interrupt()
+        self.stop_reader()
+        outcome = self.outcome()
+        self.session.meta['outcome'] = outcome
+        if self.recorder is not None:
+            self.recorder.write_meta(outcome=outcome)
+            self.recorder.flush()
+        return outcome
+
+    def outcome(self):
+        # the metrics of the measurement so far
+        return self.pipeline.metrics.summary()
+
+    def read(self):
+        # everything the reader thread collected since the last call, with
+        # times in seconds since start()
+        times, values = self.buffer.drain()
+        return times - self.start_time, values
+
+    def process(self, times, values):
+        # Detection on one batch. Returns (result, kept) like Pipeline.process
+        # and the TOUCH / PUNCTURE events of the kept samples, oldest first.
+        if log.is_enabled_for(DEBUG):
+            log.debug('samples', limit=False, station=self.name, times=times.tolist(), values=values.tolist())
+        result, kept = self.pipeline.process(times, values)
+        if kept == 0:
+            return result, kept, []
+        self.threshold = result.threshold[kept - 1]
+        self.high_threshold = result.high_threshold[kept - 1]
+        self.punc_threshold = result.punc_threshold[kept - 1]
+        end_time = times[kept - 1]
+        events = []
+        for event in result.events:
+            if event.time > end_time:
+                break
+            if event.kind in (TOUCH, PUNCTURE):
+                events.append(event)
+                self.state = event.kind
+                log.info(event.kind, f"{event.kind.capitalize()} State detected", station=self.name)
+        self.puncture_active = bool(result.puncture_mask[kept - 1])
+        return result, kept, events
+
+    def visible(self, renderer, pixels):
+        # (times, values, current_time) to draw on `renderer`, decimated to `pixels`
+        self.pyramid.update()
+        current_time = float(self.session.samples.times[-1])
+        start, end = renderer.visible_span(current_time)
+        times, values = self.pyramid.query(start, end, pixels)
+        return times, values, current_time
+
+    def reset_graph(self):
+        # time restarts at 0 for the next start(), a new measurement: the
+        # recording of this one is closed, start_recording() opens the next
+        self.pyramid = MinMaxPyramid(self.session.samples, offset=len(self.session.samples))
+        self.graph_mark = self.session.mark()
+        self.pipeline.metrics.reset()
+        self.close_recording()
+
+    def start_recording(self, directory, name):
+        # one recording per measurement, from here until reset_graph() or close()
+        if self.recorder is not None:
+            return self.recorder
+        path = os.path.join(directory, f'{name}.rec')
+        try:
+            # the .archive next to it opens instantly in the viewer (--view)
+            self.recorder = SessionRecorder(path, archive_path=os.path.join(directory,
+                                                                             f'{name}{ARCHIVE_SUFFIX}')).start()
+        except OSError as e:
+            log.error('recorder_failed', f"Cannot record to {path}: {e}", station=self.name, path=path)
+            return None
+        self.pipeline.recorder = self.recorder
+        if self.filter_spec:
+            self.recorder.write_meta(filter=self.filter_spec)  # the samples recorded are filtered
+        log.info('recording', f"Recording to {path}", station=self.name, path=path)
+        return self.recorder
+
+    def close_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+            self.pipeline.recorder = None
+
+    def close(self):
+        self.stop_reader()
+        self.close_recording()
+        self.connection.close()
@@ -13,6 +13,7 @@ import csv
 import os
 from collections import deque
 from itertools import islice
+from calibration import Calibrator
 
 class RealTimePlotter:
     def __init__(self, root):
@@ -49,6 +50,8 @@ class RealTimePlotter:
         self.malist = deque([] , maxlen= 50 )
 
         self.event_list = []  # List to store important events
+        self.calibrator = Calibrator()
+        self.calibrated = False  # thresholds from a calibration, the moving average leaves them alone
 
 
         self.fig, self.ax = plt.subplots()
@@ -104,7 +107,14 @@ class RealTimePlotter:
             self.dataQueue.append(arduino_data_int)
             self.malist.append(arduino_data_int)
 
-            if len(self.malist) == self.Mawindow:
+            if self.calibrator.running:
+                self.calibrator.feed([current_time], [arduino_data_int])
+                if self.calibrator.running:
+                    self.calibration_label.config(text=f'Calibrating threshold {self.calibrator.progress:.0%}')
+                else:
+                    self.finish_calibration()
+
+            if len(self.malist) == self.Mawindow and not self.calibrated:
                 Mavg = np.mean(self.malist)
                 self.threshold = Mavg - (0.0015*Mavg)
                 self.highThreshold = Mavg + (0.00025*Mavg)
@@ -281,8 +291,10 @@ class RealTimePlotter:
             self.highThreshold = mean + 0.00035 * mean
             self.puncThreshold = mean - 0.0003 * mean
             self.threshold_label.config(text=f'Threshold: {self.threshold:.2f}')
+            self.calibrated = True
         else:
             self.threshold = 15000
+            self.calibrated = False
             self.threshold_label.config(text=f"Threshold: {self.threshold}")
         self.calibration_label.config(text='')
 
@@ -290,10 +302,21 @@ class RealTimePlotter:
         self.root.after(30000, self.auto_calibrate)
 
     def auto_calibrate(self):
-        if self.running and not self.paused:
-            self.calibrate_threshold()
+        # recalibrates from the samples animate() is already reading instead of
+        # blocking the GUI for 10 s in calibrate_threshold()
+        if self.running and not self.paused and not self.calibrator.running:
+            self.calibration_label.config(text='Calibrating threshold 0%')
+            self.calibrator.start(time.time() - self.start_time)
         self.schedule_auto_calibration()
 
+    def finish_calibration(self):
+        thresholds = self.calibrator.thresholds()
+        if thresholds:
+            self.threshold, self.highThreshold, self.puncThreshold = thresholds
+            self.threshold_label.config(text=f'Threshold: {self.threshold:.2f}')
+            self.calibrated = True
+        self.calibration_label.config(text='')
+
     def export_data(self):
         export_path = filedialog.askdirectory(title="Select Export Directory")
         if export_path:
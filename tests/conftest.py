@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logger import log  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def log_directory(tmp_path, monkeypatch):
+    # session log files go to the test's directory, not ./logs
+    monkeypatch.setattr(log, 'directory', str(tmp_path / 'logs'))
@@ -0,0 +1,18 @@
+import numpy as np
+
+from simulator import LoadCellModel
+
+
+def session_signal(seconds=120, rate=80, seed=0, **model):
+    # the simulator's touch / puncture / plateau script, as the pipeline sees it
+    times = np.arange(int(seconds * rate)) / rate
+    return times, np.rint(LoadCellModel(seed=seed, **model).values(times)).astype(np.int64)
+
+
+def chunks(n, seed=0, largest=300):
+    # random chunk boundaries over n samples, ones of a single sample included
+    rng = np.random.default_rng(seed)
+    bounds = [0]
+    while bounds[-1] < n:
+        bounds.append(min(n, bounds[-1] + int(rng.integers(1, largest))))
+    return list(zip(bounds[:-1], bounds[1:]))
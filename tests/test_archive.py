@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from archive import ArchiveWriter, SessionArchive
+from station import Station
+
+
+def feed(station, seconds, rate=80, level=650000):
+    times = np.arange(int(seconds * rate)) / rate
+    station.process(times, np.full(len(times), level, dtype=np.int64))
+    return times
+
+
+def test_writer_rejects_time_going_back(tmp_path):
+    writer = ArchiveWriter(str(tmp_path / 'a.archive'))
+    try:
+        writer.append_samples(np.arange(10) / 4, np.arange(10))
+        with pytest.raises(ValueError):
+            writer.append_samples(np.arange(10) / 4, np.arange(10))
+    finally:
+        writer.close()
+
+
+def test_reset_graph_starts_a_new_recording(tmp_path):
+    station = Station()
+    try:
+        station.start_recording(str(tmp_path), 'first')
+        first = feed(station, 3)
+        station.reset_graph()
+        assert station.recorder is None and station.pipeline.recorder is None
+        station.start_recording(str(tmp_path), 'second')
+        second = feed(station, 2)
+    finally:
+        station.close()
+
+    for name, times in (('first', first), ('second', second)):
+        archive = SessionArchive(str(tmp_path / f'{name}.archive'))
+        assert np.array_equal(archive.times, times)
+        t, _ = archive.slice(1.0, 1.5)
+        assert np.array_equal(t, times[(times >= 1.0) & (times < 1.5)])
@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks import compare, flatten
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks.py')
+
+
+def report(**results):
+    return {'commit': None, 'results': results}
+
+
+def test_compare_flags_slower_timings_only():
+    baseline = report(detection={'whole_ms': 10.0, 'batched_ms': 10.0, 'rows': 100}, render={'blit_ms': 5.0})
+    current = report(detection={'whole_ms': 10.5, 'batched_ms': 12.0, 'rows': 900}, render={'blit_ms': 2.0},
+                     filter={'new_ms': 1.0})
+    assert compare(baseline, current, tolerance=0.1) == ['detection.batched_ms']
+
+
+def test_flatten():
+    assert flatten({'a': {'b': {'c_ms': 1}}, 'd': 2}) == {'a.b.c_ms': 1, 'd': 2}
+
+
+def run(*args):
+    return subprocess.run([sys.executable, SCRIPT, 'parse', *args], capture_output=True, text=True, timeout=120)
+
+
+def test_json_output_and_compare(tmp_path):
+    output = tmp_path / 'run.json'
+    assert run('-o', str(output)).returncode == 0
+    with open(output) as f:
+        data = json.load(f)
+    assert set(data) == {'commit', 'timestamp', 'machine', 'results'}
+    timings = data['results']['parse']
+    assert timings and all(value > 0 for value in timings.values())
+
+    # a baseline ten times faster is a regression, one ten times slower is not
+    for factor, code in ((0.1, 1), (10, 0)):
+        baseline = tmp_path / f'baseline-{factor}.json'
+        data['results']['parse'] = {name: value * factor for name, value in timings.items()}
+        with open(baseline, 'w') as f:
+            json.dump(data, f)
+        result = run('--compare', str(baseline))
+        assert result.returncode == code, result.stdout + result.stderr
+        assert 'parse.binary_per_sample_us' in result.stdout
@@ -0,0 +1,95 @@
+import math
+import threading
+import time
+
+import numpy as np
+import pytest
+import serial
+
+import process_station
+from broker import Broker, BrokerClient, pack_state, unpack_state
+from process_station import FIELDS, STATUSES
+from recorder import is_complete, is_recording, recover_all
+from station import ACQUIRING, WAITING
+
+
+@pytest.fixture
+def broker():
+    broker = Broker(address='127.0.0.1:0', device_url='sim://', interval=0.005)
+    broker.address = f'127.0.0.1:{broker.listener.getsockname()[1]}'
+    thread = threading.Thread(target=broker.serve_forever, daemon=True)
+    thread.start()
+    yield broker
+    broker.stop()
+    thread.join(5)
+
+
+def test_recover_all_skips_the_broker_recording(broker, tmp_path):
+    client = BrokerClient(broker.address)
+    try:
+        path = client.request('record', str(tmp_path), 'session')
+        assert path and is_recording(path) and not is_complete(path)
+        before = open(path, 'rb').read()
+        # a second window started on the same directory
+        assert recover_all(str(tmp_path)) == []
+        assert open(path, 'rb').read() == before
+    finally:
+        client.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_state_packs_nan_equal():
+    state = dict.fromkeys(FIELDS, 0.0)
+    state['level'] = float('nan')
+    other = dict(state, level=-float('nan'))  # another NaN bit pattern
+    assert pack_state(state) == pack_state(other)
+    assert math.isnan(unpack_state(pack_state(state))['level'])
+
+
+def test_state_is_only_sent_when_it_changes(broker):
+    states = []
+    client = BrokerClient(broker.address, on_state=states.append)
+    try:
+        time.sleep(0.3)  # some 60 broker steps with no level yet
+        assert 1 <= len(states) <= 2
+        assert states[-1]['status'] == STATUSES.index(WAITING) and math.isnan(states[-1]['level'])
+    finally:
+        client.close()
+
+
+def test_subscribe_and_command_round_trip(broker):
+    states, batches = [], []
+    client = BrokerClient(broker.address, on_state=states.append, on_samples=lambda *batch: batches.append(batch))
+    try:
+        assert client.request('start') is True
+        assert wait_for(lambda: states and states[-1]['status'] == STATUSES.index(ACQUIRING))
+        assert wait_for(lambda: sum(len(b[0]) for b in batches) >= 40)
+        times = np.concatenate([b[0] for b in list(batches)])
+        assert np.all(np.diff(times) > 0)
+        assert client.request('outcome')['samples'] > 0
+    finally:
+        client.close()
+
+
+def test_failing_command_only_fails_for_its_subscriber(broker, monkeypatch):
+    def unplugged(station):
+        raise serial.SerialException("device disconnected")
+
+    monkeypatch.setitem(process_station.COMMANDS, 'calibrate', unplugged)
+    first, second = BrokerClient(broker.address), BrokerClient(broker.address)
+    try:
+        with pytest.raises(OSError, match='device disconnected'):
+            first.request('calibrate')
+        assert second.request('outcome') is not None
+        assert first.request('outcome') is not None  # and the one that failed is still served
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from calibration import CANCELLED, DONE, RUNNING, Calibrator
+
+
+def test_finishes_early_once_converged_with_the_margins():
+    calibrator = Calibrator()
+    calibrator.start(100.0)
+    rng = np.random.default_rng(0)
+    values = 650000 + rng.normal(0, 2, 80 * 10)
+    times = 100.0 + np.arange(len(values)) / 80
+    for start in range(0, len(values), 8):
+        calibrator.feed(times[start:start + 8], values[start:start + 8])
+        if not calibrator.running:
+            break
+    assert calibrator.state == DONE and calibrator.progress == 1.0
+    assert calibrator.min_duration <= calibrator.elapsed < calibrator.max_duration
+    mean = values[:calibrator.count].mean()
+    assert calibrator.mean == pytest.approx(mean, abs=1e-6)
+    threshold, high, punc = calibrator.thresholds()
+    assert threshold == pytest.approx(mean * (1 - calibrator.low_margin))
+    assert high == pytest.approx(mean * (1 + calibrator.high_margin))
+    assert punc == pytest.approx(mean * (1 - calibrator.punc_margin))
+
+
+def test_minimum_duration_and_samples():
+    calibrator = Calibrator()
+    calibrator.start(0.0)
+    calibrator.feed(np.arange(100) / 100, np.full(100, 650000))  # converged, but only 1 s in
+    assert calibrator.state == RUNNING and calibrator.thresholds() is None
+    assert calibrator.progress == pytest.approx(0.099)
+    calibrator.feed([2.0], [650000])
+    assert calibrator.state == DONE
+
+
+def test_silent_device_times_out_without_thresholds():
+    calibrator = Calibrator()
+    calibrator.start(0.0)
+    calibrator.check(5.0)
+    assert calibrator.running and calibrator.progress == 0.5
+    calibrator.check(calibrator.max_duration)
+    assert calibrator.state == DONE and calibrator.count == 0
+    assert calibrator.thresholds() is None
+
+
+def test_noisy_signal_runs_to_max_duration():
+    calibrator = Calibrator()
+    calibrator.start(0.0)
+    rng = np.random.default_rng(1)
+    for second in range(10):
+        times = second + np.arange(10) / 10
+        calibrator.feed(times, 650000 + rng.normal(0, 5000, 10))
+    assert calibrator.running
+    calibrator.check(10.0)
+    assert calibrator.state == DONE and calibrator.thresholds() is not None
+
+
+def test_cancel():
+    calibrator = Calibrator()
+    calibrator.start(0.0)
+    calibrator.feed([0.5], [650000])
+    calibrator.cancel()
+    assert calibrator.state == CANCELLED and calibrator.thresholds() is None
+    calibrator.feed([3.0], [650000])  # late samples change nothing
+    assert calibrator.count == 1
@@ -0,0 +1,124 @@
+import threading
+from types import SimpleNamespace
+
+import serial
+import serial.tools.list_ports
+
+import connection
+from connection import ConnectionManager
+from simulator import SimulatedDevice
+
+URL = 'sim://?rate=1000&seed=1'
+
+
+def port_info(device, vid, pid=1, serial_number=None, description=''):
+    return SimpleNamespace(device=device, vid=vid, pid=pid, serial_number=serial_number, description=description)
+
+
+class WrongBaudDevice(SimulatedDevice):
+    # a sketch running at `sketch_baudrate`: any other rate only reads garbage
+    def __init__(self, sketch_baudrate, **kwargs):
+        super().__init__(rate=1000, seed=1, **kwargs)
+        self.sketch_baudrate = sketch_baudrate
+
+    def readline(self):
+        line = super().readline()
+        return line if self.baudrate == self.sketch_baudrate else b'\xf0\x8f\x00\xff\r\n'
+
+
+def test_connect_opens_the_url_once():
+    manager = ConnectionManager(url=URL)
+    port = manager.connect()
+    assert isinstance(port, SimulatedDevice) and manager.is_open()
+    assert manager.detected_baudrate == connection.BAUD_RATE
+    assert manager.connect() is port
+    manager.flush()
+    manager.close()
+    assert not manager.is_open() and manager.port is None
+
+
+def test_baud_rate_fallback(monkeypatch):
+    monkeypatch.setattr(connection, 'open_url', lambda url, baudrate, timeout: WrongBaudDevice(9600, baudrate=baudrate))
+    manager = ConnectionManager(url=URL)
+    port = manager.connect()
+    assert manager.detected_baudrate == 9600 and port.baudrate == 9600
+
+
+def test_no_readings_at_any_baud_rate(monkeypatch):
+    monkeypatch.setattr(connection, 'open_url', lambda url, baudrate, timeout: WrongBaudDevice(300, baudrate=baudrate))
+    manager = ConnectionManager(url=URL)
+    port = manager.connect()
+    assert manager.detected_baudrate is None and port.baudrate == connection.BAUD_RATE
+
+
+def test_discovery_prefers_the_board_it_talked_to(monkeypatch):
+    ports = [
+        port_info('/dev/ttyS0', None, None, description='Arduino Uno (COM3)'),
+        port_info('/dev/ttyUSB0', 0x0403, 0x6001, 'B'),
+        port_info('/dev/ttyACM1', 0x2341, 0x0043, 'A2'),
+        port_info('/dev/ttyACM0', 0x2341, 0x0042, 'A1'),
+    ]
+    monkeypatch.setattr(serial.tools.list_ports, 'comports', lambda: ports)
+    manager = ConnectionManager()
+    assert manager.discover().device == '/dev/ttyUSB0'  # first known VID
+    manager.device = (0x2341, 0x0042, 'A1')
+    assert manager.discover().device == '/dev/ttyACM0'  # same serial number
+    manager.device = (0x2341, 0x0043, 'A3')
+    assert manager.discover().device == '/dev/ttyACM1'  # same kind of board
+    monkeypatch.setattr(serial.tools.list_ports, 'comports', lambda: ports[:1])
+    assert manager.discover().device == '/dev/ttyS0'  # description only
+    monkeypatch.setattr(serial.tools.list_ports, 'comports', lambda: [port_info('/dev/ttyS1', 0x1234)])
+    assert manager.discover() is None and manager.connect() is None
+    assert connection.discover_ports() == []
+
+
+def test_connect_remembers_the_discovered_board(monkeypatch):
+    monkeypatch.setattr(serial.tools.list_ports, 'comports', lambda: [port_info('/dev/ttyACM0', 0x2341, 0x0042, 'A1')])
+    monkeypatch.setattr(serial, 'Serial', lambda device, baudrate, timeout: SimulatedDevice(
+        rate=1000, port=device, baudrate=baudrate, timeout=timeout, seed=1))
+    manager = ConnectionManager()
+    assert manager.connect().port == '/dev/ttyACM0'
+    assert manager.device == (0x2341, 0x0042, 'A1')
+    assert manager.detected_baudrate == connection.BAUD_RATE
+
+
+def test_reconnect_after_a_disconnect(monkeypatch):
+    opened = []
+    failures = [OSError("port busy")]
+
+    def open_url(url, baudrate, timeout):
+        if len(opened) == 1 and failures:
+            raise failures.pop()
+        opened.append(SimulatedDevice.from_url(url, baudrate=baudrate, timeout=timeout))
+        return opened[-1]
+
+    monkeypatch.setattr(connection, 'open_url', open_url)
+    connected = threading.Event()
+    manager = ConnectionManager(url=URL + '&disconnect_after=0.2', backoff_start=0.01,
+                                on_connect=lambda port: connected.set())
+    first = manager.connect()
+    try:
+        while True:
+            first.readline()
+    except serial.SerialException:
+        pass
+    manager.reconnect()
+    manager.reconnect()  # already running
+    assert connected.wait(5)
+    assert manager.reconnects == 1 and not failures
+    assert len(opened) == 2 and manager.port is opened[1] and manager.is_open()
+    assert not first.is_open
+    manager.close()
+
+
+def test_close_stops_a_pending_reconnect(monkeypatch):
+    def open_url(url, baudrate, timeout):
+        raise OSError("unplugged")
+
+    monkeypatch.setattr(connection, 'open_url', open_url)
+    manager = ConnectionManager(url=URL, backoff_start=0.01, backoff_max=0.02)
+    manager.reconnect()
+    thread = manager._reconnect_thread
+    manager.close()
+    thread.join(5)
+    assert not thread.is_alive() and manager.reconnects == 0
@@ -0,0 +1,132 @@
+import base64
+import json
+import os
+import socket
+import struct
+import time
+
+import numpy as np
+import pytest
+
+import dashboard
+from dashboard import CLOSE, PING, PONG, TEXT, Dashboard, StationFeed, accept_key, read_ws_frame, ws_frame
+
+
+class StubClient:
+    # stands in for the BrokerClient, the test calls the feed's handlers itself
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def stub_broker(monkeypatch):
+    monkeypatch.setattr(dashboard, 'BrokerClient', StubClient)
+
+
+def client_frame(payload, opcode=TEXT):
+    # a masked frame, as browsers send them
+    mask = os.urandom(4)
+    size = len(payload)
+    if size < 126:
+        header = struct.pack('!BB', 0x80 | opcode, 0x80 | size)
+    elif size < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, size)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, size)
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, n):
+        chunk, self.data = self.data[:n], self.data[n:]
+        return chunk
+
+
+def test_accept_key():
+    # the example of RFC 6455
+    assert accept_key('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+@pytest.mark.parametrize('size', [0, 5, 125, 126, 200, 65535, 70000])
+def test_frames_round_trip(size):
+    payload = os.urandom(size)
+    assert read_ws_frame(Reader(ws_frame(payload, PONG))) == (PONG, payload)  # unmasked, server side
+    assert read_ws_frame(Reader(client_frame(payload))) == (TEXT, payload)
+    with pytest.raises(EOFError):
+        read_ws_frame(Reader(b''))
+
+
+def connect(dash):
+    host, port = dash.server.server_address
+    sock = socket.create_connection((host, port), timeout=5)
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall(f'GET /ws HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                 f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'.encode())
+    rfile = sock.makefile('rb')
+    status = rfile.readline()
+    headers = {}
+    for line in iter(rfile.readline, b'\r\n'):
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+    assert status.split()[1] == b'101'
+    assert headers['sec-websocket-accept'] == accept_key(key)
+    return sock, rfile
+
+
+def test_handshake_ping_and_close(stub_broker):
+    dash = Dashboard([], '127.0.0.1:0', frame_interval=0.02).start()
+    try:
+        sock, rfile = connect(dash)
+        opcode, payload = read_ws_frame(rfile)
+        assert opcode == TEXT and json.loads(payload) == {'window': 60, 'stations': []}
+        sock.sendall(client_frame(b'hi', PING))
+        assert read_ws_frame(rfile) == (PONG, b'hi')
+        sock.sendall(client_frame(struct.pack('!H', 1000), CLOSE))
+        assert read_ws_frame(rfile) == (CLOSE, struct.pack('!H', 1000))
+        sock.close()
+    finally:
+        dash.close()
+
+
+def batch(start, n):
+    times = np.arange(start, start + n) / 10
+    return times, np.arange(start, start + n), np.zeros(n, dtype=bool)
+
+
+def test_snapshot_stops_where_the_next_frame_starts(stub_broker):
+    feed = StationFeed(0, 'a', 'unused', window=60)
+    feed.on_decimated(*batch(0, 20))
+    assert feed.take()['v'] == list(range(20))
+    feed.on_decimated(*batch(20, 10))  # not sent to anyone yet
+    snapshot = feed.snapshot()
+    assert snapshot['v'] == list(range(20))
+    assert snapshot['v'] + feed.take()['v'] == list(range(30))
+
+
+def test_late_viewer_gets_every_point_once(stub_broker):
+    dash = Dashboard(['a=unused'], '127.0.0.1:0', frame_interval=0.05).start()
+    feed = dash.feeds[0]
+    try:
+        feed.on_decimated(*batch(0, 20))
+        time.sleep(0.2)  # taken by a frame nobody watched
+        feed.on_decimated(*batch(20, 10))
+        sock, rfile = connect(dash)
+        values = []
+        sock.settimeout(0.5)  # some frame intervals with nothing new end it
+        try:
+            while True:
+                opcode, payload = read_ws_frame(rfile)
+                for station in json.loads(payload)['stations']:
+                    values += station.get('v', [])
+        except (socket.timeout, EOFError):
+            pass
+        assert values == list(range(30))
+        sock.close()
+    finally:
+        dash.close()
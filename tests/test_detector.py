@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from detector import EventDetector, PLATEAU, PUNCTURE, TOUCH
+
+from helpers import chunks, session_signal
+
+RATE = 20  # the rolling window follows the simulated puncture too closely at higher rates
+
+
+def run(times, values, bounds):
+    detector = EventDetector()
+    events, masks, thresholds = [], [], []
+    for start, end in bounds:
+        result = detector.process(times[start:end], values[start:end])
+        events += [(e.time, e.kind, e.value) for e in result.events]
+        masks.append(result.puncture_mask)
+        thresholds.append(np.vstack((result.threshold, result.high_threshold, result.punc_threshold)))
+    return events, np.concatenate(masks), np.hstack(thresholds), detector
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_batches_give_the_same_result_as_the_whole_array(seed):
+    times, values = session_signal(rate=RATE, seed=seed)
+    whole = run(times, values, [(0, len(values))])
+    batched = run(times, values, chunks(len(values), seed=seed))
+    assert batched[0] == whole[0]
+    assert np.array_equal(batched[1], whole[1])
+    assert np.array_equal(batched[2], whole[2])
+    assert batched[3].dip_count == whole[3].dip_count
+    kinds = {kind for _, kind, _ in whole[0]}
+    assert {TOUCH, PUNCTURE, PLATEAU} <= kinds  # the script really went through the states
+
+
+def test_sample_by_sample_gives_the_same_result():
+    times, values = session_signal(seconds=40, rate=RATE)
+    whole = run(times, values, [(0, len(values))])
+    single = run(times, values, [(i, i + 1) for i in range(len(values))])
+    assert single[0] == whole[0]
+    assert np.array_equal(single[1], whole[1])
+    assert np.array_equal(single[2], whole[2])
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from filters import FilterChain, filter_signal
+
+from helpers import chunks, session_signal
+
+SPEC = 'rate:80,median:5,notch:50,lowpass:10'
+
+
+@pytest.mark.parametrize('spec', [SPEC, 'median:5', 'lowpass:10:4', 'notch:50:20'])
+def test_chunks_give_the_same_output_as_the_whole_signal(spec):
+    _, values = session_signal(seconds=60, noise=40, mains=30)
+    values[::97] += 5000  # spikes for the median stage
+    whole = filter_signal(values, spec)
+    chain = FilterChain(spec)
+    chunked = np.concatenate([chain.process(values[start:end]) for start, end in chunks(len(values))])
+    assert np.array_equal(chunked, whole)
+
+
+def test_reset_starts_over():
+    _, values = session_signal(seconds=10, noise=40)
+    chain = FilterChain(SPEC)
+    first = chain.process(values)
+    chain.reset()
+    assert np.array_equal(chain.process(values), first)
+
+
+def test_filter_reduces_noise():
+    _, values = session_signal(seconds=10, noise=40, mains=30, events=())
+    assert np.std(filter_signal(values, SPEC)[80:]) < np.std(values) / 1.5
+
+
+@pytest.mark.parametrize('spec', ['rate', 'rate:', 'rate:0,notch:50', 'rate:-80', 'rate:nan,lowpass:10', 'lowpass',
+                                  'lowpass:50', 'bandpass:3'])
+def test_bad_spec(spec):
+    with pytest.raises(ValueError, match='bad filter spec'):
+        FilterChain(spec)
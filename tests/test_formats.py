@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+
+from formats import available_formats, export_session, load_session
+from pipeline import Pipeline
+from session import THRESHOLD_NAMES, SessionBuffer
+
+from helpers import session_signal
+
+
+def measured_session():
+    # two measurements in one session buffer, times start at 0 again in the second
+    pipeline = Pipeline(stop_on_plateau=False)
+    times, values = session_signal(seconds=40, rate=20)
+    for start in range(0, len(times), 64):
+        pipeline.process(times[start:start + 64], values[start:start + 64])
+    pipeline.interrupt()
+    pipeline.process(times[:100], values[:100] + 7)
+    pipeline.session.meta.update({'threshold': 49925.5, 'filter': None})
+    return pipeline.session
+
+
+@pytest.mark.parametrize('fmt', available_formats())
+def test_round_trip(tmp_path, fmt):
+    session = measured_session()
+    assert session.puncture_mask.flags.any()
+    paths = export_session(session, str(tmp_path / 'session'), fmt)
+    loaded = load_session(paths[0])
+    assert np.array_equal(loaded.samples.times, session.samples.times)
+    assert np.array_equal(loaded.samples.values, session.samples.values)
+    assert np.array_equal(loaded.puncture.times, session.puncture.times)
+    assert np.array_equal(loaded.puncture.values, session.puncture.values)
+    assert len(session.thresholds['threshold']) > 0
+    for name in THRESHOLD_NAMES:
+        assert np.array_equal(loaded.thresholds[name].times, session.thresholds[name].times)
+        assert np.array_equal(loaded.thresholds[name].values, session.thresholds[name].values)
+    if fmt == 'csv':
+        assert len(paths) == 2 and len(load_session(paths[1]).samples) == len(session.samples)
+        return  # only samples, the puncture series and the thresholds
+    assert np.array_equal(loaded.puncture_mask.flags, session.puncture_mask.flags)
+    assert [(e.time, e.kind, e.value) for e in loaded.events] == [(e.time, e.kind, e.value) for e in session.events]
+    assert loaded.meta == session.meta
+
+
+@pytest.mark.parametrize('fmt', available_formats())
+def test_session_without_thresholds(tmp_path, fmt):
+    session = SessionBuffer()
+    session.add_samples(np.arange(5) / 80, np.arange(5), np.zeros(5, dtype=bool))
+    paths = export_session(session, str(tmp_path / 'session'), fmt)
+    loaded = load_session(paths[0])
+    assert len(loaded.samples) == 5
+    assert all(len(loaded.thresholds[name]) == 0 for name in THRESHOLD_NAMES)
+
+
+def test_export_from_before_the_thresholds_table(tmp_path):
+    session = measured_session()
+    base = str(tmp_path / 'session')
+    with np.load(export_session(session, base, 'npz')[0]) as data:
+        np.savez(base + '.old.npz', **{name: data[name] for name in data.files if not name.startswith('thresholds_')})
+    assert len(load_session(base + '.old.npz').thresholds['threshold']) == 0
+    paths = export_session(session, base, 'csv')
+    os.remove(paths[1])
+    assert len(load_session(paths[0]).thresholds['threshold']) == 0
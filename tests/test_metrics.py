@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from metrics import GREAT_SECONDS, OutcomeMetrics, verdict
+from pipeline import Pipeline
+
+from helpers import chunks, session_signal
+
+
+def run(times, values, bounds):
+    pipeline = Pipeline(stop_on_plateau=False)
+    for start, end in bounds:
+        pipeline.process(times[start:end], values[start:end])
+    return pipeline
+
+
+def thresholds(n, level=0.0):
+    return tuple(np.full(n, level) for _ in range(3))
+
+
+def test_batches_give_the_same_outcome_as_one_pass():
+    times, values = session_signal(seconds=80, rate=20)
+    whole = run(times, values, [(0, len(values))]).metrics.summary()
+    batched = run(times, values, chunks(len(values))).metrics.summary()
+    assert whole['punctures'] > 0 and whole['puncture_to_min'] is not None
+    assert batched == pytest.approx(whole)
+
+
+def test_puncture_to_min_matches_the_session():
+    # what Stop used to compute from the puncture series of the session
+    times, values = session_signal(seconds=40, rate=20)
+    pipeline = run(times, values, chunks(len(values), seed=3))
+    puncture = pipeline.session.puncture
+    baseline = puncture.times[np.argmin(puncture.values)] - puncture.times[0]
+    assert pipeline.metrics.puncture_to_min == baseline
+
+
+def test_first_of_equal_minima_counts():
+    metrics = OutcomeMetrics()
+    metrics.update([0, 1, 2, 3], [50, 40, 45, 40], [False, True, True, True], thresholds(4))
+    metrics.update([4, 5], [40, 41], [True, True], thresholds(2))
+    assert (metrics.min_value, metrics.min_time, metrics.puncture_start) == (40, 1.0, 1.0)
+    assert metrics.puncture_to_min == 0.0
+    metrics.update([6, 7], [39, 39], [False, True], thresholds(2))  # lower, but not in puncture state
+    assert metrics.min_time == 7.0 and metrics.puncture_to_min == 6.0
+
+
+def test_no_puncture():
+    metrics = OutcomeMetrics()
+    metrics.update(np.arange(10.0), np.full(10, 100), np.zeros(10, dtype=bool), thresholds(10, 50.0))
+    summary = metrics.summary()
+    assert summary['puncture_to_min'] is None and summary['great'] is None
+    assert summary['longest_stable_run'] == 10 and summary['duration'] == 9.0
+    assert verdict(summary) == 'No puncture detected'
+
+
+def test_verdict():
+    assert verdict(None) == 'No puncture detected'  # the station did not answer
+    assert verdict({}) == 'No puncture detected'
+    assert verdict({'puncture_to_min': GREAT_SECONDS + 1, 'great': True}) == 'Great blood drawing!!!'
+    assert verdict({'puncture_to_min': GREAT_SECONDS, 'great': False}) == 'Try again'
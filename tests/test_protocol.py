@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from protocol import BinaryFrameDecoder, SYNC, encode_frames
+
+
+def noisy_stream(frames=5000, insertions=50, seed=0):
+    # valid frames with runs of garbage, some with sync bytes, in between
+    rng = np.random.default_rng(seed)
+    seq = np.arange(frames)
+    reading = rng.integers(-(1 << 23), 1 << 23, frames)
+    encoded = np.frombuffer(encode_frames(seq, reading, seq * 12500), dtype=np.uint8).reshape(frames, -1)
+    at = np.sort(rng.choice(np.arange(1, frames), insertions, replace=False))
+    parts, previous = [], 0
+    for i in at:
+        parts.append(encoded[previous:i].tobytes())
+        garbage = rng.integers(0, 256, rng.integers(1, 20), dtype=np.uint8)
+        garbage[0] = SYNC
+        parts.append(garbage.tobytes())
+        previous = i
+    parts.append(encoded[previous:].tobytes())
+    return b''.join(parts), reading
+
+
+def decode(stream, chunk_size):
+    decoder = BinaryFrameDecoder()
+    frames = [decoder.feed(stream[i:i + chunk_size]) for i in range(0, len(stream), chunk_size)]
+    return decoder, np.concatenate(frames)
+
+
+def test_round_trip():
+    stream, reading = noisy_stream(frames=500, insertions=0)
+    decoder, frames = decode(stream, 4096)
+    assert np.array_equal(frames['reading'], reading)
+    assert np.array_equal(frames['seq'], np.arange(500))
+    assert (decoder.resyncs, decoder.skipped_bytes, decoder.bad_frames) == (0, 0, 0)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 11, 64, 4096])
+def test_chunk_size_does_not_change_the_counters(chunk_size):
+    stream, _ = noisy_stream()
+    whole, expected = decode(stream, len(stream))
+    decoder, frames = decode(stream, chunk_size)
+    assert np.array_equal(frames, expected)
+    assert decoder.frames == whole.frames
+    assert decoder.resyncs == whole.resyncs == 50
+    assert decoder.skipped_bytes == whole.skipped_bytes
+    assert decoder.bad_frames == whole.bad_frames
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from helpers import chunks
+from pyramid import MinMaxPyramid, interleave
+from session import SampleSeries
+
+
+def random_walk(n, seed=0, dtype=np.float64):
+    rng = np.random.default_rng(seed)
+    values = np.cumsum(rng.normal(0, 10, n))
+    return np.arange(n) / 80, values.astype(dtype)
+
+
+def grown(times, values, seed=0):
+    series = SampleSeries(values.dtype)
+    pyramid = MinMaxPyramid(series)
+    for start, end in chunks(len(values), seed=seed, largest=2000):
+        series.extend(times[start:end], values[start:end])
+        pyramid.update()
+    return pyramid
+
+
+def check_query(pyramid, times, values, t0, t1, pixels):
+    out_t, out_v = pyramid.query(t0, t1, pixels)
+    assert len(out_t) == len(out_v) <= 4 * pixels + 4
+    assert np.all(np.diff(out_t) >= 0)
+    assert np.all((out_t >= t0) & (out_t <= t1))
+    visible = (times >= t0) & (times <= t1)
+    i, j = np.argmin(values[visible]), np.argmax(values[visible])
+    assert out_v.min() == values[visible][i] and out_v.max() == values[visible][j]
+    assert times[visible][i] in out_t[out_v == out_v.min()]
+    assert times[visible][j] in out_t[out_v == out_v.max()]
+    # every point drawn is a real sample
+    index = np.searchsorted(times, out_t)
+    assert np.array_equal(values[index], out_v)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.int64])
+def test_query_keeps_the_extremes_of_the_visible_span(dtype):
+    times, values = random_walk(100_000, dtype=dtype)
+    pyramid = grown(times, values)
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        t0, t1 = np.sort(rng.uniform(0, times[-1], 2))
+        check_query(pyramid, times, values, t0, t1, int(rng.integers(50, 1000)))
+    check_query(pyramid, times, values, 0, times[-1], 800)
+
+
+def test_query_includes_samples_not_folded_yet():
+    times, values = random_walk(50_000, seed=2)
+    series = SampleSeries(np.float64)
+    pyramid = MinMaxPyramid(series)
+    series.extend(times[:40_000], values[:40_000])
+    pyramid.update()
+    series.extend(times[40_000:], values[40_000:])  # no update()
+    values[45_000] = values.max() + 1
+    series.values[45_000] = values[45_000]
+    check_query(pyramid, times, values, 0, times[-1], 300)
+    check_query(pyramid, times, values, times[39_990], times[-1], 100)
+
+
+def test_few_samples_are_returned_raw():
+    times, values = random_walk(1000)
+    pyramid = grown(times, values)
+    out_t, out_v = pyramid.query(times[100], times[299], 100)
+    assert np.array_equal(out_t, times[100:300]) and np.array_equal(out_v, values[100:300])
+    assert len(pyramid.query(-2, -1, 100)[0]) == 0
+
+
+def test_offset():
+    times, values = random_walk(20_000)
+    series = SampleSeries(np.float64)
+    series.extend(times, values)
+    pyramid = MinMaxPyramid(series, offset=5000)
+    pyramid.update()
+    assert len(pyramid) == 15_000
+    check_query(pyramid, times[5000:], values[5000:], times[5000], times[-1], 200)
+    assert pyramid.query(0, times[4999], 200)[0].size == 0
+
+
+def test_interleave_orders_each_bucket():
+    times, values = interleave(np.array([1.0, 4.0]), np.array([-1, -4]), np.array([0.0, 5.0]), np.array([9, 8]))
+    assert times.tolist() == [0.0, 1.0, 4.0, 5.0] and values.tolist() == [9, -1, -4, 8]
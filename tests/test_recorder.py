@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from recorder import (CHUNK_HEADER, LOCK_SUFFIX, SessionRecorder, is_complete, is_recording, read_index,
+                      read_recording, recover, recover_all)
+from session import Event
+
+
+def record(path, batches=10, size=100):
+    recorder = SessionRecorder(str(path)).start()
+    times = np.arange(batches * size) / 80
+    values = np.arange(batches * size, dtype=np.int64)
+    for start in range(0, len(times), size):
+        recorder.append_samples(times[start:start + size], values[start:start + size])
+        recorder.append_puncture(times[start:start + 10], values[start:start + 10])
+        recorder.flush()  # one chunk per batch
+    recorder.append_events([Event(1.0, 'touch', 5)])
+    recorder.write_meta(threshold=49000.0)
+    recorder.close()
+    return times, values
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 's.rec'
+    times, values = record(path)
+    assert is_complete(str(path))
+    session = read_recording(str(path))
+    assert np.array_equal(session.samples.times, times)
+    assert np.array_equal(session.samples.values, values)
+    assert len(session.puncture) == 100
+    assert [(e.time, e.kind, e.value) for e in session.events] == [(1.0, 'touch', 5)]
+    assert session.meta == {'threshold': 49000.0}
+
+
+def test_recover_truncated_recording(tmp_path):
+    path = tmp_path / 's.rec'
+    times, values = record(path)
+    index = read_index(str(path))
+    # cut the file in the middle of the sixth samples chunk, as a crash would
+    offsets = [offset for offset, kind, *_ in index if kind == 1]
+    with open(path, 'r+b') as f:
+        f.truncate(offsets[5] + 40)
+    assert not is_complete(str(path))
+
+    dropped = recover(str(path))
+    assert dropped == 40
+    assert is_complete(str(path))
+    session = read_recording(str(path))
+    assert np.array_equal(session.samples.times, times[:500])
+    assert np.array_equal(session.samples.values, values[:500])
+    assert np.array_equal(session.puncture_mask.flags, np.isin(np.arange(500) % 100, np.arange(10)))
+    assert len(read_index(str(path))) == 5 * 2 + 1  # five samples and puncture chunks, then END
+    assert os.path.getsize(path) == offsets[5] + CHUNK_HEADER.size
+
+
+def test_recover_all_leaves_recordings_being_written_alone(tmp_path):
+    crashed = tmp_path / 'crashed.rec'
+    record(crashed)
+    with open(crashed, 'r+b') as f:
+        f.truncate(os.path.getsize(crashed) - 30)
+    with open(str(crashed) + LOCK_SUFFIX, 'w') as f:
+        f.write('12345\n')  # the lock file of a writer that died, nobody holds it
+
+    live = tmp_path / 'live.rec'
+    recorder = SessionRecorder(str(live)).start()
+    try:
+        recorder.append_samples(np.arange(100) / 80, np.arange(100))
+        recorder.flush()
+        assert is_recording(str(live)) and not is_recording(str(crashed))
+        with pytest.raises(OSError):
+            SessionRecorder(str(live)).start()  # a second writer would truncate it
+        before = live.read_bytes()
+
+        assert recover_all(str(tmp_path)) == [str(crashed)]
+        assert live.read_bytes() == before  # no END chunk, nothing cut
+        assert not os.path.exists(str(crashed) + LOCK_SUFFIX)
+
+        recorder.append_samples(np.arange(100, 200) / 80, np.arange(100, 200))
+    finally:
+        recorder.close()
+    assert not is_recording(str(live)) and is_complete(str(live))
+    assert np.array_equal(read_recording(str(live)).samples.values, np.arange(200))
+    assert recover_all(str(tmp_path)) == []
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from helpers import chunks, session_signal
+from rolling import RollingStats
+
+WINDOW = 64
+
+
+def reference_window(values, end):
+    return values[max(0, end - WINDOW):end]
+
+
+def check(stats, values, end):
+    window = reference_window(values, end)
+    assert len(stats) == len(window)
+    assert stats.mean == pytest.approx(window.mean(), rel=1e-12)
+    assert stats.std == pytest.approx(window.std(), rel=1e-6, abs=1e-6)
+    assert stats.median() == pytest.approx(np.median(window))
+    assert stats.mad() == pytest.approx(np.median(np.abs(window - np.median(window))))
+
+
+def test_push_matches_the_window():
+    _, values = session_signal(seconds=20)
+    stats = RollingStats(WINDOW, track_median=True)
+    for end, x in enumerate(values, 1):
+        stats.push(x)
+        if end % 7 == 0 or end in (1, WINDOW - 1, WINDOW, WINDOW + 1):
+            check(stats, values, end)
+    assert stats.full
+
+
+def test_update_means_match_push():
+    _, values = session_signal(seconds=20)
+    pushed = RollingStats(WINDOW)
+    expected = []
+    for x in values:
+        pushed.push(x)
+        expected.append(pushed.mean if pushed.full else np.nan)
+    batched = RollingStats(WINDOW)
+    means = np.concatenate([batched.update(values[start:end]) for start, end in chunks(len(values), largest=3 * WINDOW)])
+    np.testing.assert_allclose(means, expected, rtol=1e-12)
+    assert batched.mean == pytest.approx(pushed.mean, rel=1e-12)
+    assert batched.std == pytest.approx(pushed.std, rel=1e-6)
+
+
+def test_mixed_push_and_update_across_the_window_boundary():
+    _, values = session_signal(seconds=20, seed=3)
+    stats = RollingStats(WINDOW, ema_alpha=0.1, track_median=True)
+    ema = None
+    end = 0
+    for i, (start, stop) in enumerate(chunks(len(values), seed=1, largest=2 * WINDOW)):
+        if i % 2:
+            for x in values[start:stop]:
+                stats.push(x)
+        else:
+            stats.update(values[start:stop])
+        for x in values[start:stop].tolist():
+            ema = x if ema is None else ema + 0.1 * (x - ema)
+        end = stop
+        check(stats, values, end)
+        assert stats.ema == pytest.approx(ema)
+    assert end == len(values)
+
+
+def test_update_is_nan_until_the_window_fills():
+    stats = RollingStats(4)
+    means = stats.update([1, 2, 3])
+    assert np.isnan(means).all() and not stats.full
+    np.testing.assert_allclose(stats.update([4, 5]), [2.5, 3.5])
+    assert np.isnan(stats.median())  # not tracked
+    assert len(RollingStats(4).update([])) == 0
@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+
+from detector import TOUCH
+from session import Event
+from shared_ring import SharedRing
+
+
+def test_reader_sees_whole_batches_only():
+    total = 200000
+    writer = SharedRing.create(('published',), capacity=1 << 18)  # room for all of it, whatever the scheduling
+    reader = SharedRing.attach(writer.name, ('published',))
+
+    def write():
+        for start in range(0, total, 100):
+            index = np.arange(start, start + 100)
+            writer.publish(index / 80, index, index % 2 == 0, [Event(start / 80, TOUCH, start)],
+                           published=start + 100)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    values, events = [], []
+    while True:
+        done = not thread.is_alive()
+        _, v, puncture, e, state = reader.read()
+        # the state is always that of the last batch read
+        assert state['published'] == reader.tail or (reader.tail == 0 and np.isnan(state['published']))
+        assert np.array_equal(puncture, v % 2 == 0)
+        values.append(v)
+        events += e
+        if done:
+            break
+    thread.join()
+    assert np.array_equal(np.concatenate(values), np.arange(total))
+    assert [e.value for e in events] == list(range(0, total, 100))
+    assert reader.overruns == 0
+    reader.close()
+    writer.close()
+
+
+def test_overrun_is_counted():
+    writer = SharedRing.create(('published',), capacity=256)
+    reader = SharedRing.attach(writer.name, ('published',))
+    writer.publish(np.arange(1000) / 80, np.arange(1000), np.zeros(1000, dtype=bool), published=1000)
+    _, values, _, _, _ = reader.read()
+    assert np.array_equal(values, np.arange(744, 1000))
+    assert reader.overruns == 744
+    reader.close()
+    writer.close()
@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+import pytest
+import serial
+
+from protocol import BinaryFrameDecoder, parse_ascii_line, reading_to_value
+from simulator import LoadCellModel, SimulatedDevice
+
+QUIET = 'sim://?rate=1000&noise=0&seed=1'  # baseline 50000 for the first 8 s
+
+
+def read_lines(device, n):
+    return [device.readline() for _ in range(n)]
+
+
+def test_from_url():
+    device = SimulatedDevice.from_url('sim://?rate=500&baseline=1000&noise=2&garbage=0.1&dropout=0.2'
+                                      '&disconnect_after=30&seed=4', baudrate=9600, timeout=0.5)
+    assert device.rate == 500 and device.garbage == 0.1 and device.dropout == 0.2
+    assert device.disconnect_after == 30 and device.baudrate == 9600 and device.timeout == 0.5
+    assert device.model.baseline == 1000 and device.model.noise == 2
+    assert device.port.startswith('sim://') and device.is_open
+
+
+def test_model_script():
+    model = LoadCellModel(noise=0, seed=0)
+    values = model.values([0.0, 8.5, 23.0, 27.0, 48.5])
+    assert values.tolist() == [50000, 49800, 49500, 50000, 49800]  # baseline, touch, puncture, plateau, next period
+
+
+def test_poll_answers_one_reading():
+    device = SimulatedDevice.from_url(QUIET)
+    device.write(b'gg')
+    assert [parse_ascii_line(line) for line in read_lines(device, 2)] == [(None, 50000)] * 2
+    assert device.in_waiting == 0
+
+
+def test_ascii_stream_until_stopped():
+    device = SimulatedDevice.from_url(QUIET)
+    device.write(b's')
+    readings = [parse_ascii_line(line) for line in read_lines(device, 50)]
+    assert readings == [(seq, 50000) for seq in range(50)]
+    device.write(b'x')
+    device.reset_input_buffer()
+    time.sleep(0.02)
+    assert device.in_waiting == 0
+
+
+def test_binary_stream():
+    device = SimulatedDevice.from_url(QUIET)
+    device.write(b'b')
+    frames = BinaryFrameDecoder().feed(device.read(11 * 100))
+    assert frames['seq'].tolist() == list(range(100))
+    assert (reading_to_value(frames['reading']) == 50000).all()
+    assert np.array_equal(frames['device_time'], np.arange(100) * 1000)
+
+
+def test_garbage_and_dropout():
+    device = SimulatedDevice.from_url(QUIET + '&garbage=0.1&dropout=0.1')
+    device.write(b'b')
+    decoder = BinaryFrameDecoder()
+    frames = decoder.feed(device.read(11 * 500))
+    assert decoder.bad_frames > 0 and len(frames) < 480
+    assert frames['seq'][-1] >= 500  # dropped samples still used up their sequence numbers
+    assert (reading_to_value(frames['reading']) == 50000).all()  # only intact frames get through
+    assert np.array_equal(frames['device_time'], frames['seq'].astype(np.uint32) * 1000)
+
+    device = SimulatedDevice.from_url(QUIET + '&garbage=0.1')
+    device.write(b's')
+    lines = read_lines(device, 300)
+    bad = 0
+    for line in lines:
+        try:
+            parse_ascii_line(line)
+        except ValueError:
+            bad += 1
+    assert 0 < bad < 100
+
+
+def test_disconnect():
+    device = SimulatedDevice.from_url(QUIET + '&disconnect_after=0.05')
+    device.write(b's')
+    with pytest.raises(serial.SerialException):
+        while True:
+            device.readline()
+    assert not device.is_open
+    with pytest.raises(serial.SerialException):
+        device.write(b'g')
+
+    device = SimulatedDevice.from_url(QUIET)
+    device.close()
+    with pytest.raises(serial.SerialException):
+        device.in_waiting
+
+
+def test_read_times_out_without_data():
+    device = SimulatedDevice.from_url(QUIET, timeout=0.05)
+    started = time.monotonic()
+    assert device.readline() == b''
+    assert 0.05 <= time.monotonic() - started < 1
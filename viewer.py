@@ -0,0 +1,255 @@
+import argparse
+import os
+import tkinter as tk
+
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+from matplotlib.widgets import SpanSelector
+import numpy as np
+
+from archive import SUFFIX, SessionArchive, write_archive
+from detector import TOUCH, PUNCTURE, PLATEAU
+from formats import load_session
+from pyramid import MinMaxPyramid
+from session import THRESHOLD_NAMES
+
+EVENT_COLORS = {TOUCH: 'tab:orange', PUNCTURE: 'tab:red', PLATEAU: 'tab:green'}
+THRESHOLD_STYLES = {'threshold': ('r', 'Threshold'), 'high_threshold': ('k', 'High Threshold'),
+                    'punc_threshold': ('m', 'Puncture Threshold')}
+
+
+def open_archive(path):
+    # Archives open directly. Any other session file is converted once to
+    # <path>.archive next to it, so the next open is instant too.
+    path = str(path).rstrip('/\\')
+    if path.endswith(SUFFIX):
+        return SessionArchive(path)
+    archive_path = path + SUFFIX
+    if not os.path.isdir(archive_path) or os.path.getmtime(archive_path) < os.path.getmtime(path):
+        write_archive(load_session(path), archive_path)
+    return SessionArchive(archive_path)
+
+
+class SessionViewer:
+    # Read-only view of a recorded session: no port, no detection. The slider
+    # jumps to any second and only that window of samples is read from the
+    # memory mapped archive.
+    def __init__(self, root, path, window=10):
+        self.root = root
+        self.archive = open_archive(path)
+        self.window = window
+        self.root.title(f"Session Viewer - {os.path.basename(str(path).rstrip('/'))}")
+
+        self.fig, self.ax = plt.subplots()
+        self.canvas = FigureCanvasTkAgg(self.fig, master=root)
+        self.canvas.get_tk_widget().pack()
+        self.line, = self.ax.plot([], [])
+        self.ax.set_title("Recorded Data")
+        self.ax.set_xlabel("Time (s)")
+        self.ax.set_ylabel("Value")
+        self.event_lines = []
+        meta = self.archive.meta
+        for key, color, label in (('threshold', 'r', 'Threshold'), ('high_threshold', 'k', 'High Threshold'),
+                                  ('punc_threshold', 'm', 'Puncture Threshold')):
+            if key in meta:
+                self.ax.axhline(y=meta[key], color=color, linestyle='--', label=f'{label}: {meta[key]:.2f}')
+        if meta:
+            self.ax.legend(loc='upper right')
+
+        frame = tk.Frame(root)
+        frame.pack(fill=tk.X)
+        tk.Button(frame, text="<<", command=lambda: self.step(-1)).pack(side=tk.LEFT, padx=10, pady=10)
+        self.position = tk.Scale(frame, from_=0, to=max(0, int(self.archive.duration)), orient=tk.HORIZONTAL,
+                                 resolution=1, showvalue=False, command=self.on_scale)
+        self.position.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        tk.Button(frame, text=">>", command=lambda: self.step(1)).pack(side=tk.LEFT, padx=10, pady=10)
+        self.position_label = tk.Label(root, text='', font=('Courier', 16))
+        self.position_label.pack()
+
+        self.show(0)
+
+    def on_scale(self, value):
+        self.show(float(value))
+
+    def step(self, direction):
+        self.position.set(self.position.get() + direction * self.window)
+
+    def show(self, start):
+        end = start + self.window
+        times, values = self.archive.slice(start, end)
+        self.line.set_data(times, values)
+        self.ax.set_xlim(start, end)
+        if len(values):
+            low, high = float(values.min()), float(values.max())
+            margin = max((high - low) * 0.1, abs(high) * 0.0005, 1)
+            self.ax.set_ylim(low - margin, high + margin)
+        for line in self.event_lines:
+            line.remove()
+        self.event_lines = [self.ax.axvline(e.time, color=EVENT_COLORS.get(e.kind, 'grey'), alpha=0.6)
+                            for e in self.archive.events_between(start, end)]
+        self.position_label.config(text=f'{start:.0f} - {end:.0f} s of {self.archive.duration:.0f} s  '
+                                        f'({len(values)} samples, {len(self.event_lines)} events)')
+        self.canvas.draw_idle()
+
+
+class ReviewWindow:
+    # Post-run review: an overview strip of the whole session and a detail pane
+    # for the span selected on it (drag on the overview, scroll on the detail to
+    # zoom). Both are drawn from MinMaxPyramids, so redrawing costs the same for
+    # any session length. Events and the threshold history are overlaid.
+    # `samples` is anything with times / values (SampleSeries, SessionArchive),
+    # `thresholds` maps THRESHOLD_NAMES to such series.
+    def __init__(self, master, samples, events, thresholds=None, title="Session Review"):
+        self.top = tk.Toplevel(master)
+        self.top.title(title)
+        self.pyramid = MinMaxPyramid(samples)
+        self.pyramid.update()
+        self.events = sorted(events, key=lambda e: e.time)
+        self.event_times = np.array([e.time for e in self.events], dtype=np.float64)
+        self.thresholds = {}
+        for name, series in (thresholds or {}).items():
+            if len(series.values):
+                pyramid = MinMaxPyramid(series)
+                pyramid.update()
+                self.thresholds[name] = pyramid
+        times = samples.times
+        self.start = float(times[0]) if len(times) else 0.0
+        self.end = float(times[-1]) if len(times) else 1.0
+        self.span = (self.start, self.end)
+
+        self.fig = Figure(figsize=(10, 7))
+        overview, detail = self.fig.subplots(2, 1, gridspec_kw={'height_ratios': [1, 4]})
+        self.overview_ax, self.detail_ax = overview, detail
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.top)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+
+        overview.set_title("Whole session (drag to zoom)")
+        overview.set_yticks([])
+        self.overview_line, = overview.plot([], [], linewidth=0.8)
+        self.highlight = overview.axvspan(self.start, self.end, alpha=0.15, color='tab:blue')
+        self.add_events(overview, self.events)
+        detail.set_xlabel("Time (s)")
+        detail.set_ylabel("Value")
+        self.detail_line, = detail.plot([], [])
+        self.threshold_lines = {}
+        for name in THRESHOLD_NAMES:
+            if name in self.thresholds:
+                color, label = THRESHOLD_STYLES[name]
+                self.threshold_lines[name], = detail.plot([], [], color=color, linestyle='--', drawstyle='steps-post',
+                                                          label=label)
+        if self.threshold_lines:
+            detail.legend(loc='upper right')
+        self.detail_events = None
+        self.selector = SpanSelector(overview, self.on_select, 'horizontal', minspan=0.01, useblit=True,
+                                     props=dict(alpha=0.2, facecolor='tab:blue'))
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.canvas.mpl_connect('resize_event', lambda event: self.redraw())
+
+        frame = tk.Frame(self.top)
+        frame.pack()
+        tk.Button(frame, text="Whole Session", command=lambda: self.show(self.start, self.end)).pack(side=tk.LEFT,
+                                                                                                   padx=10, pady=10)
+        tk.Button(frame, text="Zoom In", command=lambda: self.zoom(0.5)).pack(side=tk.LEFT, padx=10, pady=10)
+        tk.Button(frame, text="Zoom Out", command=lambda: self.zoom(2)).pack(side=tk.LEFT, padx=10, pady=10)
+        tk.Button(frame, text="<", command=lambda: self.pan(-0.5)).pack(side=tk.LEFT, padx=10, pady=10)
+        tk.Button(frame, text=">", command=lambda: self.pan(0.5)).pack(side=tk.LEFT, padx=10, pady=10)
+        tk.Button(frame, text="Next Event", command=self.next_event).pack(side=tk.LEFT, padx=10, pady=10)
+        self.span_label = tk.Label(self.top, text='', font=('Courier', 14))
+        self.span_label.pack()
+
+        self.redraw()
+
+    @staticmethod
+    def add_events(ax, events):
+        if not events:
+            return None
+        return ax.vlines([e.time for e in events], 0, 1, transform=ax.get_xaxis_transform(),
+                         colors=[EVENT_COLORS.get(e.kind, 'grey') for e in events], alpha=0.7)
+
+    @staticmethod
+    def fit_y(ax, values):
+        if len(values):
+            low, high = float(np.min(values)), float(np.max(values))
+            margin = max((high - low) * 0.05, 1)
+            ax.set_ylim(low - margin, high + margin)
+
+    def pixels(self, ax):
+        return max(int(ax.bbox.width), 100)
+
+    def redraw(self):
+        times, values = self.pyramid.query(self.start, self.end, self.pixels(self.overview_ax))
+        self.overview_line.set_data(times, values)
+        self.overview_ax.set_xlim(self.start, self.end)
+        self.fit_y(self.overview_ax, values)
+        self.show(*self.span)
+
+    def show(self, t0, t1):
+        length = max(t1 - t0, 0.01)
+        t0 = min(max(t0, self.start), max(self.end - length, self.start))
+        t1 = t0 + length
+        self.span = (t0, t1)
+        times, values = self.pyramid.query(t0, t1, self.pixels(self.detail_ax))
+        self.detail_line.set_data(times, values)
+        self.detail_ax.set_xlim(t0, t1)
+        self.fit_y(self.detail_ax, values)
+        for name, line in self.threshold_lines.items():
+            # include the step in force at t0
+            series = self.thresholds[name].series
+            first = max(int(np.searchsorted(series.times, t0, side='right')) - 1, 0)
+            line.set_data(*self.thresholds[name].query(float(series.times[first]), t1, self.pixels(self.detail_ax)))
+        if self.detail_events is not None:
+            self.detail_events.remove()
+        first, last = np.searchsorted(self.event_times, [t0, t1])
+        self.detail_events = self.add_events(self.detail_ax, self.events[first:last])
+        self.highlight.set_x(t0)
+        self.highlight.set_width(t1 - t0)
+        self.span_label.config(text=f'{t0:.2f} - {t1:.2f} s of {self.end - self.start:.2f} s  '
+                                    f'({last - first} events, {len(values)} points drawn)')
+        self.canvas.draw_idle()
+
+    def on_select(self, t0, t1):
+        if t1 > t0:
+            self.show(t0, t1)
+
+    def zoom(self, factor, center=None):
+        t0, t1 = self.span
+        if center is None:
+            center = (t0 + t1) / 2
+        self.show(center - (center - t0) * factor, center + (t1 - center) * factor)
+
+    def pan(self, fraction):
+        t0, t1 = self.span
+        shift = (t1 - t0) * fraction
+        self.show(t0 + shift, t1 + shift)
+
+    def on_scroll(self, event):
+        if event.inaxes is self.detail_ax and event.xdata is not None:
+            self.zoom(0.8 if event.button == 'up' else 1.25, center=event.xdata)
+
+    def next_event(self):
+        # centres the detail pane on the first event after the current centre
+        t0, t1 = self.span
+        i = int(np.searchsorted(self.event_times, (t0 + t1) / 2, side='right'))
+        if i < len(self.event_times):
+            half = (t1 - t0) / 2
+            self.show(self.event_times[i] - half, self.event_times[i] + half)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Browse a recorded session")
+    parser.add_argument('path', help="a .archive directory or any session file (.rec, .csv, .npz, ...)")
+    parser.add_argument('--window', type=float, default=10, help="seconds shown at once")
+    parser.add_argument('--review', action='store_true', help="open the overview / zoom review instead")
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    if args.review:
+        root.withdraw()
+        session = load_session(args.path)
+        review = ReviewWindow(root, session.samples, session.events, session.thresholds,
+                              title=f"Session Review - {os.path.basename(args.path)}")
+        review.top.protocol('WM_DELETE_WINDOW', root.destroy)
+    else:
+        viewer = SessionViewer(root, args.path, window=args.window)
+    root.mainloop()